@@ -3,10 +3,10 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager
 from config import get_config
-from apscheduler.schedulers.background import BackgroundScheduler
+from .replicas import RoutingSession
 
 # Initialize extensions
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 migrate = Migrate()
 jwt = JWTManager()
 
@@ -18,20 +18,53 @@ def create_app(config_class=None):
     if config_class is None:
         config_class = get_config()
     app.config.from_object(config_class)
+
+    # Engine options have to be complete before db.init_app creates the engine
+    from .pooling import setup_pooling
+    app = setup_pooling(app)
     
     # Initialize extensions
     db.init_app(app)
     migrate.init_app(app, db)
     jwt.init_app(app)
     
+    from .passwords import passwords
+    passwords.init_app(app)
+    
     # Setup security features
     from .security import setup_security
     app = setup_security(app)
+
+    from .profiling import setup_profiling
+    app = setup_profiling(app)
+
+    from .metrics import setup_metrics
+    app = setup_metrics(app)
+
+    from .queries import setup_query_stats
+    app = setup_query_stats(app)
+
+    from .slowlog import slow_query_log
+    slow_query_log.init_app(app)
+
+    from .replicas import setup_replicas
+    app = setup_replicas(app)
     
     # Custom JWT error handler
     @jwt.invalid_token_loader
     def invalid_token_callback(error_string):
         return jsonify({"message": "Invalid token"}), 422
+
+    from .revocation import revocation_list
+    revocation_list.clear()
+
+    @jwt.token_in_blocklist_loader
+    def token_in_blocklist_callback(jwt_header, jwt_payload):
+        return revocation_list.is_revoked(jwt_payload)
+
+    @jwt.revoked_token_loader
+    def revoked_token_callback(jwt_header, jwt_payload):
+        return jsonify({"message": "Token has been revoked"}), 401
     
     # Register blueprints
     from .auth import auth_bp
@@ -43,10 +76,26 @@ def create_app(config_class=None):
     from .profile import profile_bp
     app.register_blueprint(profile_bp, url_prefix='/api')
     
-    # Set up background job to clean up old logs every 1 week
-    from .utils import cleanup_old_logs
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(func=cleanup_old_logs, trigger="interval", weeks=1)
-    scheduler.start()
+    # Warm the in-memory autocomplete index if asked to; otherwise it is built lazily
+    if app.config['FOOD_INDEX_ENABLED'] and app.config['FOOD_INDEX_PRELOAD']:
+        from .food_index import food_index
+        with app.app_context():
+            try:
+                food_index.build(force=True)
+            except Exception:
+                app.logger.exception("Could not preload the food index; it will be built on first use")
+    
+    # Background jobs run in a separate process: `flask jobs run` (see app/jobs.py)
+    from .jobs import jobs_cli
+    app.cli.add_command(jobs_cli)
+
+    from .auth import tokens_cli
+    app.cli.add_command(tokens_cli)
+
+    from .profiling import profile_cli
+    app.cli.add_command(profile_cli)
+
+    from .seed import seed_command
+    app.cli.add_command(seed_command)
     
     return app
@@ -1,12 +1,29 @@
 # filepath: /home/jorge/projects/bytebites-backend/app/auth.py
+import click
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import create_access_token
+from flask.cli import AppGroup
+from flask_limiter.util import get_remote_address
+from flask_jwt_extended import create_access_token, get_jwt, get_jwt_identity, jwt_required
 from . import db
 from .models import User
+from .passwords import PasswordPoolBusy, passwords
+from .ratelimit import auth_limit
+from .security import limiter
+from .revocation import revoke_token, revoke_user_tokens
+from .tokens import (
+    InvalidRefreshToken, issue_refresh_token, revoke_refresh_token,
+    revoke_user_refresh_tokens, rotate_refresh_token
+)
 
 auth_bp = Blueprint('auth', __name__)
 
+@auth_bp.errorhandler(PasswordPoolBusy)
+def password_pool_busy(error):
+    # Shed load instead of queueing more hashing work behind a full pool
+    return jsonify({"message": "Server busy, please retry"}), 503, {'Retry-After': '1'}
+
 @auth_bp.route('/register', methods=['POST'])
+@limiter.limit(auth_limit, key_func=get_remote_address)
 def register():
     data = request.get_json()
     username = data.get('username')
@@ -31,6 +48,7 @@ def register():
     return jsonify({"message": "User created successfully"}), 201
     
 @auth_bp.route('/login', methods=['POST'])
+@limiter.limit(auth_limit, key_func=get_remote_address)
 def login():
     data = request.get_json()
     login_value = data.get('username')
@@ -45,11 +63,62 @@ def login():
         user = User.query.filter_by(username=login_value).first()
 
     if user and user.check_password(password):
+        if passwords.needs_rehash(user.password_hash):
+            # Argon2 parameters changed since this hash was made
+            user.set_password(password)
+            db.session.commit()
         # Convert user ID to string when creating the token
         access_token = create_access_token(identity=str(user.id))
+        refresh_token = issue_refresh_token(user.id)
+        db.session.commit()
         return jsonify({
             "message": "Logged in successfully",
-            "access_token": access_token
+            "access_token": access_token,
+            "refresh_token": refresh_token
         }), 200
     else:
-        return jsonify({"message": "Invalid login or password"}), 401
\ No newline at end of file
+        return jsonify({"message": "Invalid login or password"}), 401
+
+@auth_bp.route('/refresh', methods=['POST'])
+@limiter.limit(auth_limit, key_func=get_remote_address)
+def refresh():
+    """Trade a refresh token for a new access token and the next refresh token."""
+    data = request.get_json(silent=True)
+    token = data.get('refresh_token') if isinstance(data, dict) else None
+    if not isinstance(token, str) or not token:
+        return jsonify({"message": "Missing refresh token"}), 400
+
+    try:
+        user_id, refresh_token = rotate_refresh_token(token)
+    except InvalidRefreshToken:
+        return jsonify({"message": "Invalid refresh token"}), 401
+    return jsonify({
+        "access_token": create_access_token(identity=str(user_id)),
+        "refresh_token": refresh_token
+    }), 200
+
+
+@auth_bp.route('/logout', methods=['POST'])
+@jwt_required()
+def logout():
+    """Revoke the access token used for this request and, if given, its refresh token."""
+    revoke_token(get_jwt())
+    data = request.get_json(silent=True)
+    token = data.get('refresh_token') if isinstance(data, dict) else None
+    if isinstance(token, str) and token:
+        revoke_refresh_token(token, int(get_jwt_identity()))
+    db.session.commit()
+    return jsonify({"message": "Logged out successfully"}), 200
+
+tokens_cli = AppGroup('tokens', help='Revoke access and refresh tokens.')
+
+@tokens_cli.command('revoke-user')
+@click.argument('user_id', type=int)
+def revoke_user_command(user_id):
+    """Sign a user out everywhere: revoke all their current tokens."""
+    if db.session.get(User, user_id) is None:
+        raise click.ClickException(f'No user with id {user_id}')
+    revoke_user_tokens(user_id)
+    revoke_user_refresh_tokens(user_id)
+    db.session.commit()
+    click.echo(f'Revoked all tokens of user {user_id}')
@@ -0,0 +1,156 @@
+"""Materialized feed inboxes (fan-out on write).
+
+A user's feed is the feed_entries rows they own: one for each of their own
+logs and for each log by someone they follow, written in the same transaction
+as the log itself. Reading a feed page is then one keyset range scan of the
+owner's inbox, however many people they follow.
+
+Authors with at least FEED_CELEBRITY_FOLLOWERS followers are not fanned out
+(that would mean one insert per follower on every log). Their logs are merged
+in from food_logs when a follower reads the feed instead. Authors crossing the
+threshold are not re-materialized: the feed switches strategy for their logs
+from then on, so entries around the crossing may come from either side.
+"""
+from sqlalchemy import Integer, DateTime, Float, column, literal, tuple_, values
+from sqlalchemy.dialects.postgresql import insert
+from flask import current_app
+from . import db
+from .models import FeedEntry, Food, FoodLog, User, followers
+
+_ENTRY_COLUMNS = ['owner_id', 'log_date', 'log_id', 'author_id', 'food_id', 'grams']
+
+def celebrity_ids(user_ids):
+    """Return the subset of `user_ids` whose logs are read on demand rather than fanned out."""
+    if not user_ids:
+        return set()
+    threshold = current_app.config['FEED_CELEBRITY_FOLLOWERS']
+    return set(db.session.execute(
+        db.select(User.id).filter(
+            User.id.in_(user_ids),
+            User.followers_count >= threshold
+        )
+    ).scalars())
+
+def fan_out(logs):
+    """Write new logs into their authors' and their followers' inboxes.
+
+    `logs` is a list of dicts with id, user_id, log_date, food_id and grams.
+    Runs in the caller's transaction: two INSERTs however many logs or
+    followers there are.
+    """
+    if not logs:
+        return
+    db.session.execute(insert(FeedEntry).values([{
+        "owner_id": log['user_id'],
+        "log_date": log['log_date'],
+        "log_id": log['id'],
+        "author_id": log['user_id'],
+        "food_id": log['food_id'],
+        "grams": log['grams']
+    } for log in logs]).on_conflict_do_nothing())
+
+    skip = celebrity_ids({log['user_id'] for log in logs})
+    logs = [log for log in logs if log['user_id'] not in skip]
+    if not logs:
+        return
+    new_logs = values(
+        column('log_date', DateTime), column('log_id', Integer), column('author_id', Integer),
+        column('food_id', Integer), column('grams', Float),
+        name='new_logs'
+    ).data([
+        (log['log_date'], log['id'], log['user_id'], log['food_id'], log['grams'])
+        for log in logs
+    ])
+    db.session.execute(insert(FeedEntry).from_select(
+        _ENTRY_COLUMNS,
+        db.select(
+            followers.c.follower_id, new_logs.c.log_date, new_logs.c.log_id,
+            new_logs.c.author_id, new_logs.c.food_id, new_logs.c.grams
+        ).join(new_logs, followers.c.followed_id == new_logs.c.author_id)
+    ).on_conflict_do_nothing())
+
+def backfill(owner_id, author_id):
+    """Copy an author's most recent logs into a new follower's inbox."""
+    if celebrity_ids({author_id}):
+        return
+    recent = db.select(
+        literal(owner_id), FoodLog.log_date, FoodLog.id, FoodLog.user_id,
+        FoodLog.food_id, FoodLog.grams
+    ).filter(
+        FoodLog.user_id == author_id,
+        FoodLog.log_date.isnot(None)
+    ).order_by(FoodLog.log_date.desc(), FoodLog.id.desc()).limit(
+        current_app.config['FEED_BACKFILL_LOGS']
+    )
+    db.session.execute(insert(FeedEntry).from_select(_ENTRY_COLUMNS, recent).on_conflict_do_nothing())
+
+def remove_author(owner_id, author_id):
+    """Take an author's logs out of a former follower's inbox."""
+    db.session.execute(db.delete(FeedEntry).where(
+        FeedEntry.owner_id == owner_id,
+        FeedEntry.author_id == author_id
+    ))
+
+def read_feed(owner_id, limit, after=None):
+    """Return up to `limit` feed rows for `owner_id`, newest first.
+
+    `after` is the (log_date, log_id) of the last row of the previous page.
+    Rows have log_date, log_id, username, food_name, calories_per_100g and grams.
+    """
+    pulled = set(db.session.execute(
+        db.select(User.id).join(followers, followers.c.followed_id == User.id).filter(
+            followers.c.follower_id == owner_id,
+            User.followers_count >= current_app.config['FEED_CELEBRITY_FOLLOWERS']
+        )
+    ).scalars())
+
+    inbox = db.select(
+        FeedEntry.log_date, FeedEntry.log_id, FeedEntry.author_id,
+        FeedEntry.food_id, FeedEntry.grams
+    ).filter(FeedEntry.owner_id == owner_id)
+    if pulled:
+        # Entries fanned out before these authors crossed the threshold
+        inbox = inbox.filter(FeedEntry.author_id.notin_(pulled))
+    if after:
+        inbox = inbox.filter(tuple_(FeedEntry.log_date, FeedEntry.log_id) < after)
+    source = inbox.order_by(FeedEntry.log_date.desc(), FeedEntry.log_id.desc()).limit(limit)
+
+    if pulled:
+        on_read = db.select(
+            FoodLog.log_date, FoodLog.id.label('log_id'), FoodLog.user_id.label('author_id'),
+            FoodLog.food_id, FoodLog.grams
+        ).filter(
+            FoodLog.user_id.in_(pulled),
+            FoodLog.log_date.isnot(None)
+        )
+        if after:
+            on_read = on_read.filter(tuple_(FoodLog.log_date, FoodLog.id) < after)
+        on_read = on_read.order_by(FoodLog.log_date.desc(), FoodLog.id.desc()).limit(limit)
+        source = source.union_all(on_read)
+
+    merged = source.subquery()
+    return db.session.execute(
+        db.select(
+            merged.c.log_date, merged.c.log_id, merged.c.grams,
+            User.username, Food.name.label('food_name'), Food.calories_per_100g
+        )
+        .join(User, User.id == merged.c.author_id)
+        .join(Food, Food.id == merged.c.food_id)
+        .order_by(merged.c.log_date.desc(), merged.c.log_id.desc())
+        .limit(limit)
+    ).all()
+
+def delete_expired_entries(cutoff, batch_size=1000):
+    """Delete inbox entries for logs older than `cutoff`, in batches. Returns the count."""
+    deleted = 0
+    while True:
+        batch = db.select(FeedEntry.owner_id, FeedEntry.log_date, FeedEntry.log_id).filter(
+            FeedEntry.log_date < cutoff
+        ).limit(batch_size)
+        result = db.session.execute(db.delete(FeedEntry).where(
+            tuple_(FeedEntry.owner_id, FeedEntry.log_date, FeedEntry.log_id).in_(batch)
+        ))
+        db.session.commit()
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
@@ -0,0 +1,233 @@
+"""In-process food catalog index for autocomplete.
+
+Each worker can hold a copy of the food catalog in memory so that
+`/foods/autocomplete` is answered without a database round trip. Names are
+accent-folded and split into words; words live in a prefix trie and in a
+trigram posting list (for infix matches), and each word maps to the ids of the
+foods whose name contains it.
+
+Writers stamp changed foods with a new catalog version (`next_catalog_version`)
+in the same transaction as the change. Workers poll that version every
+FOOD_INDEX_REFRESH_SECONDS and patch in only the rows newer than what they
+already hold.
+"""
+import heapq
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from flask import current_app
+from sqlalchemy.dialects.postgresql import insert
+from . import db
+from .models import CatalogState, Food
+
+_WORD_END = ''  # trie key marking that a complete word ends at this node
+
+def fold(text):
+    """Lower-case text and strip accents, mirroring f_unaccent(lower(...))."""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+def _trigrams(word):
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+def next_catalog_version():
+    """Bump the catalog version inside the current transaction and return it.
+
+    Callers stamp the foods they add or change with the returned value before
+    committing, so the new version only becomes visible together with them.
+    """
+    stmt = insert(CatalogState).values(id=1, version=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CatalogState.id],
+        set_={'version': CatalogState.version + 1}
+    ).returning(CatalogState.version)
+    return db.session.execute(stmt).scalar_one()
+
+def current_catalog_version():
+    version = db.session.execute(
+        db.select(CatalogState.version).filter_by(id=1)
+    ).scalar()
+    return version or 0
+
+class FoodIndex:
+    """Prefix trie and trigram postings over the words of every food name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.version = None
+        self._checked_at = 0.0
+        self._foods = {}                  # food id -> serialized food
+        self._names = {}                  # food id -> folded name
+        self._postings = {}               # word -> set of food ids
+        self._trie = {}                   # nested dicts keyed by character
+        self._grams = defaultdict(set)    # trigram -> set of words
+
+    @property
+    def loaded(self):
+        return self.version is not None
+
+    def __len__(self):
+        return len(self._foods)
+
+    # -- maintenance -----------------------------------------------------
+
+    def build(self, force=False):
+        """Load the whole catalog. Must run inside an application context.
+
+        Threads that queued behind another thread's build find the index loaded
+        and return, so a cold start loads the catalog once.
+        """
+        with self._refresh_lock:
+            if self.loaded and not force:
+                return
+            version = current_catalog_version()
+            foods = db.session.execute(db.select(Food)).scalars().all()
+            with self._lock:
+                self._reset()
+                for food in foods:
+                    self._add(food)
+                self.version = version
+                self._checked_at = time.monotonic()
+
+    def refresh(self, force=False):
+        """Patch in foods changed since the last refresh, at most once per interval.
+
+        Only one thread refreshes at a time; the others keep answering from the
+        current data instead of waiting.
+        """
+        if not self.loaded:
+            self.build()
+            return
+        interval = current_app.config['FOOD_INDEX_REFRESH_SECONDS']
+        if not force and time.monotonic() - self._checked_at < interval:
+            return
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            self._checked_at = time.monotonic()
+            version = current_catalog_version()
+            if version <= self.version:
+                return
+            changed = db.session.execute(
+                db.select(Food).filter(Food.catalog_version > self.version)
+            ).scalars().all()
+            with self._lock:
+                for food in changed:
+                    self._remove(food.id)
+                    self._add(food)
+                self.version = max([version] + [food.catalog_version for food in changed])
+        finally:
+            self._refresh_lock.release()
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def _add(self, food):
+        name = fold(food.name)
+        self._foods[food.id] = {
+            "id": food.id,
+            "name": food.name,
+            "calories_per_100g": food.calories_per_100g,
+            "protein_per_100g": food.protein_per_100g,
+            "carbs_per_100g": food.carbs_per_100g,
+            "fat_per_100g": food.fat_per_100g
+        }
+        self._names[food.id] = name
+        for word in set(name.split()):
+            ids = self._postings.get(word)
+            if ids is None:
+                ids = self._postings[word] = set()
+                node = self._trie
+                for char in word:
+                    node = node.setdefault(char, {})
+                node[_WORD_END] = True
+                for gram in _trigrams(word):
+                    self._grams[gram].add(word)
+            ids.add(food.id)
+
+    def _remove(self, food_id):
+        name = self._names.pop(food_id, None)
+        self._foods.pop(food_id, None)
+        if name is None:
+            return
+        for word in set(name.split()):
+            ids = self._postings.get(word)
+            if ids is None:
+                continue
+            ids.discard(food_id)
+            if not ids:
+                # Leave the trie path in place; it is cheap and the word is
+                # likely to come back. Dropping the postings is enough.
+                del self._postings[word]
+                for gram in _trigrams(word):
+                    self._grams[gram].discard(word)
+
+    # -- lookup ----------------------------------------------------------
+
+    def _words_with_prefix(self, prefix):
+        node = self._trie
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+        words = []
+        stack = [(node, prefix)]
+        while stack:
+            node, word = stack.pop()
+            for char, child in node.items():
+                if char == _WORD_END:
+                    if word in self._postings:
+                        words.append(word)
+                else:
+                    stack.append((child, word + char))
+        return words
+
+    def _words_containing(self, fragment):
+        grams = _trigrams(fragment)
+        if not grams:
+            return []
+        candidates = set.intersection(*(self._grams.get(g, set()) for g in grams))
+        return [word for word in candidates if fragment in word]
+
+    def _matching_ids(self, token, infix):
+        words = self._words_with_prefix(token)
+        if infix:
+            words.extend(self._words_containing(token))
+        ids = set()
+        for word in words:
+            ids |= self._postings.get(word, set())
+        return ids
+
+    def search(self, query, limit):
+        """Return up to `limit` serialized foods whose name matches `query`.
+
+        Every query word must match the start of a word in the name; words of
+        at least SEARCH_MIN_INFIX_LENGTH characters may also match inside a
+        word. Exact names rank first, then names starting with the query, then
+        shorter names.
+        """
+        term = ' '.join(fold(query).split())
+        if not term:
+            return []
+        min_infix = current_app.config['SEARCH_MIN_INFIX_LENGTH']
+        with self._lock:
+            matches = None
+            for token in term.split():
+                ids = self._matching_ids(token, len(token) >= min_infix)
+                matches = ids if matches is None else matches & ids
+                if not matches:
+                    return []
+
+            def rank(food_id):
+                name = self._names[food_id]
+                return (name != term, not name.startswith(term), len(name), food_id)
+
+            return [self._foods[food_id] for food_id in heapq.nsmallest(limit, matches, key=rank)]
+
+food_index = FoodIndex()
@@ -0,0 +1,209 @@
+"""Background maintenance jobs and the single-leader runner that schedules them.
+
+Web workers never schedule jobs. A separate process started with
+`flask jobs run` tries to take a session-level Postgres advisory lock on a
+dedicated connection; whichever runner holds it is the leader and runs the
+schedule. Standby runners poll for the lock every JOBS_LEADER_POLL_SECONDS, so
+when the leader dies (and its connection, and therefore its lock, goes away)
+one of them takes over. The leader checks its own connection on the same
+interval and stops scheduling as soon as it can no longer vouch for the lock.
+
+Every run happens inside an application context and is recorded in job_runs
+with its duration and the number of rows it reported.
+"""
+import signal
+import threading
+import time
+from datetime import datetime
+
+import click
+from apscheduler.schedulers.background import BackgroundScheduler
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import text
+from . import db
+from .models import JobRun, madrid_now, madrid_tz
+
+# pg_try_advisory_lock key held by the leading job runner
+_LEADER_LOCK = 0x6a6f6272756e  # 'jobrun'
+
+def _ensure_log_partitions():
+    from .partitions import ensure_log_partitions
+    return ensure_log_partitions(current_app.config['FOOD_LOG_PARTITION_MONTHS_AHEAD'])
+
+def _cleanup_old_logs():
+    from .utils import cleanup_old_logs
+    return cleanup_old_logs()
+
+def _reconcile_follow_counts():
+    from .utils import reconcile_follow_counts
+    return reconcile_follow_counts()
+
+def _purge_expired_refresh_tokens():
+    from .tokens import purge_expired_refresh_tokens
+    return purge_expired_refresh_tokens()
+
+def _purge_expired_revocations():
+    from .revocation import purge_expired_revocations
+    return purge_expired_revocations()
+
+# name -> (function returning a row count or None, APScheduler trigger kwargs, run when leadership starts)
+JOBS = {
+    'ensure_log_partitions': (_ensure_log_partitions, {'trigger': 'interval', 'days': 1}, True),
+    'cleanup_old_logs': (_cleanup_old_logs, {'trigger': 'interval', 'weeks': 1}, False),
+    'reconcile_follow_counts': (_reconcile_follow_counts, {'trigger': 'interval', 'days': 1}, False),
+    'purge_expired_refresh_tokens': (_purge_expired_refresh_tokens, {'trigger': 'interval', 'days': 1}, False),
+    'purge_expired_revocations': (_purge_expired_revocations, {'trigger': 'interval', 'hours': 1}, False),
+}
+
+def run_job(name):
+    """Run one job in the current application context and record it in job_runs."""
+    func = JOBS[name][0]
+    started_at = madrid_now()
+    start = time.perf_counter()
+    rows, error = None, None
+    try:
+        rows = func()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception(f'Job {name} failed')
+        error = f'{type(e).__name__}: {e}'[:500]
+    duration_ms = (time.perf_counter() - start) * 1000
+
+    db.session.add(JobRun(
+        job_name=name,
+        started_at=started_at,
+        duration_ms=duration_ms,
+        rows=rows if isinstance(rows, int) else None,
+        succeeded=error is None,
+        error=error
+    ))
+    db.session.commit()
+    current_app.logger.info(f'Job {name} finished in {duration_ms:.0f} ms (rows: {rows})')
+    return error is None
+
+class JobRunner:
+    """Runs JOBS on a schedule while this process holds the leader lock."""
+
+    def __init__(self, app):
+        self.app = app
+        self._conn = None
+        self._scheduler = None
+        self._stopping = threading.Event()
+
+    @property
+    def is_leader(self):
+        return self._conn is not None
+
+    def acquire_lock(self):
+        """Try to become the leader. Returns True if this runner holds the lock."""
+        if self._conn is not None:
+            return True
+        with self.app.app_context():
+            conn = db.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        try:
+            acquired = conn.execute(
+                text("SELECT pg_try_advisory_lock(:key)"), {"key": _LEADER_LOCK}
+            ).scalar()
+        except Exception:
+            conn.close()
+            raise
+        if not acquired:
+            conn.close()
+            return False
+        self._conn = conn
+        return True
+
+    def check_lock(self):
+        """Return True if the leader connection (and so the lock) is still alive."""
+        if self._conn is None:
+            return False
+        try:
+            self._conn.execute(text("SELECT 1"))
+            return True
+        except Exception:
+            self.app.logger.warning('Lost the job runner leader connection')
+            self._drop_connection()
+            return False
+
+    def release(self):
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _LEADER_LOCK})
+        except Exception:
+            pass  # closing the connection releases it anyway
+        self._drop_connection()
+
+    def _drop_connection(self):
+        try:
+            self._conn.invalidate()
+            self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+    def _run(self, name):
+        with self.app.app_context():
+            run_job(name)
+
+    def _start_scheduler(self):
+        self._scheduler = BackgroundScheduler(timezone=madrid_tz)
+        for name, (_, trigger, at_start) in JOBS.items():
+            options = dict(trigger)
+            if at_start:
+                options['next_run_time'] = datetime.now(madrid_tz)
+            self._scheduler.add_job(
+                self._run, args=[name], id=name,
+                max_instances=1, coalesce=True, **options
+            )
+        self._scheduler.start()
+
+    def _stop_scheduler(self):
+        if self._scheduler is not None:
+            self._scheduler.shutdown(wait=True)
+            self._scheduler = None
+
+    def stop(self, *_):
+        self._stopping.set()
+
+    def run_forever(self):
+        """Poll for leadership and run the schedule while leading, until stop() is called."""
+        interval = self.app.config['JOBS_LEADER_POLL_SECONDS']
+        try:
+            while not self._stopping.is_set():
+                if self.is_leader:
+                    if not self.check_lock():
+                        self._stop_scheduler()
+                else:
+                    try:
+                        if self.acquire_lock():
+                            self.app.logger.info('Job runner is now the leader')
+                            self._start_scheduler()
+                    except Exception:
+                        self.app.logger.exception('Could not reach the database to take the job runner lock')
+                self._stopping.wait(interval)
+        finally:
+            self._stop_scheduler()
+            self.release()
+
+jobs_cli = AppGroup('jobs', help='Run background maintenance jobs.')
+
+@jobs_cli.command('run')
+def run_command():
+    """Run the job scheduler, taking over if the current leader goes away."""
+    if current_app.config['DB_PGBOUNCER']:
+        raise click.UsageError("The leader lock is a session-level advisory lock, which PgBouncer's "
+                               "transaction pooling can't hold; run with DB_PGBOUNCER=false and "
+                               "DATABASE_URL pointing at Postgres directly")
+    runner = JobRunner(current_app._get_current_object())
+    signal.signal(signal.SIGTERM, runner.stop)
+    signal.signal(signal.SIGINT, runner.stop)
+    runner.run_forever()
+
+@jobs_cli.command('run-once')
+@click.argument('name', type=click.Choice(sorted(JOBS)))
+def run_once_command(name):
+    """Run a single job now, in this process."""
+    if not run_job(name):
+        raise click.ClickException(f'Job {name} failed; see job_runs')
@@ -0,0 +1,323 @@
+"""Request metrics in Prometheus text format, aggregated across workers.
+
+Histograms and counters are sharded per thread, so recording an observation
+takes no lock: each thread only ever writes its own shard, and shards are
+summed when someone reads them. Every worker writes its totals to
+METRICS_DIR/<pid>.json at most every METRICS_FLUSH_SECONDS (and on each
+scrape), and GET /metrics adds up the files of all workers. Clear METRICS_DIR
+when the server is restarted; Prometheus handles the counter reset.
+
+Gauges (DB pool, Argon2 queue) are read when a worker flushes. Files that
+have not been updated for a few flush intervals belong to workers that are
+gone, so their gauges are left out while their counters still count.
+"""
+import bisect
+import hmac
+import json
+import os
+import threading
+import time
+from flask import Blueprint, Response, current_app, g, jsonify, request
+from . import db
+from .security import limiter
+
+_SEP = '\x1f'  # joins label values into one key
+
+def _key(labels):
+    return _SEP.join(str(value) for value in labels)
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _label_text(names, key, extra=()):
+    pairs = list(zip(names, key.split(_SEP) if names else [])) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Sharded:
+    """Per-thread dicts of label key -> list of numbers, summed on read."""
+
+    def __init__(self, name, documentation, labelnames, width):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._width = width
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def _values(self, labels):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        key = _key(labels)
+        values = shard.get(key)
+        if values is None:
+            values = shard[key] = [0] * self._width
+        return values
+
+    def snapshot(self):
+        totals = {}
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for key, values in list(shard.items()):
+                total = totals.setdefault(key, [0] * self._width)
+                for i, value in enumerate(values):
+                    total[i] += value
+        return totals
+
+class Counter(_Sharded):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames, 1)
+
+    def inc(self, labels=(), amount=1):
+        self._values(labels)[0] += amount
+
+    def render(self, totals):
+        for key, (value,) in sorted(totals.items()):
+            yield f'{self.name}{_label_text(self.labelnames, key)} {_number(value)}'
+
+class Histogram(_Sharded):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=()):
+        self.buckets = tuple(buckets)
+        # one count per bucket, one for +Inf, then the sum
+        super().__init__(name, documentation, labelnames, len(self.buckets) + 2)
+
+    def observe(self, labels, value):
+        values = self._values(labels)
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def render(self, totals):
+        bounds = [repr(float(bound)) for bound in self.buckets] + ['+Inf']
+        for key, values in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, values):
+                cumulative += count
+                yield f'{self.name}_bucket{_label_text(self.labelnames, key, [("le", bound)])} {cumulative}'
+            yield f'{self.name}_sum{_label_text(self.labelnames, key)} {_number(values[-1])}'
+            yield f'{self.name}_count{_label_text(self.labelnames, key)} {cumulative}'
+
+REGISTRY = {}
+_GAUGES = {}  # name -> (documentation, labelnames, function returning {labels tuple: value})
+
+def gauge(name, documentation, labelnames=()):
+    """Register a function that reports a gauge's current values in this worker."""
+    def register(func):
+        _GAUGES[name] = (documentation, tuple(labelnames), func)
+        return func
+    return register
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_DURATION = Histogram(
+    'bytebites_request_duration_seconds',
+    'Time from the start of request handling until the response is returned.',
+    ('endpoint', 'method', 'status'), LATENCY_BUCKETS
+)
+
+@gauge('bytebites_db_pool_connections', 'Database connections in this worker pool, by state.', ('state',))
+def _pool_connections():
+    pool = db.engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return {}
+    return {
+        ('checked_out',): pool.checkedout(),
+        ('idle',): pool.checkedin(),
+        ('overflow',): max(pool.overflow(), 0),
+    }
+
+@gauge('bytebites_db_pool_max_connections', 'Most connections this worker pool may open (pool_size + max_overflow).')
+def _pool_max_connections():
+    options = current_app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    return {(): options.get('pool_size', 5) + options.get('max_overflow', 10)}
+
+@gauge('bytebites_password_pool_pending', 'Argon2 operations queued or running on the hashing pool.')
+def _password_pool_pending():
+    from .passwords import passwords
+    return {(): passwords.pending}
+
+@gauge('bytebites_replica_lag_seconds', 'Replay lag of each read replica at its last check; -1 if unreachable.', ('replica',))
+def _replica_lag():
+    replicas = current_app.extensions.get('replicas')
+    if replicas is None:
+        return {}
+    return {(key,): -1 if lag is None else lag for key, lag in replicas.lags.items()}
+
+def _collect_gauges():
+    values = {}
+    for name, (_, _, func) in _GAUGES.items():
+        try:
+            values[name] = {_key(labels): [value] for labels, value in func().items()}
+        except Exception:
+            current_app.logger.exception(f'Could not read gauge {name}')
+    return values
+
+class _Exporter:
+    def __init__(self):
+        self._flushed_at = 0.0
+        self._lock = threading.Lock()
+
+    def _path(self, directory):
+        return os.path.join(directory, f'{os.getpid()}.json')
+
+    def flush(self, force=False):
+        """Write this worker's totals to METRICS_DIR, at most every METRICS_FLUSH_SECONDS."""
+        config = current_app.config
+        now = time.monotonic()
+        if not force and now - self._flushed_at < config['METRICS_FLUSH_SECONDS']:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._flushed_at = now
+            directory = config['METRICS_DIR']
+            os.makedirs(directory, exist_ok=True)
+            data = {
+                'metrics': {name: metric.snapshot() for name, metric in REGISTRY.items()},
+                'gauges': _collect_gauges(),
+            }
+            path = self._path(directory)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(data, f)
+            os.replace(path + '.tmp', path)
+        finally:
+            self._lock.release()
+
+    def collect(self):
+        """Sum the latest totals of every worker."""
+        config = current_app.config
+        directory = config['METRICS_DIR']
+        self.flush(force=True)
+        stale_after = time.time() - 3 * config['METRICS_FLUSH_SECONDS']
+        metrics, gauges = {}, {}
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json'):
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                fresh = os.path.getmtime(path) >= stale_after
+            except (OSError, ValueError):
+                continue  # a worker replaced it mid-read; it'll be there next scrape
+            sections = [(metrics, data.get('metrics', {}))]
+            if fresh:
+                sections.append((gauges, data.get('gauges', {})))
+            for target, section in sections:
+                for name, series in section.items():
+                    merged = target.setdefault(name, {})
+                    for key, values in series.items():
+                        total = merged.setdefault(key, [0] * len(values))
+                        for i, value in enumerate(values):
+                            total[i] += value
+        return metrics, gauges
+
+exporter = _Exporter()
+
+def render():
+    metrics, gauges = exporter.collect()
+    lines = []
+    for name, metric in REGISTRY.items():
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        lines.extend(metric.render(metrics.get(name, {})))
+    for name, (documentation, labelnames, _) in _GAUGES.items():
+        lines.append(f'# HELP {name} {documentation}')
+        lines.append(f'# TYPE {name} gauge')
+        for key, (value,) in sorted(gauges.get(name, {}).items()):
+            lines.append(f'{name}{_label_text(labelnames, key)} {_number(value)}')
+    lines.extend(_job_lines())
+    return '\n'.join(lines) + '\n'
+
+def _job_lines():
+    """Background job timings, from the job_runs table the job runner writes."""
+    from sqlalchemy import func
+    from .models import JobRun
+    latest = db.select(JobRun.job_name, func.max(JobRun.id).label('id')).group_by(JobRun.job_name).subquery()
+    try:
+        last_runs = db.session.execute(
+            db.select(JobRun).join(latest, JobRun.id == latest.c.id).order_by(JobRun.job_name)
+        ).scalars().all()
+        totals = db.session.execute(
+            db.select(JobRun.job_name, JobRun.succeeded, func.count(), func.sum(JobRun.duration_ms))
+            .group_by(JobRun.job_name, JobRun.succeeded)
+            .order_by(JobRun.job_name, JobRun.succeeded)
+        ).all()
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception('Could not read job runs for /metrics')
+        return []
+    lines = [
+        '# HELP bytebites_job_last_duration_seconds Duration of the latest run of each background job.',
+        '# TYPE bytebites_job_last_duration_seconds gauge',
+    ]
+    lines += [
+        f'bytebites_job_last_duration_seconds{{job="{run.job_name}"}} {run.duration_ms / 1000!r}'
+        for run in last_runs
+    ]
+    lines += [
+        '# HELP bytebites_job_last_success Whether the latest run of each background job succeeded.',
+        '# TYPE bytebites_job_last_success gauge',
+    ]
+    lines += [f'bytebites_job_last_success{{job="{run.job_name}"}} {int(run.succeeded)}' for run in last_runs]
+    lines += [
+        '# HELP bytebites_job_runs_total Background job runs recorded in job_runs.',
+        '# TYPE bytebites_job_runs_total counter',
+    ]
+    lines += [
+        f'bytebites_job_runs_total{{job="{name}",result="{"success" if ok else "failure"}"}} {count}'
+        for name, ok, count, _ in totals
+    ]
+    lines += [
+        '# HELP bytebites_job_duration_seconds_total Total time spent in each background job.',
+        '# TYPE bytebites_job_duration_seconds_total counter',
+    ]
+    lines += [
+        f'bytebites_job_duration_seconds_total{{job="{name}",result="{"success" if ok else "failure"}"}} {duration / 1000!r}'
+        for name, ok, _, duration in totals
+    ]
+    return lines
+
+def setup_metrics(app):
+    """Time every request and serve GET /metrics."""
+    @app.before_request
+    def start_metrics_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            REQUEST_DURATION.observe(
+                (request.endpoint or 'unmatched', request.method, response.status_code),
+                time.perf_counter() - start
+            )
+            exporter.flush()
+        return response
+
+    app.register_blueprint(metrics_bp)
+    return app
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+@limiter.exempt
+def metrics():
+    """Prometheus scrape endpoint. Requires `Bearer METRICS_TOKEN` when that is set."""
+    token = current_app.config['METRICS_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify({"message": "Unauthorized"}), 401
+    return Response(render(), mimetype='text/plain; version=0.0.4')
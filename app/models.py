@@ -1,15 +1,29 @@
 from . import db
-from argon2 import PasswordHasher
+from .passwords import passwords
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects.postgresql import insert
 from datetime import datetime
 import pytz
 
 madrid_tz = pytz.timezone('Europe/Madrid')
-ph = PasswordHasher()
+
+def madrid_wall_time(value):
+    """`value` as naive Europe/Madrid wall time, the way log dates and other local timestamps are stored.
+
+    Naive values are taken to be Madrid time already.
+    """
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(madrid_tz).replace(tzinfo=None)
+
+def madrid_now():
+    return madrid_wall_time(datetime.now(madrid_tz))
 
 # Association table for followers
 followers = db.Table('followers',
     db.Column('follower_id', db.Integer, db.ForeignKey('users.id'), primary_key=True),
-    db.Column('followed_id', db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    db.Column('followed_id', db.Integer, db.ForeignKey('users.id'), primary_key=True),
+    db.Index('ix_followers_followed_id', 'followed_id')
 )
 
 class User(db.Model):
@@ -25,10 +39,15 @@ class User(db.Model):
     weight = db.Column(db.Float)  # in kg
     height = db.Column(db.Float)  # in cm
     date_of_birth = db.Column(db.Date)
-    joined_at = db.Column(db.DateTime, default=lambda: datetime.now(madrid_tz))
+    joined_at = db.Column(db.DateTime, default=madrid_now)
     
     # Profile picture URL (stored in frontend/CDN)
     profile_picture_url = db.Column(db.String(500))
+
+    # Kept in step with the followers table by follow/unfollow;
+    # the reconcile_follow_counts job repairs any drift
+    followers_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    following_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # Relationships
     followed = db.relationship(
@@ -40,42 +59,49 @@ class User(db.Model):
     )
 
     def set_password(self, password):
-        self.password_hash = ph.hash(password)
+        self.password_hash = passwords.hash(password)
 
     def check_password(self, password):
-        try:
-            return ph.verify(self.password_hash, password)
-        except Exception:
-            return False
+        return passwords.verify(self.password_hash, password)
     
     def follow(self, user):
-        if not self.is_following(user):
-            self.followed.append(user)
+        """Follow `user`. Returns True if this created the relationship."""
+        created = db.session.execute(
+            insert(followers).values(follower_id=self.id, followed_id=user.id)
+            .on_conflict_do_nothing()
+        ).rowcount
+        if created:
+            self._adjust_follow_counts(user, 1)
+        return bool(created)
     
     def unfollow(self, user):
-        if self.is_following(user):
-            self.followed.remove(user)
+        """Stop following `user`. Returns True if there was a relationship to remove."""
+        removed = db.session.execute(
+            followers.delete().where(
+                followers.c.follower_id == self.id,
+                followers.c.followed_id == user.id
+            )
+        ).rowcount
+        if removed:
+            self._adjust_follow_counts(user, -1)
+        return bool(removed)
+
+    def _adjust_follow_counts(self, user, delta):
+        # Update the two rows in id order so concurrent follows can't deadlock
+        updates = sorted([
+            (self.id, {'following_count': User.following_count + delta}),
+            (user.id, {'followers_count': User.followers_count + delta})
+        ], key=lambda update: update[0])
+        for user_id, values in updates:
+            db.session.execute(db.update(User).where(User.id == user_id).values(**values))
     
     def is_following(self, user):
-        return self.followed.filter(followers.c.followed_id == user.id).count() > 0
-    
-    def get_feed(self):
-        """Get food logs from followed users and self."""
-        followed = FoodLog.query.join(
-            followers, (followers.c.followed_id == FoodLog.user_id)
-        ).filter(followers.c.follower_id == self.id)
-        
-        own = FoodLog.query.filter_by(user_id=self.id)
-        
-        return followed.union(own).order_by(FoodLog.log_date.desc())
-    
-    @property
-    def followers_count(self):
-        return self.followers.count()
-    
-    @property
-    def following_count(self):
-        return self.followed.count()
+        return db.session.execute(
+            db.select(db.exists().where(
+                followers.c.follower_id == self.id,
+                followers.c.followed_id == user.id
+            ))
+        ).scalar()
 
 class Food(db.Model):
     __tablename__ = 'foods'
@@ -86,14 +112,117 @@ class Food(db.Model):
     carbs_per_100g = db.Column(db.Float)
     fat_per_100g = db.Column(db.Float)
     usda_id = db.Column(db.String(20), unique=True)  # To store USDA FoodData Central ID
+    # Catalog version that last touched this row (see CatalogState)
+    catalog_version = db.Column(db.BigInteger, nullable=False, default=0, server_default='0', index=True)
+
+# unaccent() is only STABLE, so it can't be used in an index expression directly.
+# The trigram index on foods and the search queries both go through this wrapper.
+event.listen(Food.__table__, 'before_create', DDL(
+    "CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text AS "
+    "$$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$ "
+    "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT"
+))
+
+class CatalogState(db.Model):
+    """Single-row counter bumped whenever foods are added or changed.
+
+    Workers holding an in-memory food index poll this version and load only
+    the rows stamped with a newer catalog_version.
+    """
+    __tablename__ = 'catalog_state'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
 
 class FoodLog(db.Model):
+    """A user's logged portion of a food.
+
+    The table is range-partitioned by month on log_date (see app/partitions.py),
+    so log_date is part of the primary key and can't be NULL.
+    """
     __tablename__ = 'food_logs'
-    id = db.Column(db.Integer, primary_key=True)
+    __table_args__ = (
+        # Serves per-user history pages ordered by (log_date, id)
+        db.Index('ix_food_logs_user_id_log_date_id', 'user_id', 'log_date', 'id'),
+        {'postgresql_partition_by': 'RANGE (log_date)'},
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     food_id = db.Column(db.Integer, db.ForeignKey('foods.id'), nullable=False)
     grams = db.Column(db.Float, nullable=False)
-    log_date = db.Column(db.DateTime, default=lambda: datetime.now(madrid_tz), index=True)
+    log_date = db.Column(db.DateTime, primary_key=True, default=madrid_now, index=True)
 
     user = db.relationship('User', backref='food_logs')
-    food = db.relationship('Food', backref='food_logs')
\ No newline at end of file
+    food = db.relationship('Food', backref='food_logs')
+
+# A partitioned table accepts no rows until it has partitions. Schemas built
+# with create_all get the catch-all partition; monthly ones come from the job
+# runner (ensure_log_partitions).
+event.listen(FoodLog.__table__, 'after_create', DDL(
+    "CREATE TABLE IF NOT EXISTS food_logs_default PARTITION OF food_logs DEFAULT"
+))
+
+class DailyNutrition(db.Model):
+    """Per-user, per-day totals of everything logged, kept in step with food_logs.
+
+    Days are the local (Europe/Madrid) date of FoodLog.log_date. Rows are
+    updated in the same transaction as the logs they summarize; see
+    app/nutrition.py.
+    """
+    __tablename__ = 'daily_nutrition'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    calories = db.Column(db.Float, nullable=False, default=0)
+    protein = db.Column(db.Float, nullable=False, default=0)
+    carbs = db.Column(db.Float, nullable=False, default=0)
+    fat = db.Column(db.Float, nullable=False, default=0)
+    log_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class FeedEntry(db.Model):
+    """A food log in one user's feed inbox, written when the log is created (see app/feed.py)."""
+    __tablename__ = 'feed_entries'
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    log_date = db.Column(db.DateTime, primary_key=True)
+    log_id = db.Column(db.Integer, primary_key=True)
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    food_id = db.Column(db.Integer, db.ForeignKey('foods.id'), nullable=False)
+    grams = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_feed_entries_owner_id_author_id', 'owner_id', 'author_id'),
+        db.Index('ix_feed_entries_log_date', 'log_date'),
+    )
+
+class RefreshToken(db.Model):
+    """A refresh token, stored as its HMAC (see app/tokens.py)."""
+    __tablename__ = 'refresh_tokens'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    family_id = db.Column(db.Uuid, nullable=False, index=True)  # tokens rotated from the same login
+    token_hash = db.Column(db.LargeBinary(32), nullable=False, unique=True)
+    expires_at = db.Column(db.DateTime, nullable=False)  # naive UTC
+    used_at = db.Column(db.DateTime)
+    revoked_at = db.Column(db.DateTime)
+
+class RevokedToken(db.Model):
+    """A denylisted access token jti, or `user:<id>` for all of a user's tokens (see app/revocation.py)."""
+    __tablename__ = 'revoked_tokens'
+    id = db.Column(db.BigInteger, primary_key=True)
+    jti = db.Column(db.String(64), nullable=False, unique=True)
+    revoked_at = db.Column(db.DateTime, nullable=False)  # naive UTC
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)  # row can be purged after this
+
+class JobRun(db.Model):
+    """One execution of a background job by the job runner (app/jobs.py)."""
+    __tablename__ = 'job_runs'
+    id = db.Column(db.Integer, primary_key=True)
+    job_name = db.Column(db.String(64), nullable=False)
+    started_at = db.Column(db.DateTime, nullable=False, default=madrid_now)
+    duration_ms = db.Column(db.Float, nullable=False)
+    rows = db.Column(db.Integer)  # rows created/deleted, when the job reports it
+    succeeded = db.Column(db.Boolean, nullable=False)
+    error = db.Column(db.String(500))
+
+    __table_args__ = (
+        db.Index('ix_job_runs_job_name_started_at', 'job_name', 'started_at'),
+    )
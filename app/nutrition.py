@@ -0,0 +1,60 @@
+"""Incremental maintenance of the daily_nutrition rollup table.
+
+Every path that adds or removes food logs calls `add_to_daily_totals` in the
+same transaction, so the rollups never drift from the logs they summarize.
+"""
+from collections import defaultdict
+from sqlalchemy import delete, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from . import db
+from .models import DailyNutrition, madrid_wall_time
+
+def _amount(per_100g, grams):
+    return (per_100g or 0) * grams / 100
+
+def add_to_daily_totals(entries, sign=1):
+    """Add (sign=1) or subtract (sign=-1) logs from their users' daily totals.
+
+    `entries` is an iterable of (user_id, log_date, grams, food) tuples, where
+    food is anything with the Food *_per_100g attributes. The day is the date
+    of log_date as stored, in naive Madrid wall time. Entries are summed per
+    (user, day) first so each rollup row is touched by one upsert.
+    """
+    totals = defaultdict(lambda: [0.0, 0.0, 0.0, 0.0, 0])
+    for user_id, log_date, grams, food in entries:
+        row = totals[(user_id, madrid_wall_time(log_date).date())]
+        row[0] += sign * _amount(food.calories_per_100g, grams)
+        row[1] += sign * _amount(food.protein_per_100g, grams)
+        row[2] += sign * _amount(food.carbs_per_100g, grams)
+        row[3] += sign * _amount(food.fat_per_100g, grams)
+        row[4] += sign
+    if not totals:
+        return
+
+    stmt = insert(DailyNutrition).values([{
+        "user_id": user_id,
+        "day": day,
+        "calories": calories,
+        "protein": protein,
+        "carbs": carbs,
+        "fat": fat,
+        "log_count": log_count
+    } for (user_id, day), (calories, protein, carbs, fat, log_count) in totals.items()])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DailyNutrition.user_id, DailyNutrition.day],
+        set_={
+            "calories": DailyNutrition.calories + stmt.excluded.calories,
+            "protein": DailyNutrition.protein + stmt.excluded.protein,
+            "carbs": DailyNutrition.carbs + stmt.excluded.carbs,
+            "fat": DailyNutrition.fat + stmt.excluded.fat,
+            "log_count": DailyNutrition.log_count + stmt.excluded.log_count
+        }
+    )
+    db.session.execute(stmt)
+
+    if sign < 0:
+        # Days whose last log went away no longer need a row
+        db.session.execute(delete(DailyNutrition).where(
+            tuple_(DailyNutrition.user_id, DailyNutrition.day).in_(list(totals)),
+            DailyNutrition.log_count <= 0
+        ))
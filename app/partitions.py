@@ -0,0 +1,138 @@
+"""Monthly range partitions of food_logs.
+
+food_logs is partitioned by RANGE (log_date), one partition per calendar month
+named food_logs_yYYYYmMM, plus food_logs_default for anything outside them.
+Partitions are created ahead of time by a scheduled job, and retention drops
+whole partitions instead of deleting their rows.
+"""
+import re
+from datetime import date, datetime
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from . import db
+from .models import DailyNutrition, madrid_tz
+
+PARENT = 'food_logs'
+DEFAULT_PARTITION = 'food_logs_default'
+_NAME_RE = re.compile(r'^food_logs_y(\d{4})m(\d{2})$')
+
+def month_start(value):
+    """First day of the month containing a date or datetime."""
+    return date(value.year, value.month, 1)
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month):
+    return f'{PARENT}_y{month.year:04d}m{month.month:02d}'
+
+def list_partitions():
+    """Return {month: partition name} for the monthly partitions that exist."""
+    names = db.session.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :parent"
+    ), {"parent": PARENT}).scalars()
+    partitions = {}
+    for name in names:
+        match = _NAME_RE.match(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+# pg_advisory_xact_lock key serializing partition maintenance across processes
+_MAINTENANCE_LOCK = 0x666f6f646c6f67  # 'foodlog'
+
+def create_partition(month):
+    """Create the partition for `month`, moving any of its rows out of the default partition.
+
+    Postgres refuses to attach a range the default partition already holds rows
+    for, so those rows are moved into the new table before it is attached.
+    Runs in the caller's transaction, which should hold the maintenance lock
+    (see ensure_log_partitions). Returns True if a partition was created.
+    """
+    if month in list_partitions():
+        return False
+    name = partition_name(month)
+    lower, upper = month.isoformat(), add_months(month, 1).isoformat()
+    bounds = {"lower": lower, "upper": upper}
+
+    stray = db.session.execute(text(
+        f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} "
+        f"WHERE log_date >= :lower AND log_date < :upper)"
+    ), bounds).scalar()
+    if not stray:
+        db.session.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT} "
+            f"FOR VALUES FROM ('{lower}') TO ('{upper}')"
+        ))
+        return True
+
+    db.session.execute(text(
+        f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+    ))
+    db.session.execute(text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+        f"WHERE log_date >= :lower AND log_date < :upper RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ), bounds)
+    db.session.execute(text(
+        f"ALTER TABLE {PARENT} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{lower}') TO ('{upper}')"
+    ))
+    return True
+
+def ensure_log_partitions(months_ahead, start=None):
+    """Make sure monthly partitions exist from `start` (default: this month) through `months_ahead` months later.
+
+    Safe to run from several processes at once: callers queue on a
+    transaction-scoped advisory lock and re-check what exists once they hold
+    it. Returns the number of partitions created.
+    """
+    today = datetime.now(madrid_tz)
+    month = month_start(start or today)
+    last = add_months(month_start(today), months_ahead)
+    db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _MAINTENANCE_LOCK})
+    created = 0
+    while month <= last:
+        if create_partition(month):
+            created += 1
+        month = add_months(month, 1)
+    db.session.commit()
+    return created
+
+def drop_expired_partitions(cutoff):
+    """Detach and drop every monthly partition that ends on or before `cutoff`.
+
+    The daily nutrition rollups for those days go in the same transaction,
+    since every log they summarized is in the dropped partition. Dropping a
+    partition briefly needs exclusive locks on the tables its foreign keys
+    point at, so each drop gives up after FOOD_LOG_PARTITION_LOCK_TIMEOUT and
+    is retried on the next run. Returns the names of the dropped partitions.
+    """
+    lock_timeout = current_app.config['FOOD_LOG_PARTITION_LOCK_TIMEOUT']
+    dropped = []
+    for month, name in sorted(list_partitions().items()):
+        upper = add_months(month, 1)
+        if upper > cutoff:
+            break
+        try:
+            db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _MAINTENANCE_LOCK})
+            db.session.execute(text(f"SET LOCAL lock_timeout = '{lock_timeout}'"))
+            db.session.execute(
+                db.delete(DailyNutrition).where(
+                    DailyNutrition.day >= month, DailyNutrition.day < upper
+                )
+            )
+            db.session.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {name}"))
+            db.session.execute(text(f"DROP TABLE {name}"))
+            db.session.commit()
+        except OperationalError:
+            db.session.rollback()
+            current_app.logger.warning(f'Could not drop food log partition {name} yet; will retry')
+            break
+        dropped.append(name)
+    return dropped
@@ -0,0 +1,119 @@
+"""Argon2 password hashing on a bounded process pool.
+
+Hashing and verifying are CPU-bound and deliberately slow, so they run in a
+small pool of worker processes (PASSWORD_POOL_WORKERS) instead of on the
+request thread. At most PASSWORD_POOL_MAX_PENDING operations may be queued or
+running per web worker; past that, and when a result takes longer than
+PASSWORD_POOL_TIMEOUT_SECONDS, PasswordPoolBusy is raised so the auth
+endpoints can answer 503 at once instead of tying up the worker.
+
+The Argon2 parameters come from the ARGON2_* config keys. Hashes made with
+other parameters still verify, and `needs_rehash` tells login to upgrade them.
+With PASSWORD_POOL_WORKERS = 0 everything runs inline (used by the tests).
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from functools import lru_cache
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+
+class PasswordPoolBusy(Exception):
+    """Raised when the hashing pool is saturated or too slow to answer."""
+
+@lru_cache(maxsize=4)
+def _hasher(time_cost, memory_cost, parallelism):
+    return PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+
+def _hash(params, password):
+    return _hasher(*params).hash(password)
+
+def _verify(params, password_hash, password):
+    try:
+        return _hasher(*params).verify(password_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+class PasswordHashing:
+    """Hashes and verifies passwords, offloading the work to a process pool."""
+
+    def __init__(self, app=None):
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.params = (config['ARGON2_TIME_COST'], config['ARGON2_MEMORY_COST'], config['ARGON2_PARALLELISM'])
+        self.workers = config['PASSWORD_POOL_WORKERS']
+        self.timeout = config['PASSWORD_POOL_TIMEOUT_SECONDS']
+        self.max_pending = config['PASSWORD_POOL_MAX_PENDING']
+        self.shutdown()
+
+    def _get_pool(self):
+        # Created on first use in each process: a pool inherited through a
+        # fork (e.g. gunicorn --preload) would belong to the parent
+        with self._pool_lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    # spawn rather than fork: web workers run threads
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(self.params, *args)
+        with self._pending_lock:
+            if self._pending >= self.max_pending:
+                raise PasswordPoolBusy("Too many password operations in progress")
+            self._pending += 1
+        try:
+            future = self._get_pool().submit(func, self.params, *args)
+        except Exception:
+            self._done()
+            raise
+        future.add_done_callback(lambda _: self._done())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise PasswordPoolBusy("Password operation timed out")
+
+    def _done(self):
+        with self._pending_lock:
+            self._pending -= 1
+
+    @property
+    def pending(self):
+        """Operations queued or running on the pool (exposed at /metrics)."""
+        return self._pending
+
+    def hash(self, password):
+        return self._run(_hash, password)
+
+    def verify(self, password_hash, password):
+        """Return True if `password` matches `password_hash`."""
+        return self._run(_verify, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if the hash was made with other parameters than the configured ones. Cheap; runs inline."""
+        try:
+            return _hasher(*self.params).check_needs_rehash(password_hash)
+        except InvalidHashError:
+            return True
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            self._pool_pid = None
+
+passwords = PasswordHashing()
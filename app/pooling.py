@@ -0,0 +1,93 @@
+"""Database connection pool settings and instrumentation.
+
+The pool is sized by SQLALCHEMY_ENGINE_OPTIONS in each config class.
+`setup_pooling` runs before the engines are created and completes those
+options: the instrumented pool class, and the server-side statement_timeout
+(DB_STATEMENT_TIMEOUT), sent as a startup option so it costs no statement.
+
+With DB_PGBOUNCER the app sits behind PgBouncer in transaction pooling
+mode, where consecutive transactions may run on different server
+connections, so nothing may rely on session state:
+- no startup options; set statement_timeout on the role instead
+  (`ALTER ROLE bytebites SET statement_timeout = '30s'`);
+- no server-side prepared statements (turned off for psycopg 3; psycopg2
+  never uses them);
+- no session-level advisory locks, so `flask jobs run` refuses to start and
+  has to connect to Postgres directly.
+
+Every pool reports, by pool name (`primary`, `replica_0`, ...), the time
+each checkout took including any wait for a free connection, the checkouts
+that gave up after pool_timeout, and the connections it opened, closed and
+invalidated (churn). With the bytebites_db_pool_connections gauges that is
+enough to size pool_size and max_overflow from data.
+"""
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+from .metrics import Counter, Histogram, LATENCY_BUCKETS
+
+POOL_CHECKOUT = Histogram(
+    'bytebites_db_pool_checkout_seconds',
+    'Time to check a connection out of the pool, including waiting for a free one.',
+    ('pool',), LATENCY_BUCKETS
+)
+POOL_TIMEOUTS = Counter(
+    'bytebites_db_pool_timeouts_total',
+    'Checkouts that gave up after pool_timeout because the pool was exhausted.',
+    ('pool',)
+)
+POOL_CONNECTIONS = Counter(
+    'bytebites_db_connections_total',
+    'Database connections opened, closed and invalidated by the pool.',
+    ('pool', 'event')
+)
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records checkout times, timeouts and connection churn."""
+
+    def __init__(self, creator, **kwargs):
+        super().__init__(creator, **kwargs)
+        # A pool recreated by engine.dispose() inherits the listeners through _dispatch
+        if kwargs.get('_dispatch') is None:
+            name = getattr(self, 'logging_name', None) or 'primary'
+            for event_name in ('connect', 'close', 'invalidate'):
+                event.listen(self, event_name, _count_connections(name, event_name))
+
+    def connect(self):
+        name = getattr(self, 'logging_name', None) or 'primary'
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            POOL_TIMEOUTS.inc((name,))
+            raise
+        finally:
+            POOL_CHECKOUT.observe((name,), time.perf_counter() - start)
+
+def _count_connections(name, event_name):
+    def listener(*args):
+        POOL_CONNECTIONS.inc((name, event_name))
+    return listener
+
+def setup_pooling(app):
+    """Complete SQLALCHEMY_ENGINE_OPTIONS. Must run before db.init_app."""
+    config = app.config
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    options.setdefault('poolclass', InstrumentedQueuePool)
+    options.setdefault('pool_logging_name', 'primary')
+    connect_args = dict(options.get('connect_args', {}))
+    timeout = config['DB_STATEMENT_TIMEOUT']
+    if config['DB_PGBOUNCER']:
+        if timeout:
+            app.logger.warning("DB_STATEMENT_TIMEOUT is not sent through PgBouncer; "
+                               "set statement_timeout on the database role instead")
+        uri = config.get('SQLALCHEMY_DATABASE_URI')
+        if uri and make_url(uri).drivername == 'postgresql+psycopg':
+            connect_args['prepare_threshold'] = None
+    elif timeout:
+        connect_args['options'] = f"{connect_args.get('options', '')} -c statement_timeout={timeout}".strip()
+    options['connect_args'] = connect_args
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    return app
@@ -1,13 +1,20 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from . import db
+from . import db, feed
 from .models import User
+from .queries import query_budget
+from .ratelimit import read_limit
+from .replicas import read_only
+from .security import limiter
+from .utils import decode_cursor, encode_cursor, parse_limit
 from datetime import datetime
 
 profile_bp = Blueprint('profile', __name__)
 
 @profile_bp.route('/profile', methods=['GET'])
 @jwt_required()
+@query_budget(2)
+@read_only
 def get_profile():
     """Get current user's profile"""
     current_user_id = get_jwt_identity()
@@ -57,6 +64,7 @@ def update_profile():
 
 @profile_bp.route('/users/<int:user_id>/follow', methods=['POST'])
 @jwt_required()
+@query_budget(9)
 def follow_user(user_id):
     """Follow a user"""
     current_user_id = get_jwt_identity()
@@ -69,12 +77,14 @@ def follow_user(user_id):
     if not user_to_follow:
         return jsonify({"message": "User not found"}), 404
         
-    current_user.follow(user_to_follow)
+    if current_user.follow(user_to_follow):
+        feed.backfill(current_user.id, user_to_follow.id)
     db.session.commit()
     return jsonify({"message": f"Now following {user_to_follow.username}"})
 
 @profile_bp.route('/users/<int:user_id>/unfollow', methods=['POST'])
 @jwt_required()
+@query_budget(8)
 def unfollow_user(user_id):
     """Unfollow a user"""
     current_user_id = get_jwt_identity()
@@ -84,29 +94,53 @@ def unfollow_user(user_id):
     if not user_to_unfollow:
         return jsonify({"message": "User not found"}), 404
         
-    current_user.unfollow(user_to_unfollow)
+    if current_user.unfollow(user_to_unfollow):
+        feed.remove_author(current_user.id, user_to_unfollow.id)
     db.session.commit()
     return jsonify({"message": f"Unfollowed {user_to_unfollow.username}"})
 
 @profile_bp.route('/feed', methods=['GET'])
+@limiter.limit(read_limit)
 @jwt_required()
+@query_budget(3)
+@read_only
 def get_feed():
-    """Get food logs from followed users"""
-    current_user_id = get_jwt_identity()
-    user = db.session.get(User, int(current_user_id))
-    
-    feed_logs = user.get_feed().limit(50).all()  # Limit to last 50 entries
-    
-    return jsonify([{
-        "username": log.user.username,
-        "food_name": log.food.name,
-        "grams": log.grams,
-        "calories": (log.food.calories_per_100g * log.grams) / 100,
-        "log_date": log.log_date.isoformat()
-    } for log in feed_logs])
+    """Get food logs from followed users and the current user, newest first.
+
+    Pages hold at most `limit` logs; the cursor for the next page, if any, is
+    returned in the X-Next-Cursor header.
+    """
+    current_user_id = int(get_jwt_identity())
+    try:
+        limit = parse_limit('FEED_DEFAULT_LIMIT', 'FEED_MAX_LIMIT')
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    after = None
+    if request.args.get('cursor'):
+        try:
+            log_date, log_id = decode_cursor(request.args['cursor'])
+            after = (datetime.fromisoformat(log_date), int(log_id))
+        except (TypeError, ValueError):
+            return jsonify({"message": "Invalid cursor"}), 400
+
+    rows = feed.read_feed(current_user_id, limit + 1, after)
+
+    response = jsonify([{
+        "username": row.username,
+        "food_name": row.food_name,
+        "grams": row.grams,
+        "calories": (row.calories_per_100g * row.grams) / 100,
+        "log_date": row.log_date.isoformat()
+    } for row in rows[:limit]])
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        response.headers['X-Next-Cursor'] = encode_cursor(last.log_date.isoformat(), last.log_id)
+    return response
 
 @profile_bp.route('/users/<int:user_id>/profile', methods=['GET'])
 @jwt_required()
+@query_budget(4)
+@read_only
 def get_user_profile(user_id):
     """Get another user's public profile"""
     current_user_id = get_jwt_identity()
@@ -0,0 +1,242 @@
+"""Opt-in sampling profiler for individual requests.
+
+A profiled request gets a sampler thread that records the request thread's
+Python stack every PROFILE_INTERVAL_SECONDS until the response is ready. The
+stacks show where the time goes whether the thread is running Python (JSON
+building, ORM hydration) or waiting in C (psycopg2, the Argon2 pool).
+
+Requests are profiled at random with probability PROFILE_SAMPLE_RATE, or on
+demand with an `X-Profile: <PROFILE_TOKEN>` header. Profiles are written to
+PROFILE_DIR/<endpoint>/ in collapsed-stack (`.folded`) or speedscope
+(`.speedscope.json`) format, see PROFILE_FORMAT. With both settings off the
+cost is one config lookup per request.
+
+`flask profile merge` adds up the profiles of each endpoint into a folded
+file and an SVG flamegraph.
+"""
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from html import escape
+import click
+from flask import current_app, g, request
+from flask.cli import AppGroup
+
+_FOLDED = '.folded'
+_SPEEDSCOPE = '.speedscope.json'
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+
+def _frame_name(code):
+    path = code.co_filename
+    marker = path.rfind('site-packages' + os.sep)
+    if marker != -1:
+        path = path[marker + len('site-packages') + 1:]
+    elif path.startswith(_ROOT):
+        path = path[len(_ROOT):]
+    # ';' separates frames in the collapsed format
+    return f'{code.co_name} ({path}:{code.co_firstlineno})'.replace(';', ':')
+
+class Sampler(threading.Thread):
+    """Samples one thread's stack at a fixed interval until stopped."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name=f'profiler-{thread_id}', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()  # tuple of frame names, outermost first -> samples
+        self._stopped = threading.Event()
+        self._names = {}  # code object -> frame name
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                name = self._names.get(code)
+                if name is None:
+                    name = self._names[code] = _frame_name(code)
+                stack.append(name)
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        return self.stacks
+
+def _wants_profile(config):
+    token = config['PROFILE_TOKEN']
+    if token:
+        header = request.headers.get('X-Profile')
+        if header and hmac.compare_digest(header, token):
+            return True
+    rate = config['PROFILE_SAMPLE_RATE']
+    return rate > 0 and random.random() < rate
+
+def write_profile(directory, endpoint, stacks, interval, fmt, duration):
+    """Write one request's stacks to directory/endpoint/ and return the path."""
+    folder = os.path.join(directory, endpoint)
+    os.makedirs(folder, exist_ok=True)
+    base = os.path.join(folder, f'{time.time_ns() // 1000}-{os.getpid()}-{threading.get_ident()}')
+    if fmt == 'speedscope':
+        path = base + _SPEEDSCOPE
+        index, samples, weights = {}, [], []
+        for stack, count in stacks.items():
+            samples.append([index.setdefault(name, len(index)) for name in stack])
+            weights.append(count * interval)
+        frames = [{"name": name} for name in index]
+        data = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled", "name": endpoint, "unit": "seconds",
+                "startValue": 0, "endValue": duration,
+                "samples": samples, "weights": weights
+            }]
+        }
+        content = json.dumps(data)
+    else:
+        path = base + _FOLDED
+        content = ''.join(f'{";".join(stack)} {count}\n' for stack, count in stacks.items())
+    with open(path + '.tmp', 'w') as f:
+        f.write(content)
+    os.replace(path + '.tmp', path)
+    return path
+
+def read_profile(path):
+    """Stacks of a profile written by write_profile, as a Counter of tuples."""
+    stacks = Counter()
+    with open(path) as f:
+        if path.endswith(_SPEEDSCOPE):
+            data = json.load(f)
+            names = [frame['name'] for frame in data['shared']['frames']]
+            for profile in data['profiles']:
+                # weights are in seconds; count in units of the smallest one, i.e. one sample
+                unit = min(profile['weights'], default=1) or 1
+                for sample, weight in zip(profile['samples'], profile['weights']):
+                    stacks[tuple(names[i] for i in sample)] += round(weight / unit)
+        else:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack:
+                    stacks[tuple(stack.split(';'))] += int(count)
+    return stacks
+
+def setup_profiling(app):
+    @app.before_request
+    def start_profiler():
+        config = app.config
+        if not (config['PROFILE_SAMPLE_RATE'] or config['PROFILE_TOKEN']) or not _wants_profile(config):
+            return
+        sampler = Sampler(threading.get_ident(), config['PROFILE_INTERVAL_SECONDS'])
+        g.profiler = (sampler, time.perf_counter())
+        sampler.start()
+
+    @app.teardown_request
+    def stop_profiler(exc):
+        # Teardown also runs when the view raised, so the sampler never
+        # outlives its request. Streamed bodies are produced after this point
+        # and are not included.
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return
+        sampler, start = profiler
+        stacks = sampler.stop()
+        duration = time.perf_counter() - start
+        if stacks:
+            try:
+                path = write_profile(
+                    app.config['PROFILE_DIR'], request.endpoint or 'unmatched', stacks,
+                    sampler.interval, app.config['PROFILE_FORMAT'], duration
+                )
+                app.logger.info(f'Profiled {request.method} {request.path} ({duration * 1000:.1f}ms) to {path}')
+            except OSError:
+                app.logger.exception('Could not write profile')
+
+    return app
+
+def _color(name):
+    # warm palette, stable per frame
+    h = zlib.crc32(name.encode())
+    return f'rgb({205 + h % 50},{(h >> 8) % 230},{(h >> 16) % 55})'
+
+def flamegraph_svg(stacks, title, width=1200, row=16):
+    """Render folded stacks as a standalone SVG flamegraph (callers at the bottom)."""
+    root = {}  # name -> [samples, children]
+    depth = 0
+    for stack, count in stacks.items():
+        depth = max(depth, len(stack))
+        level = root
+        for name in stack:
+            node = level.setdefault(name, [0, {}])
+            node[0] += count
+            level = node[1]
+    total = sum(stacks.values()) or 1
+    height = (depth + 2) * row
+    rects = []
+
+    def draw(level, x, y):
+        for name, (count, children) in sorted(level.items()):
+            w = count / total * width
+            if w >= 0.5:
+                label = name if w > 7 * len(name) else name[:int(w / 7) - 2] + '..' if w > 35 else ''
+                rects.append(
+                    f'<g><title>{escape(name)} ({count} samples, {count / total:.1%})</title>'
+                    f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row - 1}" fill="{_color(name)}"/>'
+                    f'<text x="{x + 3:.1f}" y="{y + row - 4}">{escape(label)}</text></g>'
+                )
+                draw(children, x, y - row)
+            x += w
+
+    draw(root, 0, height - 2 * row)
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="monospace" font-size="11">'
+        f'<text x="{width / 2}" y="{row - 3}" text-anchor="middle" font-size="13">'
+        f'{escape(title)} ({total} samples)</text>' + ''.join(rects) + '</svg>\n'
+    )
+
+profile_cli = AppGroup('profile', help='Work with request profiles.')
+
+@profile_cli.command('merge')
+@click.option('--dir', 'directory', help='Profile directory; defaults to PROFILE_DIR.')
+@click.option('--output', help='Where to write the flamegraphs; defaults to <dir>/flamegraphs.')
+@click.option('--endpoint', multiple=True, help='Only merge these endpoints.')
+def merge_command(directory, output, endpoint):
+    """Merge each endpoint's profiles into a folded file and an SVG flamegraph."""
+    directory = directory or current_app.config['PROFILE_DIR']
+    output = output or os.path.join(directory, 'flamegraphs')
+    if not os.path.isdir(directory):
+        raise click.ClickException(f'No profiles in {directory}')
+    os.makedirs(output, exist_ok=True)
+    merged_any = False
+    for name in sorted(os.listdir(directory)):
+        folder = os.path.join(directory, name)
+        if not os.path.isdir(folder) or os.path.abspath(folder) == os.path.abspath(output):
+            continue
+        if endpoint and name not in endpoint:
+            continue
+        stacks, profiles = Counter(), 0
+        for filename in os.listdir(folder):
+            if filename.endswith((_FOLDED, _SPEEDSCOPE)):
+                stacks.update(read_profile(os.path.join(folder, filename)))
+                profiles += 1
+        if not stacks:
+            continue
+        with open(os.path.join(output, name + _FOLDED), 'w') as f:
+            f.writelines(f'{";".join(stack)} {count}\n' for stack, count in stacks.most_common())
+        svg = os.path.join(output, name + '.svg')
+        with open(svg, 'w') as f:
+            f.write(flamegraph_svg(stacks, name))
+        click.echo(f'{name}: {profiles} profiles, {sum(stacks.values())} samples -> {svg}')
+        merged_any = True
+    if not merged_any:
+        raise click.ClickException(f'No profiles in {directory}')
@@ -0,0 +1,191 @@
+"""Per-request SQL statement counting, query budgets, deadlines and row caps.
+
+Engine events count every statement a request executes and the time spent
+in the database. A statement executed QUERY_REPEAT_THRESHOLD or more times in
+one request usually means a lazy load inside a loop (N+1); it is logged and
+counted in bytebites_repeated_statements_total.
+
+Views can declare how many statements they may use with `@query_budget(n)`.
+Going over is logged, or raised as QueryBudgetExceeded when
+QUERY_BUDGET_STRICT is set (as in the tests), so a regression fails the
+test suite instead of reaching production. In debug mode the numbers are
+also returned as X-Query-Count / X-Query-Time-Ms headers.
+
+So that one slow request can't hold a connection indefinitely, each request
+has a deadline, QUERY_DEADLINE_SECONDS unless QUERY_DEADLINE_OVERRIDES names
+its endpoint or blueprint. Every transaction the request begins gets what
+is left of it as a `SET LOCAL statement_timeout`; a statement cancelled by
+the timeout, or a transaction begun after the deadline, ends the request
+with 503. Likewise a request that reads more than QUERY_ROW_CAP rows (or its
+override) in total is stopped with 413. Both end when the view returns, so
+streamed response bodies are only bounded by DB_STATEMENT_TIMEOUT.
+"""
+import time
+from collections import Counter as StatementCounter
+from functools import wraps
+from flask import g, has_request_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from .metrics import Counter, Histogram, LATENCY_BUCKETS
+
+_QUERY_CANCELED = '57014'  # SQLSTATE of a statement cancelled by statement_timeout
+
+class QueryBudgetExceeded(Exception):
+    """Raised in strict mode when a view runs more statements than its budget."""
+
+class RequestDeadlineExceeded(Exception):
+    """Raised when a request begins a transaction after its deadline."""
+
+class RowCapExceeded(Exception):
+    """Raised when a request reads more rows than its cap."""
+
+REQUEST_QUERIES = Histogram(
+    'bytebites_request_queries',
+    'SQL statements executed per request.',
+    ('endpoint',), (1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+)
+REQUEST_DB_TIME = Histogram(
+    'bytebites_request_db_seconds',
+    'Time per request spent executing SQL statements.',
+    ('endpoint',), LATENCY_BUCKETS
+)
+REPEATED_STATEMENTS = Counter(
+    'bytebites_repeated_statements_total',
+    'Requests that executed the same statement QUERY_REPEAT_THRESHOLD or more times.',
+    ('endpoint',)
+)
+REQUEST_LIMITS_EXCEEDED = Counter(
+    'bytebites_request_limits_exceeded_total',
+    'Requests stopped by their query deadline or row cap.',
+    ('endpoint', 'limit')
+)
+
+class QueryStats:
+    __slots__ = ('count', 'seconds', 'statements', 'rows', 'deadline', 'row_cap')
+
+    def __init__(self, deadline=None, row_cap=None):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = StatementCounter()
+        self.rows = 0
+        self.deadline = deadline  # time.monotonic() value
+        self.row_cap = row_cap
+
+def current_stats():
+    """The QueryStats of the current request, or None outside a request."""
+    return g.get('query_stats') if has_request_context() else None
+
+def query_budget(limit):
+    """Declare the most SQL statements the decorated view may execute."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            g.query_budget = limit
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_stats() is not None:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_stats()
+    starts = conn.info.get('query_start')
+    if stats is None or not starts:
+        return
+    stats.seconds += time.perf_counter() - starts.pop()
+    stats.count += 1
+    stats.statements[statement] += 1  # the SQL text with placeholders, i.e. the statement's shape
+    if cursor.description is not None and cursor.rowcount > 0:
+        stats.rows += cursor.rowcount
+        if stats.row_cap is not None and stats.rows > stats.row_cap:
+            raise RowCapExceeded(f'{request.endpoint} read more than {stats.row_cap} rows')
+
+@event.listens_for(Session, 'after_begin')
+def _apply_deadline(session, transaction, connection):
+    stats = current_stats()
+    if stats is None or stats.deadline is None:
+        return
+    remaining_ms = int((stats.deadline - time.monotonic()) * 1000)
+    if remaining_ms < 1:
+        raise RequestDeadlineExceeded(f'{request.endpoint} is past its deadline')
+    # On the DBAPI connection, so it isn't counted as one of the request's statements
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute("SELECT set_config('statement_timeout', %s, true)", (f'{remaining_ms}ms',))
+    finally:
+        cursor.close()
+
+def _for_endpoint(config, default_key, overrides_key):
+    """The override for the request's endpoint or blueprint, else the default."""
+    overrides = config[overrides_key]
+    for name in (request.endpoint, request.blueprint):
+        if name in overrides:
+            return overrides[name]
+    return config[default_key]
+
+def setup_query_stats(app):
+    @app.before_request
+    def start_query_stats():
+        seconds = _for_endpoint(app.config, 'QUERY_DEADLINE_SECONDS', 'QUERY_DEADLINE_OVERRIDES')
+        g.query_stats = QueryStats(
+            deadline=None if seconds is None else time.monotonic() + seconds,
+            row_cap=_for_endpoint(app.config, 'QUERY_ROW_CAP', 'QUERY_ROW_CAP_OVERRIDES')
+        )
+
+    @app.after_request
+    def finish_query_stats(response):
+        stats = g.pop('query_stats', None)
+        if stats is None:
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_QUERIES.observe((endpoint,), stats.count)
+        REQUEST_DB_TIME.observe((endpoint,), stats.seconds)
+
+        threshold = app.config['QUERY_REPEAT_THRESHOLD']
+        repeated = [(statement, n) for statement, n in stats.statements.items() if n >= threshold]
+        if repeated:
+            REPEATED_STATEMENTS.inc((endpoint,))
+            statement, n = max(repeated, key=lambda item: item[1])
+            app.logger.warning(f'{endpoint} ran the same statement {n} times (N+1?): {statement[:200]}')
+
+        if app.debug or app.config['QUERY_STATS_HEADERS']:
+            response.headers['X-Query-Count'] = str(stats.count)
+            response.headers['X-Query-Time-Ms'] = f'{stats.seconds * 1000:.1f}'
+
+        budget = g.pop('query_budget', None)
+        if budget is not None and stats.count > budget:
+            message = f'{endpoint} ran {stats.count} SQL statements, over its budget of {budget}'
+            if app.config['QUERY_BUDGET_STRICT']:
+                raise QueryBudgetExceeded(message)
+            app.logger.warning(message)
+        return response
+
+    def stopped(limit, status, message):
+        from . import db
+        db.session.rollback()
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_LIMITS_EXCEEDED.inc((endpoint, limit))
+        app.logger.warning(f'{endpoint} was stopped by its {limit}')
+        return jsonify({"message": message}), status
+
+    @app.errorhandler(RequestDeadlineExceeded)
+    def deadline_exceeded(error):
+        return stopped('deadline', 503, "The request took too long; try again later")
+
+    @app.errorhandler(OperationalError)
+    def query_canceled(error):
+        if getattr(error.orig, 'pgcode', None) != _QUERY_CANCELED:
+            raise error
+        return stopped('deadline', 503, "The request took too long; try again later")
+
+    @app.errorhandler(RowCapExceeded)
+    def row_cap_exceeded(error):
+        return stopped('row_cap', 413, "The request would read too many rows; narrow it down")
+
+    return app
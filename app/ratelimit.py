@@ -0,0 +1,149 @@
+"""Rate limiting pieces plugged into Flask-Limiter (see security.py).
+
+- `rate_limit_key` keys limits on the JWT identity when the request carries a
+  valid token, and on the client address otherwise, so users behind one NAT
+  don't share a budget.
+- `SlidingWindowCounterRateLimiter`, registered as the `sliding-window-counter`
+  strategy, estimates the request count over the last window from the
+  current and previous fixed-window counters. It avoids the burst at fixed
+  window boundaries without storing every hit like `moving-window`: a hit is
+  one counter read and one increment.
+- `SQLiteStorage` (`sqlite:///path`) shares counters between all the worker
+  processes on one host, for deployments without Redis.
+"""
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from flask import current_app
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from flask_limiter.util import get_remote_address
+from limits.storage import Storage
+from limits.strategies import STRATEGIES, RateLimiter
+from limits.util import WindowStats
+
+def rate_limit_key():
+    try:
+        verify_jwt_in_request(optional=True)
+        identity = get_jwt_identity()
+    except Exception:
+        identity = None  # bad tokens are rejected by the view itself
+    if identity is not None:
+        return f'user:{identity}'
+    return get_remote_address()
+
+def auth_limit():
+    return current_app.config['RATELIMIT_AUTH']
+
+def read_limit():
+    return current_app.config['RATELIMIT_READ']
+
+class SlidingWindowCounterRateLimiter(RateLimiter):
+    """Weighted sum of the previous and current fixed windows."""
+
+    def _keys_and_weight(self, item, identifiers):
+        window = item.get_expiry()
+        now = time.time()
+        index = int(now // window)
+        key = item.key_for(*identifiers)
+        weight = 1 - (now % window) / window  # share of the previous window still in view
+        return f'{key}/{index}', f'{key}/{index - 1}', weight, (index + 1) * window
+
+    def hit(self, item, *identifiers, cost=1):
+        current_key, previous_key, weight, _ = self._keys_and_weight(item, identifiers)
+        previous = self.storage.get(previous_key)
+        current = self.storage.incr(current_key, 2 * item.get_expiry(), amount=cost)
+        return math.floor(previous * weight) + current <= item.amount
+
+    def test(self, item, *identifiers):
+        current_key, previous_key, weight, _ = self._keys_and_weight(item, identifiers)
+        count = math.floor(self.storage.get(previous_key) * weight) + self.storage.get(current_key)
+        return count < item.amount
+
+    def get_window_stats(self, item, *identifiers):
+        current_key, previous_key, weight, reset = self._keys_and_weight(item, identifiers)
+        count = math.floor(self.storage.get(previous_key) * weight) + self.storage.get(current_key)
+        return WindowStats(reset, max(0, item.amount - count))
+
+    def clear(self, item, *identifiers):
+        current_key, previous_key, _, _ = self._keys_and_weight(item, identifiers)
+        self.storage.clear(current_key)
+        self.storage.clear(previous_key)
+
+STRATEGIES['sliding-window-counter'] = SlidingWindowCounterRateLimiter
+
+class SQLiteStorage(Storage):
+    """Counters in a local SQLite database shared by every process on the host.
+
+    Durability is traded for speed (WAL, synchronous=OFF): a crash may lose
+    the latest counts, which for rate limits is harmless.
+    """
+
+    STORAGE_SCHEME = ['sqlite']
+    _PURGE_EVERY = 1000  # on average, purge expired counters once per this many increments
+
+    def __init__(self, uri, wrap_exceptions=False, **options):
+        path = uri.split('://', 1)[1]
+        self.path = path[1:] if path.startswith('/') else path  # sqlite:////abs or sqlite:///relative
+        self._local = threading.local()
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS counters "
+            "(key TEXT PRIMARY KEY, value INTEGER NOT NULL, expires_at REAL NOT NULL) WITHOUT ROWID"
+        )
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connection(self):
+        # One connection per thread and process
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        conn = self._connection()
+        now = time.time()
+        value = conn.execute(
+            "INSERT INTO counters (key, value, expires_at) VALUES (:key, :amount, :expires_at) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            "value = CASE WHEN expires_at <= :now THEN excluded.value ELSE value + excluded.value END, "
+            "expires_at = CASE WHEN expires_at <= :now OR :elastic THEN excluded.expires_at ELSE expires_at END "
+            "RETURNING value",
+            {"key": key, "amount": amount, "expires_at": now + expiry, "now": now, "elastic": elastic_expiry}
+        ).fetchone()[0]
+        if random.randrange(self._PURGE_EVERY) == 0:
+            conn.execute("DELETE FROM counters WHERE expires_at <= ?", (now,))
+        return value
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value FROM counters WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        row = self._connection().execute(
+            "SELECT expires_at FROM counters WHERE key = ?", (key,)
+        ).fetchone()
+        return int(row[0]) if row else int(time.time())
+
+    def check(self):
+        try:
+            self._connection().execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self._connection().execute("DELETE FROM counters").rowcount
+
+    def clear(self, key):
+        self._connection().execute("DELETE FROM counters WHERE key = ?", (key,))
@@ -0,0 +1,168 @@
+"""Read-replica routing for read-only views.
+
+Replicas are listed in SQLALCHEMY_REPLICA_URIS and get engines named
+`replica_0`, `replica_1`, ... with the primary's SQLALCHEMY_ENGINE_OPTIONS.
+They are not Flask-SQLAlchemy binds, so `db.create_all()` and migrations
+never touch them. Views decorated with `@read_only` run their queries on a
+randomly picked replica. Everything else uses the primary, including
+flushes and INSERT/UPDATE/DELETE statements issued from a read-only view.
+
+A replica is only used while its replay lag is at most
+REPLICA_MAX_LAG_SECONDS. Each worker measures the lag of its replicas at
+most every REPLICA_LAG_CHECK_SECONDS; a replica that lags or can't be
+reached is skipped until the next check, and with no usable replica the
+view reads from the primary.
+
+Replication is asynchronous, so a user could read from a replica that has
+not yet replayed their own write. After a successful POST/PUT/PATCH/DELETE
+by an authenticated user, that user's read-only views stay on the primary
+for REPLICA_STICKY_SECONDS. The marker is kept in REPLICA_STICKY_STORAGE_URI
+(the rate limit storage by default), so every worker sees it.
+"""
+import random
+import threading
+import time
+from functools import wraps
+from flask import current_app, g, has_app_context, request
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy.session import Session
+from limits.storage import storage_from_string
+from sqlalchemy import create_engine
+
+_WRITE_METHODS = frozenset(('POST', 'PUT', 'PATCH', 'DELETE'))
+
+# A database that is not a standby, like a second local database standing
+# in for a replica, has no lag
+_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+def measure_lag(engine):
+    """Replay lag of a replica in seconds, or None if it has not replayed anything yet."""
+    # A raw connection, so the check is not counted against the request's queries
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(_LAG_SQL)
+        lag = cursor.fetchone()[0]
+        cursor.close()
+        connection.rollback()
+    finally:
+        connection.close()
+    return None if lag is None else float(lag)
+
+class ReplicaSet:
+    """Per-app replica engines, the last measured lag of each and the sticky markers."""
+
+    def __init__(self, config):
+        options = config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        self.engines = {
+            f'replica_{index}': create_engine(uri, **{**options, 'pool_logging_name': f'replica_{index}'})
+            for index, uri in enumerate(config['SQLALCHEMY_REPLICA_URIS'])
+        }
+        self.keys = list(self.engines)
+        self.lags = dict.fromkeys(self.keys)  # None: unreachable or not measured yet
+        self._checked_at = 0.0
+        self._checking = threading.Lock()
+        self._storage = storage_from_string(config['REPLICA_STICKY_STORAGE_URI']) if self.keys else None
+
+    def usable(self):
+        """Keys of the replicas within REPLICA_MAX_LAG_SECONDS, measuring them if due."""
+        config = current_app.config
+        now = time.monotonic()
+        # One request per worker measures; the others use the previous numbers meanwhile
+        if now - self._checked_at >= config['REPLICA_LAG_CHECK_SECONDS'] and self._checking.acquire(blocking=False):
+            try:
+                self._checked_at = now
+                for key in self.keys:
+                    self._measure(key, self.engines[key], config['REPLICA_MAX_LAG_SECONDS'])
+            finally:
+                self._checking.release()
+        max_lag = config['REPLICA_MAX_LAG_SECONDS']
+        return [key for key, lag in self.lags.items() if lag is not None and lag <= max_lag]
+
+    def _measure(self, key, engine, max_lag):
+        previous = self.lags[key]
+        try:
+            lag = measure_lag(engine)
+        except Exception as e:
+            lag = None
+            if previous is not None:
+                current_app.logger.warning(f"Replica {key} is unavailable, reading from the primary: {e}")
+        else:
+            if lag is not None and lag > max_lag and (previous is None or previous <= max_lag):
+                current_app.logger.warning(f"Replica {key} is {lag:.1f}s behind, reading from the primary")
+        self.lags[key] = lag
+
+    def mark_write(self, identity):
+        self._storage.incr(f'replica-sticky/{identity}', current_app.config['REPLICA_STICKY_SECONDS'],
+                           elastic_expiry=True)
+
+    def is_sticky(self, identity):
+        return self._storage.get(f'replica-sticky/{identity}') > 0
+
+class RoutingSession(Session):
+    """Session that sends the reads of a read-only view to the replica picked for it."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_app_context():
+            replica = g.get('db_replica')
+            if replica is not None and not getattr(clause, 'is_dml', False):
+                return replica
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+def _identity():
+    # Only views behind @jwt_required() have one; anonymous reads are never sticky
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        return None
+
+def _choose_replica():
+    """The engine the current read-only view should read from, or None for the primary."""
+    replicas = current_app.extensions.get('replicas')
+    if replicas is None or not replicas.keys:
+        return None
+    identity = _identity()
+    if identity is not None:
+        try:
+            if replicas.is_sticky(identity):
+                return None
+        except Exception:
+            current_app.logger.exception("Could not check for recent writes; reading from the primary")
+            return None
+    usable = replicas.usable()
+    return replicas.engines[random.choice(usable)] if usable else None
+
+def read_only(view):
+    """Run the decorated view's queries on a replica when one is usable."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_replica = _choose_replica()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g.pop('db_replica', None)
+    return wrapper
+
+def setup_replicas(app):
+    replicas = app.extensions['replicas'] = ReplicaSet(app.config)
+    if not replicas.keys:
+        return app
+
+    @app.after_request
+    def remember_writes(response):
+        if request.method in _WRITE_METHODS and response.status_code < 400:
+            identity = _identity()
+            if identity is not None:
+                try:
+                    replicas.mark_write(identity)
+                except Exception:
+                    current_app.logger.exception("Could not record a write for read-your-writes")
+        return response
+
+    return app
@@ -0,0 +1,165 @@
+"""Access token revocation: a denylist table with an in-memory Bloom filter in front.
+
+Revoked access tokens are recorded by jti in revoked_tokens. Revoking
+everything a user holds (admin action) records a `user:<id>` key instead,
+which rejects that user's tokens issued before the revocation.
+
+Every @jwt_required request asks `is_revoked`. Each worker keeps a Bloom
+filter of all denylisted keys and tops it up with rows newer than the last
+one it saw at most every REVOCATION_REFRESH_SECONDS. A token whose keys are
+not in the filter is certainly not revoked, which is the common case and
+costs a few hash probes; only possible hits are checked against the table.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from sqlalchemy.dialects.postgresql import insert
+from . import db
+from .models import RevokedToken
+
+# Row ids are taken before commit, so a row can become visible after one with
+# a higher id; each refresh re-reads this many ids below the high-water mark
+_ID_OVERLAP = 100
+
+def _now():
+    # Revocation times are stored as naive UTC, like refresh tokens
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def user_key(user_id):
+    return f'user:{user_id}'
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        """Set the bits of `key`. Only keys that set a new bit are counted, so re-adding is free."""
+        added = False
+        for position in self._positions(key):
+            mask = 1 << (position & 7)
+            if not self._bits[position >> 3] & mask:
+                self._bits[position >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+
+    def __contains__(self, key):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class RevocationList:
+    """Per-worker view of the denylist."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._filter = None
+        self._last_id = 0
+        self._checked_at = 0.0
+        self._built_at = 0.0
+
+    def _rebuild(self):
+        config = current_app.config
+        rows = db.session.execute(db.select(RevokedToken.id, RevokedToken.jti)).all()
+        bloom = BloomFilter(max(config['REVOCATION_BLOOM_CAPACITY'], 2 * len(rows)),
+                            config['REVOCATION_BLOOM_ERROR_RATE'])
+        for row in rows:
+            bloom.add(row.jti)
+        self._filter = bloom
+        self._last_id = max((row.id for row in rows), default=0)
+        self._built_at = time.monotonic()
+
+    def refresh(self, force=False):
+        """Add rows revoked since the last refresh, at most once per interval.
+
+        The filter is rebuilt from scratch when it fills up and every
+        REVOCATION_REBUILD_SECONDS, which drops keys purged from the table.
+        """
+        config = current_app.config
+        now = time.monotonic()
+        if not force and self._filter is not None and now - self._checked_at < config['REVOCATION_REFRESH_SECONDS']:
+            return
+        with self._lock:
+            self._checked_at = now
+            if self._filter is None or now - self._built_at >= config['REVOCATION_REBUILD_SECONDS']:
+                self._rebuild()
+                return
+            rows = db.session.execute(
+                db.select(RevokedToken.id, RevokedToken.jti).filter(RevokedToken.id > self._last_id - _ID_OVERLAP)
+            ).all()
+            for row in rows:
+                self._filter.add(row.jti)
+                self._last_id = max(self._last_id, row.id)
+            if self._filter.count > self._filter.capacity:
+                self._rebuild()
+
+    def add(self, key):
+        """Make a revocation made by this worker effective here immediately."""
+        if self._filter is not None:
+            self._filter.add(key)
+
+    def clear(self):
+        with self._lock:
+            self._filter = None
+            self._last_id = 0
+
+    def is_revoked(self, payload):
+        """True if the decoded JWT `payload` has been revoked."""
+        self.refresh()
+        jti_key, owner_key = payload['jti'], user_key(payload['sub'])
+        candidates = [key for key in (jti_key, owner_key) if key in self._filter]
+        if not candidates:
+            return False
+        rows = db.session.execute(
+            db.select(RevokedToken.jti, RevokedToken.revoked_at).filter(RevokedToken.jti.in_(candidates))
+        ).all()
+        for row in rows:
+            if row.jti == jti_key:
+                return True
+            # user-wide revocation: tokens issued before it are revoked
+            if datetime.fromtimestamp(payload['iat'], timezone.utc).replace(tzinfo=None) <= row.revoked_at:
+                return True
+        return False
+
+revocation_list = RevocationList()
+
+def _record(key, expires_at):
+    stmt = insert(RevokedToken).values(jti=key, revoked_at=_now(), expires_at=expires_at)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[RevokedToken.jti],
+        set_={'revoked_at': stmt.excluded.revoked_at, 'expires_at': stmt.excluded.expires_at}
+    ))
+    revocation_list.add(key)
+
+def revoke_token(payload):
+    """Denylist one access token until it would have expired. Caller commits."""
+    expires_at = datetime.fromtimestamp(payload['exp'], timezone.utc).replace(tzinfo=None)
+    _record(payload['jti'], expires_at)
+
+def revoke_user_tokens(user_id):
+    """Reject every access token issued to `user_id` so far. Caller commits."""
+    lifetime = current_app.config['JWT_ACCESS_TOKEN_EXPIRES']
+    if lifetime is False:
+        lifetime = timedelta(days=3650)  # tokens never expire; keep the row around
+    elif not isinstance(lifetime, timedelta):
+        lifetime = timedelta(seconds=lifetime)
+    _record(user_key(user_id), _now() + lifetime)
+
+def purge_expired_revocations():
+    """Delete denylist rows whose tokens have expired anyway. Returns the number deleted."""
+    result = db.session.execute(db.delete(RevokedToken).where(RevokedToken.expires_at <= _now()))
+    db.session.commit()
+    return result.rowcount
@@ -1,30 +1,141 @@
-from flask import Blueprint, request, jsonify
+import csv
+import io
+import json
+import math
+import zlib
+from datetime import datetime, timedelta
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy import func
-from . import db
-from .models import Food, FoodLog
+from sqlalchemy import and_, case, cast, func, insert, literal, or_, tuple_
+from . import db, feed
+from .food_index import food_index, next_catalog_version
+from .models import DailyNutrition, Food, FoodLog, User, madrid_now, madrid_tz, madrid_wall_time
+from .nutrition import add_to_daily_totals
+from .queries import query_budget
+from .ratelimit import read_limit
+from .replicas import read_only
+from .security import limiter
+from .utils import decode_cursor, encode_cursor, parse_date_arg, parse_limit
 
 routes_bp = Blueprint('routes', __name__)
 
-@routes_bp.route('/foods', methods=['GET'])
-def search_foods():
-    query = request.args.get('query', '')
-    
-    # Using unaccent and case-insensitive search
-    foods = Food.query.filter(
-        func.unaccent(func.lower(Food.name)).like(
-            func.unaccent(func.lower(f"%{query}%"))
-        )
-    ).all()
-    
-    return jsonify([{
+def _escape_like(value):
+    """Escape LIKE wildcards so user input is matched literally."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def _search_key(value):
+    """Accent-folded, lower-cased form of a name; matches the trigram index expression."""
+    return func.f_unaccent(func.lower(value))
+
+def _serialize_food(food):
+    return {
         "id": food.id,
         "name": food.name,
         "calories_per_100g": food.calories_per_100g,
         "protein_per_100g": food.protein_per_100g,
         "carbs_per_100g": food.carbs_per_100g,
         "fat_per_100g": food.fat_per_100g
-    } for food in foods])
+    }
+
+@routes_bp.route('/foods', methods=['GET'])
+@limiter.limit(read_limit)
+@query_budget(2)
+@read_only
+def search_foods():
+    """Search foods by name, best matches first.
+
+    Results are ranked by trigram similarity, with exact and prefix matches
+    boosted, and paginated with `limit` and an opaque `cursor`. The cursor for
+    the next page, if any, is returned in the X-Next-Cursor header.
+    """
+    return _search_foods()
+
+def _search_foods():
+    # Shared with the autocomplete fallback, which is rate limited on its own
+    query = request.args.get('query', '').strip()
+    try:
+        limit = parse_limit('SEARCH_DEFAULT_LIMIT', 'SEARCH_MAX_LIMIT')
+        after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    name_key = _search_key(Food.name)
+    stmt = db.select(Food)
+
+    if query:
+        term = _search_key(query)
+        pattern = _escape_like(query)
+        prefix = name_key.like(_search_key(pattern + '%'), escape='\\')
+        if len(query) < current_app.config['SEARCH_MIN_INFIX_LENGTH']:
+            # Too short for trigrams to narrow an infix match down
+            stmt = stmt.filter(prefix)
+        else:
+            stmt = stmt.filter(name_key.like(_search_key('%' + pattern + '%'), escape='\\'))
+        score = cast(
+            func.similarity(name_key, term)
+            + case((name_key == term, 2.0), (prefix, 1.0), else_=0.0),
+            db.Float
+        )
+    else:
+        score = None
+
+    if after is not None:
+        try:
+            after_score, after_id = float(after[0]), int(after[1])
+        except (IndexError, TypeError, ValueError):
+            return jsonify({"message": "Invalid cursor"}), 400
+        if score is None:
+            stmt = stmt.filter(Food.id > after_id)
+        else:
+            stmt = stmt.filter(or_(
+                score < after_score,
+                and_(score == after_score, Food.id > after_id)
+            ))
+
+    if score is None:
+        # No query: plain catalog browsing in id order
+        score = literal(0.0, db.Float)
+        stmt = stmt.order_by(Food.id)
+    else:
+        stmt = stmt.order_by(score.desc(), Food.id)
+    rows = db.session.execute(
+        stmt.add_columns(score.label('score')).limit(limit + 1)
+    ).all()
+
+    response = jsonify([_serialize_food(food) for food, _ in rows[:limit]])
+    if len(rows) > limit:
+        last_food, last_score = rows[limit - 1]
+        response.headers['X-Next-Cursor'] = encode_cursor(last_score, last_food.id)
+    return response
+
+@routes_bp.route('/foods/autocomplete', methods=['GET'])
+@limiter.limit(read_limit)
+@query_budget(2)
+@read_only
+def autocomplete_foods():
+    """Suggest foods for a partially typed name from the worker's in-memory index.
+
+    Falls back to the database-backed search when FOOD_INDEX_ENABLED is off
+    or the index can't be built or refreshed.
+    """
+    if not current_app.config['FOOD_INDEX_ENABLED']:
+        return _search_foods()
+
+    try:
+        limit = parse_limit('AUTOCOMPLETE_DEFAULT_LIMIT', 'AUTOCOMPLETE_MAX_LIMIT')
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    try:
+        food_index.refresh()
+    except Exception:
+        db.session.rollback()
+        if not food_index.loaded:
+            current_app.logger.exception("Could not build the food index; falling back to database search")
+            return _search_foods()
+        # A failed refresh leaves the previous data in place; keep serving it
+        current_app.logger.exception("Could not refresh the food index; serving the previous version")
+    return jsonify(food_index.search(request.args.get('query', ''), limit))
 
 @routes_bp.route('/foods', methods=['POST'])
 @jwt_required()
@@ -49,7 +160,8 @@ def create_food():
         calories_per_100g=calories,
         protein_per_100g=data.get('protein_per_100g'),
         carbs_per_100g=data.get('carbs_per_100g'),
-        fat_per_100g=data.get('fat_per_100g')
+        fat_per_100g=data.get('fat_per_100g'),
+        catalog_version=next_catalog_version()
     )
     
     db.session.add(food)
@@ -57,18 +169,20 @@ def create_food():
     
     return jsonify({
         "message": "Food created successfully",
-        "food": {
-            "id": food.id,
-            "name": food.name,
-            "calories_per_100g": food.calories_per_100g,
-            "protein_per_100g": food.protein_per_100g,
-            "carbs_per_100g": food.carbs_per_100g,
-            "fat_per_100g": food.fat_per_100g
-        }
+        "food": _serialize_food(food)
     }), 201
 
+def _validate_grams(grams):
+    """Return an error message if grams is out of range, else None."""
+    if grams <= 0:
+        return "Grams must be greater than 0"
+    if grams > 5000:  # 5kg limit
+        return "Grams amount seems unusually large"
+    return None
+
 @routes_bp.route('/food_logs', methods=['POST'])
 @jwt_required()
+@query_budget(7)
 def log_food():
     data = request.get_json()
     current_user_id = get_jwt_identity()
@@ -76,12 +190,10 @@ def log_food():
     if not data or 'food_id' not in data or 'grams' not in data:
         return jsonify({"message": "Missing required fields"}), 422
 
-    # Validate grams
     grams = float(data['grams'])
-    if grams <= 0:
-        return jsonify({"message": "Grams must be greater than 0"}), 422
-    if grams > 5000:  # 5kg limit
-        return jsonify({"message": "Grams amount seems unusually large"}), 422
+    error = _validate_grams(grams)
+    if error:
+        return jsonify({"message": error}), 422
 
     food = db.session.get(Food, data['food_id'])
     if not food:
@@ -90,25 +202,338 @@ def log_food():
     food_log = FoodLog(
         user_id=int(current_user_id),
         food_id=data['food_id'],
-        grams=grams
+        grams=grams,
+        log_date=madrid_now()
     )
     
     db.session.add(food_log)
+    db.session.flush()
+    add_to_daily_totals([(food_log.user_id, food_log.log_date, grams, food)])
+    feed.fan_out([{
+        "id": food_log.id,
+        "user_id": food_log.user_id,
+        "log_date": food_log.log_date,
+        "food_id": food_log.food_id,
+        "grams": grams
+    }])
     db.session.commit()
     
     return jsonify({"message": "Food log created successfully"}), 201
 
+@routes_bp.route('/food_logs/batch', methods=['POST'])
+@jwt_required()
+@query_budget(7)
+def log_food_batch():
+    """Create many food logs in one transaction, e.g. when syncing offline meals.
+
+    Expects {"entries": [{"food_id", "grams", "log_date"?}, ...]}; a log_date
+    with a UTC offset is converted to Madrid time. Every entry
+    is validated, food ids are checked with a single query and the valid rows
+    are written with one multi-row INSERT. Each entry gets its own result, so
+    invalid entries don't prevent the rest from being stored.
+    """
+    data = request.get_json(silent=True)
+    current_user_id = int(get_jwt_identity())
+    entries = data.get('entries') if isinstance(data, dict) else None
+
+    if not isinstance(entries, list) or not entries:
+        return jsonify({"message": "entries must be a non-empty list"}), 422
+    max_entries = current_app.config['FOOD_LOG_BATCH_MAX']
+    if len(entries) > max_entries:
+        return jsonify({"message": f"Too many entries (max {max_entries})"}), 413
+
+    results = [None] * len(entries)
+    pending = []  # (index, row) pairs that passed validation
+
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict) or 'food_id' not in entry or 'grams' not in entry:
+            results[index] = {"index": index, "status": 422, "message": "Missing required fields"}
+            continue
+        food_id = entry['food_id']
+        if not isinstance(food_id, int) or isinstance(food_id, bool):
+            results[index] = {"index": index, "status": 422, "message": "food_id must be an integer"}
+            continue
+        try:
+            grams = float(entry['grams'])
+        except (TypeError, ValueError):
+            grams = None
+        if grams is None or not math.isfinite(grams):
+            results[index] = {"index": index, "status": 422, "message": "grams must be a finite number"}
+            continue
+        error = _validate_grams(grams)
+        if error:
+            results[index] = {"index": index, "status": 422, "message": error}
+            continue
+        if entry.get('log_date'):
+            try:
+                log_date = datetime.fromisoformat(entry['log_date'])
+            except (TypeError, ValueError):
+                results[index] = {"index": index, "status": 422, "message": "Invalid log_date, use ISO 8601"}
+                continue
+            # Stored like every other row: naive Madrid wall time
+            log_date = madrid_wall_time(log_date)
+        else:
+            log_date = madrid_now()
+        pending.append((index, {
+            "user_id": current_user_id,
+            "food_id": food_id,
+            "grams": grams,
+            "log_date": log_date
+        }))
+
+    # One IN query for every referenced food
+    food_ids = {row['food_id'] for _, row in pending}
+    foods = {food.id: food for food in db.session.execute(
+        db.select(Food).filter(Food.id.in_(food_ids))
+    ).scalars()} if food_ids else {}
+
+    valid = []
+    for index, row in pending:
+        if row['food_id'] in foods:
+            valid.append((index, row))
+        else:
+            results[index] = {"index": index, "status": 404, "message": "Food not found"}
+
+    if valid:
+        log_ids = db.session.execute(
+            insert(FoodLog).returning(FoodLog.id, sort_by_parameter_order=True),
+            [row for _, row in valid]
+        ).scalars().all()
+        add_to_daily_totals(
+            (row['user_id'], row['log_date'], row['grams'], foods[row['food_id']])
+            for _, row in valid
+        )
+        feed.fan_out([dict(row, id=log_id) for (_, row), log_id in zip(valid, log_ids)])
+        db.session.commit()
+        for (index, _), log_id in zip(valid, log_ids):
+            results[index] = {"index": index, "status": 201, "id": log_id}
+
+    created = len(valid)
+    if created == len(entries):
+        status = 201
+    elif created:
+        status = 207  # Multi-Status: some entries failed
+    else:
+        status = 422
+    return jsonify({
+        "created": created,
+        "failed": len(entries) - created,
+        "results": results
+    }), status
+
+@routes_bp.route('/food_logs/summary', methods=['GET'])
+@limiter.limit(read_limit)
+@jwt_required()
+@query_budget(3)
+@read_only
+def get_nutrition_summary():
+    """Daily calories and macros for the current user against their calorie goal.
+
+    `from`/`to` (YYYY-MM-DD, inclusive) default to today. Reads the
+    daily_nutrition rollups, so any range costs one indexed range scan.
+    """
+    current_user_id = int(get_jwt_identity())
+    try:
+        today = datetime.now(madrid_tz).date()
+        start = parse_date_arg('from') or today
+        end = parse_date_arg('to') or max(start, today)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    if end < start:
+        return jsonify({"message": "from must not be after to"}), 400
+    max_days = current_app.config['NUTRITION_SUMMARY_MAX_DAYS']
+    if (end - start).days + 1 > max_days:
+        return jsonify({"message": f"Date range is limited to {max_days} days"}), 400
+
+    goal = db.session.execute(
+        db.select(User.daily_calorie_goal).filter_by(id=current_user_id)
+    ).scalar()
+    rollups = {row.day: row for row in db.session.execute(
+        db.select(DailyNutrition).filter(
+            DailyNutrition.user_id == current_user_id,
+            DailyNutrition.day.between(start, end)
+        )
+    ).scalars()}
+
+    days = []
+    totals = {"calories": 0.0, "protein": 0.0, "carbs": 0.0, "fat": 0.0, "log_count": 0}
+    day = start
+    while day <= end:
+        row = rollups.get(day)
+        entry = {
+            "date": day.isoformat(),
+            "calories": row.calories if row else 0.0,
+            "protein": row.protein if row else 0.0,
+            "carbs": row.carbs if row else 0.0,
+            "fat": row.fat if row else 0.0,
+            "log_count": row.log_count if row else 0
+        }
+        entry["remaining_calories"] = goal - entry["calories"] if goal is not None else None
+        for key in totals:
+            totals[key] += entry[key]
+        days.append(entry)
+        day += timedelta(days=1)
+
+    return jsonify({
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "daily_calorie_goal": goal,
+        "days": days,
+        "totals": totals
+    }), 200
+
+_EXPORT_FIELDS = ['id', 'log_date', 'food_id', 'food_name', 'grams', 'calories', 'protein', 'carbs', 'fat']
+
+def _export_record(row):
+    def per_grams(value):
+        return value * row.grams / 100 if value is not None else None
+    return {
+        "id": row.id,
+        "log_date": row.log_date.isoformat(),
+        "food_id": row.food_id,
+        "food_name": row.name,
+        "grams": row.grams,
+        "calories": per_grams(row.calories_per_100g),
+        "protein": per_grams(row.protein_per_100g),
+        "carbs": per_grams(row.carbs_per_100g),
+        "fat": per_grams(row.fat_per_100g)
+    }
+
+@routes_bp.route('/food_logs/export', methods=['GET'])
+@limiter.limit(read_limit)
+@jwt_required()
+def export_food_logs():
+    """Stream the current user's complete log history, oldest first.
+
+    `format` is `ndjson` (default) or `csv`; optional `from`/`to`
+    (YYYY-MM-DD, inclusive) restrict the range. Rows come off a server-side
+    cursor FOOD_LOG_EXPORT_CHUNK_ROWS at a time and are written out (gzipped
+    if the client accepts it) as they arrive, so memory use does not grow
+    with the history.
+    """
+    current_user_id = int(get_jwt_identity())
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({"message": "format must be ndjson or csv"}), 400
+    try:
+        start = parse_date_arg('from')
+        end = parse_date_arg('to')
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    stmt = db.select(
+        FoodLog.id, FoodLog.log_date, FoodLog.food_id, FoodLog.grams,
+        Food.name, Food.calories_per_100g, Food.protein_per_100g,
+        Food.carbs_per_100g, Food.fat_per_100g
+    ).join(Food, Food.id == FoodLog.food_id).filter(
+        FoodLog.user_id == current_user_id,
+        FoodLog.log_date.isnot(None)
+    )
+    if start:
+        stmt = stmt.filter(FoodLog.log_date >= start)
+    if end:
+        stmt = stmt.filter(FoodLog.log_date < end + timedelta(days=1))
+    stmt = stmt.order_by(FoodLog.log_date, FoodLog.id)
+    chunk_rows = current_app.config['FOOD_LOG_EXPORT_CHUNK_ROWS']
+    gzipped = 'gzip' in request.accept_encodings
+
+    def chunks():
+        buffer = io.StringIO()
+        writer = None
+        if export_format == 'csv':
+            writer = csv.DictWriter(buffer, fieldnames=_EXPORT_FIELDS)
+            writer.writeheader()
+            yield buffer.getvalue()
+        result = db.session.execute(stmt.execution_options(yield_per=chunk_rows))
+        for partition in result.partitions():
+            buffer.seek(0)
+            buffer.truncate()
+            for row in partition:
+                if writer:
+                    writer.writerow(_export_record(row))
+                else:
+                    buffer.write(json.dumps(_export_record(row)) + '\n')
+            yield buffer.getvalue()
+
+    def body():
+        if not gzipped:
+            for chunk in chunks():
+                if chunk:
+                    yield chunk.encode()
+            return
+        # wbits=31 writes a gzip header and trailer; sync-flush every chunk so
+        # each one reaches the client as soon as it is read
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        yield compressor.flush(zlib.Z_SYNC_FLUSH)  # gzip header, before the query runs
+        for chunk in chunks():
+            yield compressor.compress(chunk.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(body()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=food_logs.{export_format}'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if gzipped:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
 @routes_bp.route('/food_logs/<int:user_id>', methods=['GET'])
+@limiter.limit(read_limit)
 @jwt_required()
+@query_budget(2)
+@read_only
 def get_user_food_logs(user_id):
+    """List a user's food logs, newest first.
+
+    Optional `from`/`to` (YYYY-MM-DD, inclusive) restrict the date range.
+    Pages hold at most `limit` logs; the cursor for the next page, if any, is
+    returned in the X-Next-Cursor header.
+    """
     current_user_id = get_jwt_identity()
     if int(current_user_id) != user_id:
         return jsonify({"message": "Unauthorized"}), 403
-        
-    logs = FoodLog.query.filter_by(user_id=user_id).all()
-    return jsonify([{
-        "food_name": log.food.name,
-        "grams": log.grams,
-        "calories": (log.food.calories_per_100g * log.grams) / 100,
-        "log_date": log.log_date
-    } for log in logs]), 200
\ No newline at end of file
+
+    try:
+        limit = parse_limit('FOOD_LOGS_DEFAULT_LIMIT', 'FOOD_LOGS_MAX_LIMIT')
+        start = parse_date_arg('from')
+        end = parse_date_arg('to')
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    after = None
+    if request.args.get('cursor'):
+        try:
+            log_date, log_id = decode_cursor(request.args['cursor'])
+            after = (datetime.fromisoformat(log_date), int(log_id))
+        except (TypeError, ValueError):
+            return jsonify({"message": "Invalid cursor"}), 400
+
+    # Single joined query walking the (user_id, log_date, id) index
+    stmt = db.select(
+        FoodLog.id, FoodLog.grams, FoodLog.log_date,
+        Food.name, Food.calories_per_100g
+    ).join(Food, Food.id == FoodLog.food_id).filter(
+        FoodLog.user_id == user_id,
+        # Legacy rows from before log_date became NOT NULL can't be placed
+        # in (log_date, id) order or encoded in a cursor
+        FoodLog.log_date.isnot(None)
+    )
+    if start:
+        stmt = stmt.filter(FoodLog.log_date >= start)
+    if end:
+        stmt = stmt.filter(FoodLog.log_date < end + timedelta(days=1))
+    if after:
+        stmt = stmt.filter(tuple_(FoodLog.log_date, FoodLog.id) < after)
+    rows = db.session.execute(
+        stmt.order_by(FoodLog.log_date.desc(), FoodLog.id.desc()).limit(limit + 1)
+    ).all()
+
+    response = jsonify([{
+        "food_name": row.name,
+        "grams": row.grams,
+        "calories": (row.calories_per_100g * row.grams) / 100,
+        "log_date": row.log_date
+    } for row in rows[:limit]])
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        response.headers['X-Next-Cursor'] = encode_cursor(last.log_date.isoformat(), last.id)
+    return response, 200
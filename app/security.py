@@ -1,16 +1,13 @@
 from flask import request, g
 from flask_cors import CORS
 from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
 from functools import wraps
 import time
 import os
+from .ratelimit import rate_limit_key
 
-limiter = Limiter(
-    key_func=get_remote_address,
-    default_limits=["100 per hour", "5 per second"],
-    storage_uri="memory://"  # Change to redis:// in production
-)
+# Storage, strategy and default limits come from the RATELIMIT_* config keys
+limiter = Limiter(key_func=rate_limit_key)
 
 def setup_security(app):
     # More permissive CORS for development
@@ -25,7 +22,6 @@ def setup_security(app):
         }
     })
     
-    # Setup rate limiter with more permissive limits for development
     limiter.init_app(app)
     
     # Simplified security headers for development
@@ -39,16 +35,16 @@ def setup_security(app):
             response.headers['X-Frame-Options'] = 'SAMEORIGIN'
         return response
     
-    # Request timing middleware
+    # Request timing middleware; per-route latency histograms live in metrics.py
     @app.before_request
     def start_timer():
-        g.start = time.time()
+        g.start = time.perf_counter()
     
     @app.after_request
     def log_request(response):
         if hasattr(g, 'start'):
-            total_time = time.time() - g.start
-            app.logger.info(f'Request to {request.path} took {total_time:.2f}s')
+            total_ms = (time.perf_counter() - g.start) * 1000
+            app.logger.info(f'{request.method} {request.url_rule or request.path} {response.status_code} took {total_ms:.1f}ms')
         return response
     
     return app
\ No newline at end of file
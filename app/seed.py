@@ -0,0 +1,272 @@
+"""`flask seed`: a synthetic dataset at production scale, for benchmarks.
+
+Generates users with a power-law follower graph (a few users followed by a
+large share of everyone, most by a handful), foods with Zipf-distributed
+popularity, and food logs spread over the days before --end-date, busier
+users logging more. Rows are streamed into Postgres with COPY in chunks,
+monthly food_logs partitions are created before loading, and the derived
+tables (daily_nutrition, feed_entries, follow counters) are filled with one
+INSERT ... SELECT each, so tens of millions of logs load in minutes.
+
+The same --seed and --end-date give the same rows, ids included, so runs
+can be compared. The target tables must be empty; --reset truncates them.
+"""
+import io
+import itertools
+import math
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import text
+from . import db
+from .food_index import next_catalog_version
+from .partitions import ensure_log_partitions
+from .passwords import passwords
+
+_CHUNK_ROWS = 100000
+
+_TABLES = (
+    'users', 'foods', 'followers', 'food_logs', 'daily_nutrition', 'feed_entries',
+    'refresh_tokens', 'revoked_tokens', 'catalog_state'
+)
+
+_FOODS = (
+    'apple', 'banana', 'orange juice', 'oatmeal', 'brown rice', 'white rice', 'quinoa', 'lentils',
+    'chickpeas', 'black beans', 'tofu', 'tempeh', 'chicken breast', 'turkey', 'salmon', 'tuna',
+    'cod', 'shrimp', 'beef steak', 'pork loin', 'lamb chop', 'egg', 'greek yogurt', 'cottage cheese',
+    'cheddar', 'manchego', 'mozzarella', 'whole milk', 'almond milk', 'almonds', 'walnuts', 'peanut butter',
+    'avocado', 'broccoli', 'spinach', 'kale', 'carrot', 'sweet potato', 'potato', 'tomato',
+    'cucumber', 'bell pepper', 'jalapeño', 'mushroom', 'onion', 'garlic', 'olive oil', 'butter',
+    'bread', 'bagel', 'tortilla', 'pasta', 'pizza', 'burrito', 'paella', 'gazpacho',
+    'jamón serrano', 'crème fraîche', 'crêpe', 'café au lait', 'açaí bowl', 'piña colada', 'purée', 'croissant',
+)
+_PREPARATIONS = (
+    'raw', 'boiled', 'steamed', 'grilled', 'roasted', 'baked', 'fried', 'sautéed', 'smoked', 'dried',
+    'frozen', 'canned', 'organic', 'low fat', 'reduced sodium', 'homemade', 'spicy', 'sweetened',
+    'unsweetened', 'whole grain', 'marinated', 'braised', 'poached', 'pickled', 'toasted',
+)
+_STYLES = (
+    'classic', 'mediterranean', 'mexican', 'thai', 'andalusian', 'basque', 'catalan', 'greek',
+    'italian', 'japanese', 'indian', 'french', 'american', 'lebanese', 'peruvian', 'korean',
+)
+
+def _zipf_cum_weights(n, alpha):
+    return list(itertools.accumulate(1 / (rank ** alpha) for rank in range(1, n + 1)))
+
+def _food_names(count):
+    names = (f'{prep} {food}'.capitalize() for food in _FOODS for prep in _PREPARATIONS)
+    styled = (f'{prep} {food}, {style}'.capitalize() for style in _STYLES for food in _FOODS for prep in _PREPARATIONS)
+    numbered = (f'Food {i}' for i in itertools.count(1))
+    return list(itertools.islice(itertools.chain(names, styled, numbered), count))
+
+def _copy(table, columns, rows):
+    """COPY an iterable of tuples into `table` in the current transaction."""
+    cursor = db.session.connection().connection.cursor()
+    buffer = io.StringIO()
+    buffer.writelines('\t'.join(map(str, row)) + '\n' for row in rows)
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+@contextmanager
+def _indexes_deferred(*tables):
+    """Drop the secondary indexes and foreign keys of `tables`, and rebuild them on exit.
+
+    Building an index once over the loaded rows is much cheaper than updating
+    it row by row, and one validating join per foreign key is much cheaper
+    than a trigger per row.
+    """
+    indexes, foreign_keys = [], []
+    for table in tables:
+        indexes += db.session.execute(text(
+            "SELECT i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid) FROM pg_index i "
+            "WHERE i.indrelid = CAST(:table AS regclass) "
+            "AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)"
+        ), {"table": table}).all()
+        foreign_keys += [(table, name, definition) for name, definition in db.session.execute(text(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = CAST(:table AS regclass) AND contype = 'f'"
+        ), {"table": table})]
+    for table, name, _ in foreign_keys:
+        db.session.execute(text(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"'))
+    for name, _ in indexes:
+        db.session.execute(text(f"DROP INDEX {name}"))
+    db.session.commit()
+    try:
+        yield
+    finally:
+        db.session.rollback()
+        done = _timed('indexes and foreign keys')
+        db.session.execute(text("SET LOCAL maintenance_work_mem = '512MB'"))
+        for _, definition in indexes:
+            # indexes of partitioned tables are reported ON ONLY, which would leave out the partitions
+            db.session.execute(text(definition.replace(' ON ONLY ', ' ON ', 1)))
+        for table, name, definition in foreign_keys:
+            db.session.execute(text(f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition}'))
+        db.session.commit()
+        done(len(indexes) + len(foreign_keys))
+
+def _follow_graph(rng, users, avg_follows, alpha):
+    """Return sorted (follower_id, followed_id) pairs with power-law in- and out-degrees."""
+    popular = list(range(1, users + 1))
+    rng.shuffle(popular)
+    cum_weights = _zipf_cum_weights(users, alpha)
+    cap = max(0, min(users // 2, avg_follows * 50))
+    edges = []
+    for follower in range(1, users + 1):
+        # Pareto(2) has mean 2, so this averages avg_follows with a long tail
+        wanted = min(cap, int(avg_follows / 2 * rng.paretovariate(2)))
+        followed = set()
+        while len(followed) < wanted:
+            followed.update(rng.choices(popular, cum_weights=cum_weights, k=wanted - len(followed)))
+            followed.discard(follower)
+        edges.extend((follower, other) for other in sorted(followed))
+    return edges
+
+def _timed(label):
+    start = time.perf_counter()
+    def done(rows):
+        seconds = time.perf_counter() - start
+        click.echo(f'{label}: {rows:,} rows in {seconds:.1f}s ({rows / max(seconds, 1e-9):,.0f}/s)')
+    return done
+
+def _load_logs(rng, users, foods, logs, start, end):
+    """COPY `logs` food logs between `start` and `end`, busier users and popular foods more often."""
+    done = _timed('food_logs')
+    active = list(range(1, users + 1))
+    rng.shuffle(active)
+    active_weights = _zipf_cum_weights(users, 0.7)
+    food_ids = list(range(1, foods + 1))
+    rng.shuffle(food_ids)
+    food_weights = _zipf_cum_weights(foods, 1.0)
+    span = int((end - start).total_seconds())
+    days = [str((start + timedelta(days=day)).date()) for day in range(span // 86400 + 1)]
+    chunks = max(1, math.ceil(logs / _CHUNK_ROWS))
+    log_id = 0
+    for chunk in range(chunks):
+        # Each chunk covers the next slice of time, so ids grow with log_date as in production
+        count = logs // chunks + (1 if chunk < logs % chunks else 0)
+        offset, width = span * chunk // chunks, span // chunks
+        seconds = sorted(offset + int(rng.random() * width) for _ in range(count))
+        user_ids = rng.choices(active, cum_weights=active_weights, k=count)
+        foods_logged = rng.choices(food_ids, cum_weights=food_weights, k=count)
+        rows = []
+        for second, user_id, food_id in zip(seconds, user_ids, foods_logged):
+            log_id += 1
+            day, second = divmod(second, 86400)
+            log_date = f'{days[day]} {second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}'
+            rows.append((log_id, user_id, food_id, round(rng.lognormvariate(4.8, 0.5), 1), log_date))
+        _copy('food_logs', ('id', 'user_id', 'food_id', 'grams', 'log_date'), rows)
+        db.session.commit()
+    done(logs)
+
+def _derive_from_logs(feed_cutoff, celebrity_followers):
+    """Fill daily_nutrition and feed_entries from the loaded logs."""
+    done = _timed('daily_nutrition')
+    result = db.session.execute(text(
+        "INSERT INTO daily_nutrition (user_id, day, calories, protein, carbs, fat, log_count) "
+        "SELECT l.user_id, l.log_date::date, "
+        "sum(coalesce(f.calories_per_100g, 0) * l.grams / 100), sum(coalesce(f.protein_per_100g, 0) * l.grams / 100), "
+        "sum(coalesce(f.carbs_per_100g, 0) * l.grams / 100), sum(coalesce(f.fat_per_100g, 0) * l.grams / 100), "
+        "count(*) "
+        "FROM food_logs l JOIN foods f ON f.id = l.food_id GROUP BY 1, 2"
+    ))
+    db.session.commit()
+    done(result.rowcount)
+
+    done = _timed('feed_entries')
+    # What fan-out-on-write would have left in the inboxes: every author's own
+    # logs, plus each follower's copy unless the author is a celebrity
+    result = db.session.execute(text(
+        "INSERT INTO feed_entries (owner_id, log_date, log_id, author_id, food_id, grams) "
+        "SELECT l.user_id, l.log_date, l.id, l.user_id, l.food_id, l.grams "
+        "FROM food_logs l WHERE l.log_date >= :cutoff "
+        "UNION ALL "
+        "SELECT f.follower_id, l.log_date, l.id, l.user_id, l.food_id, l.grams "
+        "FROM food_logs l JOIN followers f ON f.followed_id = l.user_id JOIN users u ON u.id = l.user_id "
+        "WHERE l.log_date >= :cutoff AND u.followers_count < :celebrity"
+    ), {"cutoff": feed_cutoff, "celebrity": celebrity_followers})
+    db.session.commit()
+    done(result.rowcount)
+
+@click.command('seed')
+@click.option('--users', default=10000, show_default=True)
+@click.option('--foods', default=2000, show_default=True)
+@click.option('--logs', default=1000000, show_default=True, help='Food logs to generate.')
+@click.option('--days', default=90, show_default=True, help='Logs are spread over this many days before --end-date.')
+@click.option('--end-date', type=click.DateTime(formats=['%Y-%m-%d']), help='Defaults to today.')
+@click.option('--avg-follows', default=20, show_default=True, help='Mean users followed per user.')
+@click.option('--follow-alpha', default=1.0, show_default=True, help='Zipf exponent of user popularity.')
+@click.option('--feed-days', type=int, help='Days of logs copied into feed inboxes; defaults to FOOD_LOG_RETENTION_DAYS.')
+@click.option('--password', default='password', show_default=True, help='Password of every generated user.')
+@click.option('--seed', 'seed', default=42, show_default=True, help='Random seed; the same seed gives the same data.')
+@click.option('--reset', is_flag=True, help='Truncate users, foods, logs and everything derived from them first.')
+@with_appcontext
+def seed_command(users, foods, logs, days, end_date, avg_follows, follow_alpha, feed_days, password, seed, reset):
+    """Fill the database with a deterministic synthetic dataset."""
+    config = current_app.config
+    rng = random.Random(seed)
+    end = datetime.combine((end_date or datetime.now()).date(), datetime.min.time())
+    start = end - timedelta(days=days)
+    if feed_days is None:
+        feed_days = config['FOOD_LOG_RETENTION_DAYS']
+
+    if reset:
+        db.session.execute(text(f"TRUNCATE {', '.join(_TABLES)} RESTART IDENTITY CASCADE"))
+        db.session.commit()
+    elif db.session.execute(text("SELECT EXISTS (SELECT 1 FROM users) OR EXISTS (SELECT 1 FROM foods)")).scalar():
+        raise click.ClickException('users or foods already has rows; pass --reset to replace them')
+
+    ensure_log_partitions(config['FOOD_LOG_PARTITION_MONTHS_AHEAD'], start=start)
+
+    done = _timed('foods')
+    version = next_catalog_version()
+    food_rows = []
+    for food_id, name in enumerate(_food_names(foods), 1):
+        calories = round(rng.uniform(15, 900), 1)
+        split = [rng.random() + 0.1 for _ in range(3)]
+        total = sum(split)
+        protein, carbs = (round(calories * share / total / 4, 1) for share in split[:2])
+        fat = round(calories * split[2] / total / 9, 1)
+        food_rows.append((food_id, name, calories, protein, carbs, fat, version))
+    _copy('foods', ('id', 'name', 'calories_per_100g', 'protein_per_100g', 'carbs_per_100g', 'fat_per_100g',
+                    'catalog_version'), food_rows)
+    db.session.commit()
+    done(foods)
+
+    done = _timed('followers')
+    edges = _follow_graph(rng, users, avg_follows, follow_alpha)
+    followers_count = [0] * (users + 1)
+    following_count = [0] * (users + 1)
+    for follower, followed in edges:
+        following_count[follower] += 1
+        followers_count[followed] += 1
+
+    password_hash = passwords.hash(password)
+    _copy('users', ('id', 'username', 'email', 'password_hash', 'daily_calorie_goal', 'joined_at',
+                    'followers_count', 'following_count'), (
+        (user_id, f'user{user_id}', f'user{user_id}@example.com', password_hash,
+         rng.randrange(1500, 3250, 50), start - timedelta(seconds=rng.randrange(365 * 86400)),
+         followers_count[user_id], following_count[user_id])
+        for user_id in range(1, users + 1)
+    ))
+    _copy('followers', ('follower_id', 'followed_id'), edges)
+    db.session.commit()
+    done(len(edges))
+
+    # Logs and the tables derived from them are loaded before their indexes are built
+    with _indexes_deferred('food_logs', 'daily_nutrition', 'feed_entries'):
+        _load_logs(rng, users, foods, logs, start, end)
+        _derive_from_logs(end - timedelta(days=feed_days), config['FEED_CELEBRITY_FOLLOWERS'])
+
+    for table in ('users', 'foods', 'food_logs'):
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), coalesce(max(id), 0) + 1, false) FROM {table}"
+        ))
+    db.session.execute(text(f"ANALYZE {', '.join(_TABLES)}"))
+    db.session.commit()
+    click.echo(f'Seeded {users:,} users, {foods:,} foods and {logs:,} food logs '
+               f'from {start.date()} to {end.date()} (seed {seed})')
@@ -0,0 +1,174 @@
+"""Slow-query log with EXPLAIN capture.
+
+Statements that take SLOW_QUERY_THRESHOLD_MS or longer are written as JSON
+lines to SLOW_QUERY_LOG_PATH, a rotating log. Each entry has the statement,
+its bound parameters with strings and bytes redacted, how long it took and
+the endpoint (or CLI command) that ran it.
+
+SELECTs also get an `EXPLAIN (ANALYZE, BUFFERS)` plan. The EXPLAIN runs the
+query again, so it is done on a background thread and its own connection,
+in a read-only transaction with SLOW_QUERY_EXPLAIN_TIMEOUT, and it is rate
+limited: at most SLOW_QUERY_EXPLAINS_PER_MINUTE plans, and one per statement
+every SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS. Skipped plans are marked as such.
+"""
+import datetime
+import decimal
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import RotatingFileHandler
+import click
+from flask import current_app, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('bytebites.slow_queries')
+logger.propagate = False
+
+_MAX_PENDING_EXPLAINS = 4
+
+def redact(value):
+    """Bound parameters with strings and bytes replaced by their length."""
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    if isinstance(value, str):
+        return f'<str len={len(value)}>'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f'<bytes len={len(value)}>'
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (datetime.date, datetime.time, decimal.Decimal)):
+        return str(value)
+    return f'<{type(value).__name__}>'
+
+def _explainable(statement):
+    head = statement.lstrip().upper()
+    return head.startswith(('SELECT', 'WITH')) and ' FOR UPDATE' not in head and ' FOR SHARE' not in head
+
+class SlowQueryLog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = set()
+        self._explained_at = {}  # statement -> monotonic time of its last plan
+        self._window_start = 0.0
+        self._window_count = 0
+
+    def init_app(self, app):
+        config = app.config
+        path = config['SLOW_QUERY_LOG_PATH']
+        if not any(getattr(handler, 'baseFilename', None) == path for handler in logger.handlers):
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+                handler.close()
+            handler = RotatingFileHandler(
+                path, maxBytes=config['SLOW_QUERY_LOG_MAX_BYTES'],
+                backupCount=config['SLOW_QUERY_LOG_BACKUPS'], delay=True
+            )
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+
+    def _may_explain(self, statement, config):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._pending) >= _MAX_PENDING_EXPLAINS:
+                return 'busy'
+            last = self._explained_at.get(statement)
+            if last is not None and now - last < config['SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS']:
+                return 'explained recently'
+            if now - self._window_start >= 60:
+                self._window_start, self._window_count = now, 0
+            if self._window_count >= config['SLOW_QUERY_EXPLAINS_PER_MINUTE']:
+                return 'rate limited'
+            self._window_count += 1
+            if len(self._explained_at) > 1000:
+                self._explained_at.clear()
+            self._explained_at[statement] = now
+            return None
+
+    def record(self, engine, statement, parameters, executemany, seconds):
+        config = current_app.config
+        entry = {
+            "at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            "duration_ms": round(seconds * 1000, 1),
+            "endpoint": request.endpoint if has_request_context() else _command_name(),
+            "statement": statement,
+            "parameters": redact(parameters[:1] if executemany else parameters),
+            "executemany": len(parameters) if executemany else None,
+        }
+        if not _explainable(statement) or executemany:
+            entry["plan"] = None
+            logger.info(json.dumps(entry))
+            return
+        skipped = self._may_explain(statement, config)
+        if skipped:
+            entry["plan"] = f'skipped: {skipped}'
+            logger.info(json.dumps(entry))
+            return
+        timeout = config['SLOW_QUERY_EXPLAIN_TIMEOUT']
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='slow-query-explain')
+            future = self._executor.submit(_explain_and_log, engine, statement, parameters, timeout, entry)
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def wait(self, timeout=None):
+        """Wait for queued EXPLAINs to be written (for tests and shutdown)."""
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            future.result(timeout)
+
+def _command_name():
+    ctx = click.get_current_context(silent=True)
+    return f'cli:{ctx.command_path}' if ctx is not None else None
+
+def _explain_and_log(engine, statement, parameters, timeout, entry):
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SET TRANSACTION READ ONLY")
+            cursor.execute("SELECT set_config('statement_timeout', %s, true)", (timeout,))
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters)
+            entry["plan"] = '\n'.join(row[0] for row in cursor.fetchall())
+        finally:
+            cursor.close()
+            connection.rollback()
+    except Exception as e:
+        entry["plan"] = f'unavailable: {type(e).__name__}: {str(e).strip()[:200]}'
+    finally:
+        connection.close()
+    logger.info(json.dumps(entry))
+
+slow_query_log = SlowQueryLog()
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['slow_query_start'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop('slow_query_start', None)
+    if start is None:
+        return
+    seconds = time.perf_counter() - start
+    if not has_app_context():
+        return  # e.g. the EXPLAIN thread itself
+    threshold = current_app.config['SLOW_QUERY_THRESHOLD_MS']
+    if threshold is None or seconds * 1000 < threshold:
+        return
+    try:
+        slow_query_log.record(conn.engine, statement, parameters, executemany, seconds)
+    except Exception:
+        current_app.logger.exception('Could not record a slow query')
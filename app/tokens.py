@@ -0,0 +1,93 @@
+"""Rotating refresh tokens.
+
+Login hands out a short-lived JWT access token plus an opaque refresh token.
+Refresh tokens are random strings; only their HMAC-SHA256 (keyed with
+REFRESH_TOKEN_HMAC_KEY) is stored, so checking one is an HMAC and a unique
+index lookup rather than an Argon2 verify.
+
+Each refresh token can be used once: `/auth/refresh` marks it used and issues
+the next token of the same family. Presenting an already-used token means it
+leaked, so the whole family is revoked and the client has to log in again.
+"""
+import hashlib
+import hmac
+import secrets
+import uuid
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from . import db
+from .models import RefreshToken
+
+class InvalidRefreshToken(Exception):
+    """Raised for unknown, expired, revoked or reused refresh tokens."""
+
+def _now():
+    # Refresh token times are stored as naive UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def _digest(token):
+    key = current_app.config['REFRESH_TOKEN_HMAC_KEY'].encode()
+    return hmac.new(key, token.encode(), hashlib.sha256).digest()
+
+def issue_refresh_token(user_id, family_id=None):
+    """Store a new refresh token for `user_id` and return it. Caller commits."""
+    token = secrets.token_urlsafe(32)
+    db.session.add(RefreshToken(
+        user_id=user_id,
+        family_id=family_id or uuid.uuid4(),
+        token_hash=_digest(token),
+        expires_at=_now() + timedelta(days=current_app.config['REFRESH_TOKEN_EXPIRES_DAYS'])
+    ))
+    return token
+
+def rotate_refresh_token(token):
+    """Use up `token` and return (user_id, next refresh token). Commits.
+
+    Raises InvalidRefreshToken if the token can't be used; a reused token also
+    revokes its family.
+    """
+    row = db.session.execute(
+        db.select(RefreshToken).filter_by(token_hash=_digest(token)).with_for_update()
+    ).scalar()
+    if row is None or row.revoked_at is not None or row.expires_at <= _now():
+        db.session.rollback()
+        raise InvalidRefreshToken()
+    if row.used_at is not None:
+        revoke_family(row.family_id)
+        db.session.commit()
+        current_app.logger.warning(f'Refresh token reuse for user {row.user_id}; revoked its family')
+        raise InvalidRefreshToken()
+
+    row.used_at = _now()
+    next_token = issue_refresh_token(row.user_id, row.family_id)
+    db.session.commit()
+    return row.user_id, next_token
+
+def revoke_family(family_id):
+    db.session.execute(
+        db.update(RefreshToken)
+        .where(RefreshToken.family_id == family_id, RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=_now())
+    )
+
+def revoke_refresh_token(token, user_id):
+    """Revoke the family of `token` if it belongs to `user_id`. Caller commits."""
+    family_id = db.session.execute(
+        db.select(RefreshToken.family_id).filter_by(token_hash=_digest(token), user_id=user_id)
+    ).scalar()
+    if family_id is not None:
+        revoke_family(family_id)
+
+def revoke_user_refresh_tokens(user_id):
+    """Revoke every live refresh token of a user. Caller commits."""
+    db.session.execute(
+        db.update(RefreshToken)
+        .where(RefreshToken.user_id == user_id, RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=_now())
+    )
+
+def purge_expired_refresh_tokens():
+    """Delete refresh tokens past their expiry. Returns the number deleted."""
+    result = db.session.execute(db.delete(RefreshToken).where(RefreshToken.expires_at <= _now()))
+    db.session.commit()
+    return result.rowcount
@@ -0,0 +1,350 @@
+"""Import the USDA FoodData Central catalog into foods.
+
+Search result pages are fetched concurrently by a bounded thread pool over
+one shared HTTP session (connection pooling, retries with backoff on 429
+and 5xx). Each page is written by the calling thread with a single
+INSERT ... ON CONFLICT (usda_id) DO UPDATE, which only rewrites, and stamps
+with a new catalog version, rows whose values changed.
+
+Finished pages are recorded in a checkpoint file after they commit, so an
+interrupted import started again with the same checkpoint only fetches the
+pages it is missing. The checkpoint is removed once every page is in.
+
+`import_dump` reads the bulk download files instead (a JSON dump, or the
+CSV dump's food.csv and food_nutrient.csv, either unpacked or as the .zip).
+They are parsed incrementally, so memory use doesn't grow with the file,
+and COPYed in batches into a temporary staging table that is merged into
+foods with one INSERT ... SELECT ... ON CONFLICT.
+"""
+import csv
+import io
+import json
+import os
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import or_, text
+from sqlalchemy.dialects.postgresql import insert
+from urllib3.util.retry import Retry
+from . import db
+from .food_index import next_catalog_version
+from .models import Food
+
+NUTRIENTS_OF_INTEREST = {
+    '1008': 'calories_per_100g',    # Energy (kcal)
+    '1003': 'protein_per_100g',     # Protein
+    '1004': 'fat_per_100g',         # Total fat
+    '1005': 'carbs_per_100g',       # Carbohydrates
+}
+_NAME_LENGTH = 95  # leaves room for '...' in Food.name
+
+class ImportStats:
+    __slots__ = ('pages', 'upserted', 'skipped')
+
+    def __init__(self):
+        self.pages = self.upserted = self.skipped = 0
+
+def make_session(workers, retries=5):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=Retry(
+        total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=['GET'], respect_retry_after_header=True
+    ))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def fetch_page(session, base_url, api_key, page, page_size, data_type='Foundation,SR Legacy'):
+    response = session.get(f'{base_url}/foods/search', params={
+        'api_key': api_key,
+        'pageSize': page_size,
+        'pageNumber': page,
+        'dataType': data_type,
+        'sortBy': 'dataType.keyword',
+    }, timeout=30)
+    response.raise_for_status()
+    return response.json()
+
+def truncate_name(name, max_length=_NAME_LENGTH):
+    """Truncate food name and add '...' if it's too long"""
+    if len(name) <= max_length:
+        return name
+    return name[:max_length] + '...'
+
+def extract_nutrient_values(food_item):
+    """Extract nutrient values from a food item"""
+    nutrients = {key: None for key in NUTRIENTS_OF_INTEREST.values()}
+    for nutrient in food_item.get('foodNutrients', []):
+        key = NUTRIENTS_OF_INTEREST.get(str(nutrient.get('nutrientId', '')))
+        if key:
+            value = nutrient.get('value', 0)
+            nutrients[key] = value if value is not None else 0
+    return nutrients
+
+def food_rows(items):
+    """Food rows for one page of search results, keyed by usda_id; items without calories are left out."""
+    rows = {}
+    for item in items:
+        nutrients = extract_nutrient_values(item)
+        if not nutrients['calories_per_100g']:
+            continue
+        usda_id = str(item['fdcId'])
+        rows[usda_id] = {"name": truncate_name(item['description']), "usda_id": usda_id, **nutrients}
+    return list(rows.values())
+
+def upsert_page(rows):
+    """Write one page of rows in one statement. Returns (rows inserted or changed, rows skipped).
+
+    Food names are unique too, so rows whose name another USDA food already
+    has (in the table or earlier in the page) are skipped.
+    """
+    names = {row['name'] for row in rows}
+    taken = dict(db.session.execute(
+        db.select(Food.name, Food.usda_id).filter(Food.name.in_(names))
+    ).all()) if names else {}
+    kept = [row for row in rows if taken.setdefault(row['name'], row['usda_id']) == row['usda_id']]
+    written = 0
+    if kept:
+        version = next_catalog_version()
+        stmt = insert(Food).values([{**row, "catalog_version": version} for row in kept])
+        columns = ['name', *NUTRIENTS_OF_INTEREST.values()]
+        written = len(db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[Food.usda_id],
+            set_={column: stmt.excluded[column] for column in columns + ['catalog_version']},
+            where=or_(*[getattr(Food, column).is_distinct_from(stmt.excluded[column]) for column in columns])
+        ).returning(Food.id)).all())
+    db.session.commit()
+    return written, len(rows) - len(kept)
+
+def _load_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            data = json.load(f)
+        return data.get('total_pages'), set(data.get('done', []))
+    return None, set()
+
+def _save_checkpoint(path, total_pages, done):
+    if not path:
+        return
+    with open(path + '.tmp', 'w') as f:
+        json.dump({"total_pages": total_pages, "done": sorted(done)}, f)
+    os.replace(path + '.tmp', path)
+
+def import_foods(base_url, api_key, workers=8, page_size=200, max_pages=None,
+                 checkpoint_path=None, retries=5, on_page=None):
+    """Fetch every search page and upsert its foods. Needs an app context.
+
+    `on_page(page, upserted, skipped)` is called after each page commits.
+    Raises on the first page that can't be fetched after retries; the pages
+    already written stay in the checkpoint.
+    """
+    stats = ImportStats()
+    total_pages, done = _load_checkpoint(checkpoint_path)
+    with make_session(workers, retries) as session, ThreadPoolExecutor(max_workers=workers) as pool:
+        def write(page, data):
+            upserted, skipped = upsert_page(food_rows(data.get('foods', [])))
+            stats.pages += 1
+            stats.upserted += upserted
+            stats.skipped += skipped
+            done.add(page)
+            _save_checkpoint(checkpoint_path, total_pages, done)
+            if on_page:
+                on_page(page, upserted, skipped)
+
+        if total_pages is None:
+            first = fetch_page(session, base_url, api_key, 1, page_size)
+            total_pages = first.get('totalPages', 1)
+            if 1 not in done:
+                write(1, first)
+        last_page = min(total_pages, max_pages) if max_pages else total_pages
+
+        pending = iter([page for page in range(1, last_page + 1) if page not in done])
+        in_flight = {}
+        try:
+            while True:
+                # Keep at most two pages per worker fetched but not yet written
+                for page in pending:
+                    in_flight[pool.submit(fetch_page, session, base_url, api_key, page, page_size)] = page
+                    if len(in_flight) >= 2 * workers:
+                        break
+                if not in_flight:
+                    break
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    write(in_flight.pop(future), future.result())
+        except BaseException:
+            for future in in_flight:
+                future.cancel()
+            raise
+
+    if checkpoint_path and os.path.exists(checkpoint_path) and len(done) >= total_pages:
+        os.remove(checkpoint_path)
+    return stats
+
+_COPY_BATCH_ROWS = 50000
+_STAGING_COLUMNS = ('usda_id', 'name', 'calories_per_100g', 'protein_per_100g', 'fat_per_100g', 'carbs_per_100g')
+
+def iter_json_array(stream, chunk_size=1 << 20):
+    """Yield the objects of the first JSON array in `stream` one at a time.
+
+    Bulk dumps are one object like {"FoundationFoods": [...]}; only the food
+    being decoded and one chunk of text are held in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, eof = '', 0, False
+
+    def fill():
+        nonlocal buffer, position, eof
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    while '[' not in buffer:
+        fill()
+        if eof:
+            return
+    position = buffer.index('[') + 1
+    while True:
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) or eof:
+                break
+            fill()
+        if position >= len(buffer) or buffer[position] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            fill()  # the object continues in the next chunk
+            continue
+        position = end
+        yield item
+
+def _dump_item_nutrients(item):
+    # Dumps nest the nutrient ({"nutrient": {"id": 1008}, "amount": 52}); the
+    # search API flattens it ({"nutrientId": 1008, "value": 52})
+    return {'foodNutrients': [
+        {'nutrientId': nutrient.get('nutrient', {}).get('id'), 'value': nutrient.get('amount')}
+        for nutrient in item.get('foodNutrients', [])
+    ]}
+
+def _open_member(archive, suffix):
+    for name in archive.namelist():
+        if name.lower().endswith(suffix):
+            return io.TextIOWrapper(archive.open(name), encoding='utf-8', newline='')
+    raise FileNotFoundError(f'No *{suffix} in {archive.filename}')
+
+def _copy_batches(table, columns, rows):
+    """COPY rows into `table` in batches of _COPY_BATCH_ROWS. Returns the row count."""
+    cursor = db.session.connection().connection.cursor()
+    count = 0
+    while True:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        batch = 0
+        for row in rows:
+            writer.writerow(row)
+            batch += 1
+            if batch == _COPY_BATCH_ROWS:
+                break
+        if not batch:
+            return count
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        count += batch
+
+def _json_rows(stream):
+    for item in iter_json_array(stream):
+        nutrients = extract_nutrient_values(_dump_item_nutrients(item))
+        if nutrients['calories_per_100g'] and item.get('fdcId') and item.get('description'):
+            yield (str(item['fdcId']), truncate_name(item['description']),
+                   *(nutrients[column] for column in _STAGING_COLUMNS[2:]))
+
+def _stage_csv(foods_stream, nutrients_stream):
+    """Load food.csv and the nutrients we keep from food_nutrient.csv, then pivot them into food_import."""
+    db.session.execute(text("CREATE TEMPORARY TABLE food_import_names (usda_id text, name text) ON COMMIT DROP"))
+    db.session.execute(text(
+        "CREATE TEMPORARY TABLE food_import_nutrients (usda_id text, nutrient_id int, amount float) ON COMMIT DROP"
+    ))
+    _copy_batches('food_import_names', ('usda_id', 'name'), (
+        (row['fdc_id'], truncate_name(row['description']))
+        for row in csv.DictReader(foods_stream) if row.get('description')
+    ))
+    _copy_batches('food_import_nutrients', ('usda_id', 'nutrient_id', 'amount'), (
+        (row['fdc_id'], row['nutrient_id'], row['amount'] or None)
+        for row in csv.DictReader(nutrients_stream) if row['nutrient_id'] in NUTRIENTS_OF_INTEREST
+    ))
+    nutrient_ids = {column: nutrient_id for nutrient_id, column in NUTRIENTS_OF_INTEREST.items()}
+    pivot = ', '.join(
+        f"max(n.amount) FILTER (WHERE n.nutrient_id = {nutrient_ids[column]})" for column in _STAGING_COLUMNS[2:]
+    )
+    db.session.execute(text(
+        f"INSERT INTO food_import ({', '.join(_STAGING_COLUMNS)}) "
+        f"SELECT f.usda_id, f.name, {pivot} "
+        f"FROM food_import_names f JOIN food_import_nutrients n USING (usda_id) "
+        f"GROUP BY f.usda_id, f.name"
+    ))
+
+def import_dump(path):
+    """Import a FoodData Central bulk download. Needs an app context.
+
+    `path` is a JSON dump (.json or a .zip holding one), a directory holding
+    food.csv and food_nutrient.csv, or the CSV dump's .zip. Returns
+    (foods inserted or changed, foods skipped because their name belongs to
+    another food).
+    """
+    db.session.execute(text(
+        "CREATE TEMPORARY TABLE food_import (usda_id text, name text, calories_per_100g float, "
+        "protein_per_100g float, fat_per_100g float, carbs_per_100g float) ON COMMIT DROP"
+    ))
+    if os.path.isdir(path):
+        with open(os.path.join(path, 'food.csv'), newline='', encoding='utf-8') as foods, \
+                open(os.path.join(path, 'food_nutrient.csv'), newline='', encoding='utf-8') as nutrients:
+            _stage_csv(foods, nutrients)
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            if any(name.lower().endswith('.json') for name in archive.namelist()):
+                with _open_member(archive, '.json') as stream:
+                    _copy_batches('food_import', _STAGING_COLUMNS, _json_rows(stream))
+            else:
+                with _open_member(archive, '/food.csv') as foods, \
+                        _open_member(archive, '/food_nutrient.csv') as nutrients:
+                    _stage_csv(foods, nutrients)
+    else:
+        with open(path, encoding='utf-8') as stream:
+            _copy_batches('food_import', _STAGING_COLUMNS, _json_rows(stream))
+    return _merge_staged()
+
+def _merge_staged():
+    """Upsert food_import into foods, one row per usda_id and per name. Commits."""
+    columns = ['name', *NUTRIENTS_OF_INTEREST.values()]
+    staged = db.session.execute(text(
+        "SELECT count(DISTINCT usda_id) FROM food_import WHERE calories_per_100g <> 0"
+    )).scalar()
+    version = next_catalog_version()
+    written = db.session.execute(text(
+        f"INSERT INTO foods (usda_id, {', '.join(columns)}, catalog_version) "
+        f"SELECT usda_id, {', '.join(columns)}, :version FROM ("
+        # the first food with a name keeps it; names are unique in foods too
+        f"  SELECT DISTINCT ON (name) * FROM ("
+        f"    SELECT DISTINCT ON (usda_id) * FROM food_import WHERE calories_per_100g <> 0 ORDER BY usda_id"
+        f"  ) latest ORDER BY name, usda_id"
+        f") s WHERE NOT EXISTS ("
+        f"  SELECT 1 FROM foods f WHERE f.name = s.name AND f.usda_id IS DISTINCT FROM s.usda_id"
+        f") "
+        f"ON CONFLICT (usda_id) DO UPDATE SET "
+        + ', '.join(f"{column} = excluded.{column}" for column in columns + ['catalog_version'])
+        + " WHERE " + ' OR '.join(f"foods.{column} IS DISTINCT FROM excluded.{column}" for column in columns)
+        + " RETURNING foods.id"
+    ), {"version": version}).rowcount
+    kept = db.session.execute(text(
+        "SELECT count(DISTINCT usda_id) FROM food_import s "
+        "WHERE calories_per_100g <> 0 AND EXISTS (SELECT 1 FROM foods f WHERE f.usda_id = s.usda_id)"
+    )).scalar()
+    db.session.commit()
+    return written, staged - kept
@@ -1,13 +1,109 @@
 # utils.py
+import base64
+import json
 from datetime import datetime, timedelta
-from .models import FoodLog, db
+from flask import current_app, request
+from sqlalchemy import func
+from .feed import delete_expired_entries
+from .models import Food, FoodLog, User, db, followers, madrid_now
+from .nutrition import add_to_daily_totals
+from .partitions import drop_expired_partitions
+
+def encode_cursor(*values):
+    """Encode keyset values into an opaque, URL-safe pagination cursor."""
+    raw = json.dumps(values, separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor. Raises ValueError if malformed."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+def parse_limit(default_key, max_key):
+    """Read the `limit` query parameter, bounded by the given config keys."""
+    default = current_app.config[default_key]
+    maximum = current_app.config[max_key]
+    try:
+        limit = int(request.args.get('limit', default))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if limit <= 0:
+        raise ValueError("limit must be positive")
+    return min(limit, maximum)
+
+def parse_date_arg(name):
+    """Read an optional YYYY-MM-DD query parameter. Raises ValueError if malformed."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f"Invalid {name} date. Use YYYY-MM-DD")
 
 def cleanup_old_logs():
-    one_month_ago = datetime.utcnow() - timedelta(days=30)
-    
-    # Deleting records in batches of 100
+    """Delete food logs older than FOOD_LOG_RETENTION_DAYS.
+
+    Monthly partitions that lie entirely before the cutoff are detached and
+    dropped whole. What is left past the cutoff (the month the cutoff falls
+    in, plus anything in the default partition) is deleted in batches of 100,
+    taking the rows out of the daily nutrition rollups in the same
+    transaction. Feed inbox entries for expired logs go last. Returns the
+    number of log rows deleted in batches.
+    """
+    cutoff = madrid_now() - timedelta(days=current_app.config['FOOD_LOG_RETENTION_DAYS'])
+
+    for name in drop_expired_partitions(cutoff.date()):
+        current_app.logger.info(f'Dropped expired food log partition {name}')
+
+    rows_deleted = 0
     while True:
-        rows_deleted = db.session.query(FoodLog).filter(FoodLog.log_date < one_month_ago).limit(100).delete(synchronize_session='fetch')
-        if not rows_deleted:
+        batch = db.session.execute(
+            db.select(
+                FoodLog.id, FoodLog.user_id, FoodLog.log_date, FoodLog.grams,
+                Food.calories_per_100g, Food.protein_per_100g,
+                Food.carbs_per_100g, Food.fat_per_100g
+            ).join(Food, Food.id == FoodLog.food_id)
+            .filter(FoodLog.log_date < cutoff)
+            .limit(100)
+        ).all()
+        if not batch:
             break
-        db.session.commit()
\ No newline at end of file
+        db.session.execute(
+            db.delete(FoodLog).where(
+                FoodLog.log_date < cutoff,
+                FoodLog.id.in_([row.id for row in batch])
+            )
+        )
+        add_to_daily_totals(
+            ((row.user_id, row.log_date, row.grams, row) for row in batch),
+            sign=-1
+        )
+        db.session.commit()
+        rows_deleted += len(batch)
+
+    delete_expired_entries(cutoff)
+    return rows_deleted
+
+def reconcile_follow_counts():
+    """Reset follower/following counters that disagree with the followers table.
+
+    follow/unfollow keep the counters exact; this only repairs drift from
+    manual edits or bugs. Returns the number of users corrected.
+    """
+    following = db.select(func.count()).where(followers.c.follower_id == User.id).scalar_subquery()
+    followed_by = db.select(func.count()).where(followers.c.followed_id == User.id).scalar_subquery()
+    result = db.session.execute(
+        db.update(User)
+        .where((User.following_count != following) | (User.followers_count != followed_by))
+        .values(following_count=following, followers_count=followed_by)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
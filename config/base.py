@@ -2,6 +2,7 @@
 import os
 from dotenv import load_dotenv
 import secrets
+import tempfile
 
 # Load environment variables from .env file
 load_dotenv()
@@ -10,26 +11,142 @@ class BaseConfig:
     # Basic Configuration
     SECRET_KEY = os.environ.get("SECRET_KEY", secrets.token_urlsafe(32))
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Database connections (app/pooling.py). The pool is per worker process:
+    # keep workers * (pool_size + max_overflow) below the server's max_connections
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 5)),
+        "pool_timeout": 10,  # seconds a request waits for a free connection before failing
+        "pool_recycle": 1800,  # seconds before a connection is replaced
+        "pool_pre_ping": True,  # drop connections that died in a failover or idled out
+        "connect_args": {"connect_timeout": 5, "application_name": "bytebites"},
+    }
+    DB_STATEMENT_TIMEOUT = os.environ.get("DB_STATEMENT_TIMEOUT")  # e.g. "30s"
+    DB_PGBOUNCER = os.environ.get("DB_PGBOUNCER", "false").lower() == "true"  # behind PgBouncer in transaction pooling mode
     JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY", secrets.token_hex(32))
+    REFRESH_TOKEN_HMAC_KEY = os.environ.get("REFRESH_TOKEN_HMAC_KEY", JWT_SECRET_KEY)
+    REFRESH_TOKEN_EXPIRES_DAYS = 30
+
+    # Access token revocation (app/revocation.py)
+    REVOCATION_REFRESH_SECONDS = 2  # how stale a worker's view of the denylist may get
+    REVOCATION_REBUILD_SECONDS = 3600  # full rebuild, dropping purged entries
+    REVOCATION_BLOOM_CAPACITY = 100000
+    REVOCATION_BLOOM_ERROR_RATE = 0.001
     
     # AI Configuration
     AI_MODEL_NAME = os.environ.get("AI_MODEL_NAME", "default_model")
     AI_MODEL_PATH = os.environ.get("AI_MODEL_PATH", "/path/to/model")
     AI_API_KEY = os.environ.get("AI_API_KEY")
     
+    # Password hashing (app/passwords.py); changing the Argon2 parameters
+    # rehashes each user's password on their next login
+    ARGON2_TIME_COST = int(os.environ.get("ARGON2_TIME_COST", 3))
+    ARGON2_MEMORY_COST = int(os.environ.get("ARGON2_MEMORY_COST", 65536))  # KiB
+    ARGON2_PARALLELISM = int(os.environ.get("ARGON2_PARALLELISM", 4))
+    PASSWORD_POOL_WORKERS = int(os.environ.get("PASSWORD_POOL_WORKERS", 2))  # 0 hashes on the request thread
+    PASSWORD_POOL_MAX_PENDING = 8  # queued or running per web worker before answering 503
+    PASSWORD_POOL_TIMEOUT_SECONDS = 5
+    
     # Redis configuration
     REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379")
     
-    # Rate limiting
-    RATELIMIT_STORAGE_URL = REDIS_URL
-    RATELIMIT_DEFAULT = "100/hour"
-    RATELIMIT_STRATEGY = "fixed-window"
+    # Rate limiting, shared by all workers: Redis when REDIS_URL is set,
+    # otherwise a SQLite file that only processes on this host share
+    RATELIMIT_STORAGE_URI = os.environ.get(
+        "RATELIMIT_STORAGE_URI",
+        REDIS_URL if "REDIS_URL" in os.environ
+        else "sqlite:///" + os.path.join(tempfile.gettempdir(), "bytebites-ratelimit.sqlite")
+    )
+    RATELIMIT_ENABLED = os.environ.get("RATELIMIT_ENABLED", "true").lower() == "true"  # off for benchmarks
+    RATELIMIT_STRATEGY = "sliding-window-counter"  # see app/ratelimit.py
+    RATELIMIT_DEFAULT = "100 per hour;5 per second"
+    RATELIMIT_AUTH = "10 per minute;50 per hour"  # login, register, refresh (per client address)
+    RATELIMIT_READ = "600 per hour;10 per second"  # search, feed and log history
+    RATELIMIT_HEADERS_ENABLED = True
+
+    # Read replicas (app/replicas.py) for views marked @read_only; comma separated URLs
+    SQLALCHEMY_REPLICA_URIS = [uri for uri in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if uri]
+    REPLICA_MAX_LAG_SECONDS = 2.0  # replicas further behind are skipped
+    REPLICA_LAG_CHECK_SECONDS = 1.0
+    REPLICA_STICKY_SECONDS = 5  # a user's reads stay on the primary this long after they write
+    REPLICA_STICKY_STORAGE_URI = os.environ.get("REPLICA_STICKY_STORAGE_URI", RATELIMIT_STORAGE_URI)
     
     # Cache configuration
     CACHE_TYPE = "redis"
     CACHE_REDIS_URL = REDIS_URL
     CACHE_DEFAULT_TIMEOUT = 300  # 5 minutes default cache timeout
 
+    # Food search (GET /foods)
+    SEARCH_DEFAULT_LIMIT = 50
+    SEARCH_MAX_LIMIT = 100
+    SEARCH_MIN_INFIX_LENGTH = 3  # shorter queries only match name prefixes
+
+    # Food logs (POST /food_logs/batch, GET /food_logs/<user_id>)
+    FOOD_LOG_BATCH_MAX = 500
+    FOOD_LOGS_DEFAULT_LIMIT = 100
+    FOOD_LOGS_MAX_LIMIT = 500
+    NUTRITION_SUMMARY_MAX_DAYS = 366
+    FOOD_LOG_EXPORT_CHUNK_ROWS = 1000  # rows fetched from the server-side cursor per chunk of GET /food_logs/export
+    FOOD_LOG_RETENTION_DAYS = 30
+    FOOD_LOG_PARTITION_MONTHS_AHEAD = 3  # monthly food_logs partitions created ahead of time
+    FOOD_LOG_PARTITION_LOCK_TIMEOUT = '5s'  # give up dropping a partition rather than queue behind readers
+
+    # Feed inboxes (GET /api/feed)
+    FEED_DEFAULT_LIMIT = 50
+    FEED_MAX_LIMIT = 200
+    FEED_CELEBRITY_FOLLOWERS = 10000  # authors with this many followers are merged in on read, not fanned out
+    FEED_BACKFILL_LOGS = 200  # recent logs copied into a new follower's inbox
+
+    # In-memory autocomplete index (GET /foods/autocomplete)
+    FOOD_INDEX_ENABLED = os.environ.get("FOOD_INDEX_ENABLED", "false").lower() == "true"
+    FOOD_INDEX_PRELOAD = os.environ.get("FOOD_INDEX_PRELOAD", "false").lower() == "true"  # build at startup instead of on first request
+    FOOD_INDEX_REFRESH_SECONDS = 5
+    AUTOCOMPLETE_DEFAULT_LIMIT = 10
+    AUTOCOMPLETE_MAX_LIMIT = 25
+
+    # Metrics (GET /metrics)
+    METRICS_DIR = os.environ.get("METRICS_DIR", os.path.join(tempfile.gettempdir(), "bytebites-metrics"))  # shared by the workers of one host
+    METRICS_FLUSH_SECONDS = 5
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")  # bearer token required to scrape, if set
+
+    # Request profiling (app/profiling.py, `flask profile merge`)
+    PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))  # share of requests profiled at random
+    PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN")  # requests with `X-Profile: <token>` are always profiled
+    PROFILE_INTERVAL_SECONDS = 0.005
+    PROFILE_FORMAT = os.environ.get("PROFILE_FORMAT", "collapsed")  # or "speedscope"
+    PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "bytebites-profiles"))
+
+    # Per-request SQL statement counts (app/queries.py)
+    QUERY_STATS_HEADERS = False  # X-Query-Count / X-Query-Time-Ms; always on in debug mode
+    QUERY_REPEAT_THRESHOLD = 5  # same statement this often in one request is logged as a likely N+1
+    QUERY_BUDGET_STRICT = False  # raise instead of log when a view exceeds its @query_budget
+
+    # Request deadlines and row caps (app/queries.py); overrides are keyed by
+    # endpoint or blueprint name, None meaning no limit
+    QUERY_DEADLINE_SECONDS = 5.0  # 503 once a request's statements run past it
+    QUERY_DEADLINE_OVERRIDES = {
+        'routes.search_foods': 2.0,
+        'profile.get_feed': 2.0,
+        'routes.autocomplete_foods': None,  # may build the food index from the whole catalog
+    }
+    QUERY_ROW_CAP = 5000  # 413 once a request has read more rows than this
+    QUERY_ROW_CAP_OVERRIDES = {
+        'routes.autocomplete_foods': None,
+    }
+
+    # Slow-query log (app/slowlog.py)
+    SLOW_QUERY_THRESHOLD_MS = float(os.environ.get("SLOW_QUERY_THRESHOLD_MS", 200))
+    SLOW_QUERY_LOG_PATH = os.environ.get("SLOW_QUERY_LOG_PATH", os.path.join(tempfile.gettempdir(), "bytebites-slow-queries.log"))
+    SLOW_QUERY_LOG_MAX_BYTES = 10 * 1024 * 1024
+    SLOW_QUERY_LOG_BACKUPS = 5
+    SLOW_QUERY_EXPLAINS_PER_MINUTE = 6  # each EXPLAIN ANALYZE runs the query again
+    SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS = 600  # per distinct statement
+    SLOW_QUERY_EXPLAIN_TIMEOUT = '10s'
+
+    # Background job runner (`flask jobs run`)
+    JOBS_LEADER_POLL_SECONDS = 10  # how often standbys try for the lock and the leader checks it
+
     @staticmethod
     def get_database_url():
         """Get the database URL based on environment."""
@@ -5,6 +5,7 @@ class DevelopmentConfig(BaseConfig):
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = BaseConfig.get_database_url()
     JWT_ACCESS_TOKEN_EXPIRES = 3600  # 1 hour
+    SQLALCHEMY_ENGINE_OPTIONS = {**BaseConfig.SQLALCHEMY_ENGINE_OPTIONS, "pool_size": 2}
     
     @classmethod
     def init_app(cls, app):
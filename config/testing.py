@@ -2,12 +2,28 @@
 from .base import BaseConfig
 import os
 import secrets
+import tempfile
 
 class TestingConfig(BaseConfig):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = BaseConfig.get_database_url()
+    SQLALCHEMY_ENGINE_OPTIONS = {**BaseConfig.SQLALCHEMY_ENGINE_OPTIONS, "pool_size": 2}  # every test creates its own engine
+    DB_STATEMENT_TIMEOUT = "30s"
     JWT_SECRET_KEY = os.environ.get("TEST_JWT_SECRET_KEY", secrets.token_hex(32))
     JWT_ACCESS_TOKEN_EXPIRES = 300  # 5 minutes
+    RATELIMIT_ENABLED = False  # tests fire requests faster than the per-second limit
+    SQLALCHEMY_REPLICA_URIS = []  # see tests/test_replicas.py
+    REPLICA_LAG_CHECK_SECONDS = 0  # measure replica lag on every read-only request
+    REPLICA_STICKY_STORAGE_URI = "memory://"
+    REVOCATION_REFRESH_SECONDS = 0  # see revocations made through other sessions at once
+    METRICS_DIR = tempfile.mkdtemp(prefix='bytebites-metrics-')  # not shared with other runs
+    QUERY_STATS_HEADERS = True
+    QUERY_BUDGET_STRICT = True  # a view going over its query budget fails the test
+    SLOW_QUERY_LOG_PATH = os.path.join(METRICS_DIR, 'slow-queries.log')
+    PASSWORD_POOL_WORKERS = 0  # hash inline; no worker processes per test app
+    ARGON2_TIME_COST = 1
+    ARGON2_MEMORY_COST = 8192
+    ARGON2_PARALLELISM = 1
     
     @classmethod
     def init_app(cls, app):
@@ -97,6 +97,10 @@ def run_migrations_online():
     connectable = get_engine()
 
     with connectable.connect() as connection:
+        if not current_app.config.get('DB_PGBOUNCER'):
+            # Schema changes may take longer than the app's DB_STATEMENT_TIMEOUT
+            connection.exec_driver_sql("SET statement_timeout = 0")
+            connection.commit()
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
@@ -0,0 +1,44 @@
+"""follower and following counters on users
+
+Revision ID: 0a6d4e8b3c71
+Revises: f3c9a7d2e615
+Create Date: 2025-04-17 11:42:09.518230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0a6d4e8b3c71'
+down_revision = 'f3c9a7d2e615'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('followers_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('following_count', sa.Integer(), server_default='0', nullable=False))
+
+    op.execute("""
+        UPDATE users u SET
+            followers_count = (SELECT count(*) FROM followers f WHERE f.followed_id = u.id),
+            following_count = (SELECT count(*) FROM followers f WHERE f.follower_id = u.id)
+        WHERE EXISTS (SELECT 1 FROM followers f WHERE f.followed_id = u.id OR f.follower_id = u.id)
+    """)
+
+    # Built concurrently so following keeps working during the upgrade
+    with op.get_context().autocommit_block():
+        op.create_index('ix_followers_followed_id', 'followers', ['followed_id'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_followers_followed_id', table_name='followers',
+                      postgresql_concurrently=True, if_exists=True)
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('following_count')
+        batch_op.drop_column('followers_count')
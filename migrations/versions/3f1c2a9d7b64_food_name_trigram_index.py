@@ -0,0 +1,41 @@
+"""food name trigram index
+
+Revision ID: 3f1c2a9d7b64
+Revises: 8ac5899e79a7
+Create Date: 2025-03-10 19:42:11.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7b64'
+down_revision = '8ac5899e79a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    # unaccent() is only STABLE; index expressions need an IMMUTABLE function
+    op.execute(
+        "CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text AS "
+        "$$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$ "
+        "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT"
+    )
+
+    # Built concurrently so the catalog stays writable during the upgrade
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_foods_name_trgm "
+            "ON foods USING gin (f_unaccent(lower(name)) gin_trgm_ops)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_foods_name_trgm")
+    op.execute("DROP FUNCTION IF EXISTS f_unaccent(text)")
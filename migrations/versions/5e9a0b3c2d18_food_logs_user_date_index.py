@@ -0,0 +1,30 @@
+"""food_logs (user_id, log_date, id) index
+
+Revision ID: 5e9a0b3c2d18
+Revises: b7d41e0c95a3
+Create Date: 2025-03-18 21:17:04.331870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e9a0b3c2d18'
+down_revision = 'b7d41e0c95a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Built concurrently so logging keeps working during the upgrade
+    with op.get_context().autocommit_block():
+        op.create_index('ix_food_logs_user_id_log_date_id', 'food_logs',
+                        ['user_id', 'log_date', 'id'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_food_logs_user_id_log_date_id', table_name='food_logs',
+                      postgresql_concurrently=True, if_exists=True)
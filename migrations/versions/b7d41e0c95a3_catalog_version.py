@@ -0,0 +1,37 @@
+"""catalog version counter
+
+Revision ID: b7d41e0c95a3
+Revises: 3f1c2a9d7b64
+Create Date: 2025-03-14 11:05:37.902114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d41e0c95a3'
+down_revision = '3f1c2a9d7b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('catalog_state',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("INSERT INTO catalog_state (id, version) VALUES (1, 0)")
+
+    with op.batch_alter_table('foods', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('catalog_version', sa.BigInteger(), server_default='0', nullable=False))
+        batch_op.create_index(batch_op.f('ix_foods_catalog_version'), ['catalog_version'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('foods', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_foods_catalog_version'))
+        batch_op.drop_column('catalog_version')
+
+    op.drop_table('catalog_state')
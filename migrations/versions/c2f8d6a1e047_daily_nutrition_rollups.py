@@ -0,0 +1,50 @@
+"""daily nutrition rollups
+
+Revision ID: c2f8d6a1e047
+Revises: 5e9a0b3c2d18
+Create Date: 2025-03-24 18:52:46.107553
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2f8d6a1e047'
+down_revision = '5e9a0b3c2d18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('daily_nutrition',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('calories', sa.Float(), nullable=False),
+    sa.Column('protein', sa.Float(), nullable=False),
+    sa.Column('carbs', sa.Float(), nullable=False),
+    sa.Column('fat', sa.Float(), nullable=False),
+    sa.Column('log_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'day')
+    )
+
+    # Backfill from the existing logs
+    op.execute("""
+        INSERT INTO daily_nutrition (user_id, day, calories, protein, carbs, fat, log_count)
+        SELECT l.user_id,
+               l.log_date::date,
+               SUM(f.calories_per_100g * l.grams / 100),
+               SUM(COALESCE(f.protein_per_100g, 0) * l.grams / 100),
+               SUM(COALESCE(f.carbs_per_100g, 0) * l.grams / 100),
+               SUM(COALESCE(f.fat_per_100g, 0) * l.grams / 100),
+               COUNT(*)
+        FROM food_logs l
+        JOIN foods f ON f.id = l.food_id
+        WHERE l.log_date IS NOT NULL
+        GROUP BY l.user_id, l.log_date::date
+    """)
+
+
+def downgrade():
+    op.drop_table('daily_nutrition')
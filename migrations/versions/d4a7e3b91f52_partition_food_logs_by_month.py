@@ -0,0 +1,203 @@
+"""partition food_logs by month
+
+Revision ID: d4a7e3b91f52
+Revises: c2f8d6a1e047
+Create Date: 2025-04-02 10:26:58.640117
+
+Rebuilds food_logs as a table range-partitioned by month on log_date while
+the old table stays live:
+
+1. Create food_logs_partitioned with monthly partitions covering the existing
+   data (plus a default partition), sharing the existing id sequence.
+2. Record the ids of rows inserted, updated or deleted from here on in
+   food_logs_migration_changes, via a trigger on the old table.
+3. Copy rows over in keyset chunks of CHUNK_SIZE, each in its own transaction.
+4. Build the indexes on the new parent.
+5. Under a lock that blocks writers only, copy rows inserted since the last
+   chunk, re-sync the recorded ids (which catches inserts that committed
+   behind an already copied chunk), then swap the names and hand the
+   id sequence over.
+
+Legacy rows with a NULL log_date can't be placed in a range partition; they get
+the upgrade's local (Europe/Madrid) time and are added to that day's
+daily_nutrition rollup.
+"""
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a7e3b91f52'
+down_revision = 'c2f8d6a1e047'
+branch_labels = None
+depends_on = None
+
+CHUNK_SIZE = 50000
+MONTHS_AHEAD = 3
+COLUMNS = "id, user_id, food_id, grams, log_date"
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def upgrade():
+    conn = op.get_bind()
+
+    # Legacy NULL log_dates: stamp them and count them into the rollups
+    stamp = conn.execute(sa.text("SELECT now() AT TIME ZONE 'Europe/Madrid'")).scalar()
+    op.execute(sa.text("""
+        INSERT INTO daily_nutrition (user_id, day, calories, protein, carbs, fat, log_count)
+        SELECT l.user_id,
+               CAST(:stamp AS date),
+               SUM(f.calories_per_100g * l.grams / 100),
+               SUM(COALESCE(f.protein_per_100g, 0) * l.grams / 100),
+               SUM(COALESCE(f.carbs_per_100g, 0) * l.grams / 100),
+               SUM(COALESCE(f.fat_per_100g, 0) * l.grams / 100),
+               COUNT(*)
+        FROM food_logs l
+        JOIN foods f ON f.id = l.food_id
+        WHERE l.log_date IS NULL
+        GROUP BY l.user_id
+        ON CONFLICT (user_id, day) DO UPDATE SET
+            calories = daily_nutrition.calories + excluded.calories,
+            protein = daily_nutrition.protein + excluded.protein,
+            carbs = daily_nutrition.carbs + excluded.carbs,
+            fat = daily_nutrition.fat + excluded.fat,
+            log_count = daily_nutrition.log_count + excluded.log_count
+    """).bindparams(stamp=stamp))
+    op.execute(sa.text(
+        "UPDATE food_logs SET log_date = :stamp WHERE log_date IS NULL"
+    ).bindparams(stamp=stamp))
+
+    op.execute("""
+        CREATE TABLE food_logs_partitioned (
+            id integer NOT NULL DEFAULT nextval('food_logs_id_seq'),
+            user_id integer NOT NULL,
+            food_id integer NOT NULL,
+            grams double precision NOT NULL,
+            log_date timestamp without time zone NOT NULL,
+            CONSTRAINT food_logs_partitioned_pkey PRIMARY KEY (id, log_date),
+            CONSTRAINT food_logs_partitioned_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id),
+            CONSTRAINT food_logs_partitioned_food_id_fkey FOREIGN KEY (food_id) REFERENCES foods (id)
+        ) PARTITION BY RANGE (log_date)
+    """)
+    op.execute("CREATE TABLE food_logs_partitioned_default PARTITION OF food_logs_partitioned DEFAULT")
+
+    oldest = conn.execute(sa.text("SELECT min(log_date) FROM food_logs")).scalar() or stamp
+    month = date(oldest.year, oldest.month, 1)
+    last = _add_months(date(stamp.year, stamp.month, 1), MONTHS_AHEAD)
+    while month <= last:
+        upper = _add_months(month, 1)
+        op.execute(
+            f"CREATE TABLE food_logs_y{month.year:04d}m{month.month:02d} "
+            f"PARTITION OF food_logs_partitioned "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{upper.isoformat()}')"
+        )
+        month = upper
+
+    # Track rows written to the live table while the copy runs. Inserts count
+    # too: a row can take an id below a chunk's max(id) but commit only after
+    # that chunk was read, and the catch-up by id alone would miss it.
+    op.execute("CREATE TABLE food_logs_migration_changes (id integer NOT NULL)")
+    op.execute("""
+        CREATE FUNCTION food_logs_migration_track() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO food_logs_migration_changes (id) VALUES (COALESCE(NEW.id, OLD.id));
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER food_logs_migration_track
+        AFTER INSERT OR UPDATE OR DELETE ON food_logs
+        FOR EACH ROW EXECUTE FUNCTION food_logs_migration_track()
+    """)
+
+    # Copy in keyset chunks, one transaction each, so the old table stays
+    # writable and no single transaction holds the whole table
+    last_id = 0
+    with op.get_context().autocommit_block():
+        while True:
+            copied_up_to = conn.execute(sa.text(f"""
+                WITH chunk AS (
+                    SELECT {COLUMNS} FROM food_logs
+                    WHERE id > :last_id ORDER BY id LIMIT :chunk_size
+                ), copied AS (
+                    INSERT INTO food_logs_partitioned ({COLUMNS})
+                    SELECT {COLUMNS} FROM chunk
+                )
+                SELECT max(id) FROM chunk
+            """), {"last_id": last_id, "chunk_size": CHUNK_SIZE}).scalar()
+            if copied_up_to is None:
+                break
+            last_id = copied_up_to
+
+        # Indexes are cheaper to build once the bulk of the rows is in
+        op.execute("CREATE INDEX ix_food_logs_partitioned_log_date ON food_logs_partitioned (log_date)")
+        op.execute(
+            "CREATE INDEX ix_food_logs_partitioned_user_id_log_date_id "
+            "ON food_logs_partitioned (user_id, log_date, id)"
+        )
+
+    # Catch up and swap. SHARE ROW EXCLUSIVE blocks writers but not readers.
+    op.execute("LOCK TABLE food_logs IN SHARE ROW EXCLUSIVE MODE")
+    op.execute(sa.text(f"""
+        INSERT INTO food_logs_partitioned ({COLUMNS})
+        SELECT {COLUMNS} FROM food_logs WHERE id > :last_id
+    """).bindparams(last_id=last_id))
+    op.execute("""
+        DELETE FROM food_logs_partitioned
+        WHERE id IN (SELECT id FROM food_logs_migration_changes)
+    """)
+    op.execute(f"""
+        INSERT INTO food_logs_partitioned ({COLUMNS})
+        SELECT {COLUMNS} FROM food_logs
+        WHERE id IN (SELECT id FROM food_logs_migration_changes)
+    """)
+
+    op.execute("ALTER SEQUENCE food_logs_id_seq OWNED BY food_logs_partitioned.id")
+    op.execute("DROP TABLE food_logs")
+    op.execute("DROP TABLE food_logs_migration_changes")
+    op.execute("DROP FUNCTION food_logs_migration_track()")
+
+    op.execute("ALTER TABLE food_logs_partitioned RENAME TO food_logs")
+    op.execute("ALTER TABLE food_logs_partitioned_default RENAME TO food_logs_default")
+    op.execute("ALTER TABLE food_logs RENAME CONSTRAINT food_logs_partitioned_pkey TO food_logs_pkey")
+    op.execute("ALTER TABLE food_logs RENAME CONSTRAINT food_logs_partitioned_user_id_fkey TO food_logs_user_id_fkey")
+    op.execute("ALTER TABLE food_logs RENAME CONSTRAINT food_logs_partitioned_food_id_fkey TO food_logs_food_id_fkey")
+    op.execute("ALTER INDEX ix_food_logs_partitioned_log_date RENAME TO ix_food_logs_log_date")
+    op.execute(
+        "ALTER INDEX ix_food_logs_partitioned_user_id_log_date_id "
+        "RENAME TO ix_food_logs_user_id_log_date_id"
+    )
+
+
+def downgrade():
+    # Not online: copies everything back in one statement under an exclusive lock
+    op.execute("LOCK TABLE food_logs IN ACCESS EXCLUSIVE MODE")
+    op.execute("""
+        CREATE TABLE food_logs_plain (
+            id integer NOT NULL DEFAULT nextval('food_logs_id_seq'),
+            user_id integer NOT NULL,
+            food_id integer NOT NULL,
+            grams double precision NOT NULL,
+            log_date timestamp without time zone,
+            CONSTRAINT food_logs_plain_pkey PRIMARY KEY (id),
+            CONSTRAINT food_logs_plain_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id),
+            CONSTRAINT food_logs_plain_food_id_fkey FOREIGN KEY (food_id) REFERENCES foods (id)
+        )
+    """)
+    op.execute(f"INSERT INTO food_logs_plain ({COLUMNS}) SELECT {COLUMNS} FROM food_logs")
+    op.execute("ALTER SEQUENCE food_logs_id_seq OWNED BY food_logs_plain.id")
+    op.execute("DROP TABLE food_logs")  # drops every partition with it
+
+    op.execute("ALTER TABLE food_logs_plain RENAME TO food_logs")
+    op.execute("ALTER TABLE food_logs RENAME CONSTRAINT food_logs_plain_pkey TO food_logs_pkey")
+    op.execute("ALTER TABLE food_logs RENAME CONSTRAINT food_logs_plain_user_id_fkey TO food_logs_user_id_fkey")
+    op.execute("ALTER TABLE food_logs RENAME CONSTRAINT food_logs_plain_food_id_fkey TO food_logs_food_id_fkey")
+    op.execute("CREATE INDEX ix_food_logs_log_date ON food_logs (log_date)")
+    op.execute("CREATE INDEX ix_food_logs_user_id_log_date_id ON food_logs (user_id, log_date, id)")
@@ -0,0 +1,35 @@
+"""job runs
+
+Revision ID: e81b5c2f4a90
+Revises: d4a7e3b91f52
+Create Date: 2025-04-08 09:14:22.381906
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e81b5c2f4a90'
+down_revision = 'd4a7e3b91f52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job_runs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('job_name', sa.String(length=64), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=False),
+    sa.Column('duration_ms', sa.Float(), nullable=False),
+    sa.Column('rows', sa.Integer(), nullable=True),
+    sa.Column('succeeded', sa.Boolean(), nullable=False),
+    sa.Column('error', sa.String(length=500), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_job_runs_job_name_started_at', 'job_runs', ['job_name', 'started_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_job_runs_job_name_started_at', table_name='job_runs')
+    op.drop_table('job_runs')
@@ -0,0 +1,72 @@
+"""feed inbox entries
+
+Revision ID: f3c9a7d2e615
+Revises: e81b5c2f4a90
+Create Date: 2025-04-14 16:03:41.720554
+
+Backfills every inbox from the existing logs in keyset chunks of CHUNK_SIZE
+logs, each in its own transaction. Authors at or over CELEBRITY_FOLLOWERS
+(the FEED_CELEBRITY_FOLLOWERS default) only get their own entries. Logs
+written between the backfill and the deploy of the fan-out code are not
+covered; run the migration with the new code.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c9a7d2e615'
+down_revision = 'e81b5c2f4a90'
+branch_labels = None
+depends_on = None
+
+CHUNK_SIZE = 50000
+CELEBRITY_FOLLOWERS = 10000
+
+
+def upgrade():
+    op.create_table('feed_entries',
+    sa.Column('owner_id', sa.Integer(), nullable=False),
+    sa.Column('log_date', sa.DateTime(), nullable=False),
+    sa.Column('log_id', sa.Integer(), nullable=False),
+    sa.Column('author_id', sa.Integer(), nullable=False),
+    sa.Column('food_id', sa.Integer(), nullable=False),
+    sa.Column('grams', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['author_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['food_id'], ['foods.id'], ),
+    sa.ForeignKeyConstraint(['owner_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('owner_id', 'log_date', 'log_id')
+    )
+    op.create_index('ix_feed_entries_owner_id_author_id', 'feed_entries', ['owner_id', 'author_id'], unique=False)
+    op.create_index('ix_feed_entries_log_date', 'feed_entries', ['log_date'], unique=False)
+
+    conn = op.get_bind()
+    last_id = 0
+    with op.get_context().autocommit_block():
+        while True:
+            copied_up_to = conn.execute(sa.text("""
+                WITH chunk AS (
+                    SELECT id, user_id, food_id, grams, log_date FROM food_logs
+                    WHERE id > :last_id ORDER BY id LIMIT :chunk_size
+                ), owners AS (
+                    SELECT c.user_id AS owner_id, c.* FROM chunk c
+                    UNION ALL
+                    SELECT f.follower_id, c.* FROM chunk c
+                    JOIN followers f ON f.followed_id = c.user_id
+                    WHERE (SELECT count(*) FROM followers g WHERE g.followed_id = c.user_id) < :celebrity
+                ), copied AS (
+                    INSERT INTO feed_entries (owner_id, log_date, log_id, author_id, food_id, grams)
+                    SELECT owner_id, log_date, id, user_id, food_id, grams FROM owners
+                    ON CONFLICT DO NOTHING
+                )
+                SELECT max(id) FROM chunk
+            """), {"last_id": last_id, "chunk_size": CHUNK_SIZE, "celebrity": CELEBRITY_FOLLOWERS}).scalar()
+            if copied_up_to is None:
+                break
+            last_id = copied_up_to
+
+
+def downgrade():
+    op.drop_index('ix_feed_entries_log_date', table_name='feed_entries')
+    op.drop_index('ix_feed_entries_owner_id_author_id', table_name='feed_entries')
+    op.drop_table('feed_entries')
@@ -0,0 +1,49 @@
+"""Measure Argon2 hashing throughput with the configured parameters.
+
+Hashes passwords on 1..N worker processes and reports hashes per second in
+total and per core, to help size PASSWORD_POOL_WORKERS and pick ARGON2_*
+values that keep a login under the latency budget.
+
+    python scripts/bench_argon2.py --hashes 64 --max-workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.passwords import _hash
+from config import get_config
+
+def run(params, workers, count):
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        # Warm the workers up so process start-up isn't timed
+        list(pool.map(_hash, [params] * workers, ['warm-up'] * workers))
+        start = time.perf_counter()
+        list(pool.map(_hash, [params] * count, [f'password-{i}' for i in range(count)]))
+        return time.perf_counter() - start
+
+def main():
+    config = get_config()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--hashes', type=int, default=32, help='hashes per run')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count(), help='largest pool size to try')
+    parser.add_argument('--time-cost', type=int, default=config.ARGON2_TIME_COST)
+    parser.add_argument('--memory-cost', type=int, default=config.ARGON2_MEMORY_COST)
+    parser.add_argument('--parallelism', type=int, default=config.ARGON2_PARALLELISM)
+    args = parser.parse_args()
+    params = (args.time_cost, args.memory_cost, args.parallelism)
+
+    print(f"Argon2id t={params[0]} m={params[1]} KiB p={params[2]}, {args.hashes} hashes per run, {os.cpu_count()} CPUs")
+    print(f"{'workers':>7}  {'hashes/s':>9}  {'per core':>9}  {'ms/hash':>8}")
+    for workers in range(1, args.max_workers + 1):
+        elapsed = run(params, workers, args.hashes)
+        rate = args.hashes / elapsed
+        print(f"{workers:>7}  {rate:>9.1f}  {rate / min(workers, os.cpu_count()):>9.1f}  {1000 * workers / rate:>8.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""End-to-end HTTP benchmark of the auth, routes and profile endpoints.
+
+Runs request mixes at a fixed concurrency against a server backed by a
+database filled with `flask seed` (the user, food and password options must
+match the seed), and reports requests per second and latency percentiles
+per endpoint. Results are saved as JSON and can be compared with a saved
+baseline.
+
+    flask seed --users 10000 --foods 2000 --logs 1000000 --seed 42
+    gunicorn -w 4 --threads 4 run:app &    # or use --serve
+    python scripts/benchmark.py --url http://127.0.0.1:8000 --concurrency 16 --duration 30
+    python scripts/benchmark.py --serve --baseline benchmarks/baseline.json
+
+Rate limits would cap the numbers, so start the server with
+RATELIMIT_ENABLED=false; 429 responses are counted and reported.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+import requests
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.seed import _food_names
+
+class Client:
+    """One virtual user: a session logged in as a random seeded user."""
+
+    def __init__(self, args, rng, record):
+        self.args = args
+        self.rng = rng
+        self.record = record
+        self.session = requests.Session()
+        self.user_id = None
+        self.food_names = _food_names(args.foods)
+
+    def request(self, name, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.args.url + path, timeout=30, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, 'error'
+        self.record(name, status, time.perf_counter() - start)
+        return response
+
+    def login(self):
+        user_id = self.rng.randint(1, self.args.users)
+        response = self.request('login', 'POST', '/auth/login', json={
+            'username': f'user{user_id}', 'password': self.args.password
+        })
+        if response is not None and response.status_code == 200:
+            self.user_id = user_id
+            self.session.headers['Authorization'] = f"Bearer {response.json()['access_token']}"
+
+    # Actions; each is one step of a mix
+
+    def login_burst(self):
+        self.login()
+
+    def autocomplete(self):
+        # Someone typing a name: one request per keystroke
+        name = self.rng.choice(self.food_names).lower()
+        for length in range(1, min(len(name), 8) + 1):
+            self.request('autocomplete', 'GET', '/foods/autocomplete', params={'query': name[:length]})
+
+    def search(self):
+        words = self.rng.choice(self.food_names).split()
+        self.request('search', 'GET', '/foods', params={'query': self.rng.choice(words)})
+
+    def log_food(self):
+        self.request('log_food', 'POST', '/food_logs', json={
+            'food_id': self.rng.randint(1, self.args.foods), 'grams': self.rng.randint(20, 400)
+        })
+
+    def log_batch(self):
+        self.request('log_batch', 'POST', '/food_logs/batch', json={'entries': [
+            {'food_id': self.rng.randint(1, self.args.foods), 'grams': self.rng.randint(20, 400)}
+            for _ in range(10)
+        ]})
+
+    def feed(self):
+        response = self.request('feed', 'GET', '/api/feed')
+        cursor = response.headers.get('X-Next-Cursor') if response is not None else None
+        if cursor and self.rng.random() < 0.3:
+            self.request('feed_next_page', 'GET', '/api/feed', params={'cursor': cursor})
+
+    def history(self):
+        self.request('history', 'GET', f'/food_logs/{self.user_id}')
+
+    def summary(self):
+        self.request('summary', 'GET', '/food_logs/summary')
+
+    def profile(self):
+        self.request('user_profile', 'GET', f'/api/users/{self.rng.randint(1, self.args.users)}/profile')
+
+# mix name -> (action weights, whether clients log in before the clock starts)
+MIXES = {
+    'login-burst': ({'login_burst': 1}, False),
+    'autocomplete': ({'autocomplete': 1}, True),
+    'writes': ({'log_food': 8, 'log_batch': 2}, True),
+    'feed': ({'feed': 1}, True),
+    'mixed': ({
+        'feed': 30, 'autocomplete': 15, 'search': 10, 'history': 15, 'summary': 10,
+        'profile': 10, 'log_food': 8, 'log_batch': 2
+    }, True),
+}
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else None
+
+def run_mix(args, name, seed):
+    weights, log_in_first = MIXES[name]
+    actions, cum_weights = list(weights), []
+    total = 0
+    for action in actions:
+        total += weights[action]
+        cum_weights.append(total)
+    samples = {}  # endpoint -> list of (status, seconds), per thread then merged
+    lock = threading.Lock()
+    stop_at = [None]
+    measuring = threading.Event()
+    ready = threading.Barrier(args.concurrency + 1)
+
+    def worker(index):
+        local = {}
+        def record(endpoint, status, seconds):
+            if measuring.is_set():
+                local.setdefault(endpoint, []).append((status, seconds))
+        client = Client(args, random.Random(f'{seed}-{name}-{index}'), record)
+        if log_in_first:
+            client.login()  # before measuring starts, so not recorded
+        ready.wait()
+        while stop_at[0] is None or time.monotonic() < stop_at[0]:
+            action = client.rng.choices(actions, cum_weights=cum_weights)[0]
+            getattr(client, action)()
+        with lock:
+            for endpoint, values in local.items():
+                samples.setdefault(endpoint, []).extend(values)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    time.sleep(args.warmup)
+    measuring.set()
+    started = time.monotonic()
+    stop_at[0] = started + args.duration
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    results = {}
+    for endpoint, values in sorted(samples.items()):
+        latencies = sorted(seconds for _, seconds in values)
+        statuses = {}
+        for status, _ in values:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        results[endpoint] = {
+            'requests': len(values),
+            'rps': len(values) / elapsed,
+            'errors': sum(count for status, count in statuses.items() if not status.startswith(('2', '3'))),
+            'statuses': statuses,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p90_ms': percentile(latencies, 0.90) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'max_ms': latencies[-1] * 1000,
+            'mean_ms': statistics.fmean(latencies) * 1000,
+        }
+    return {'seconds': elapsed, 'endpoints': results}
+
+def print_mix(name, result, baseline):
+    print(f"\n{name} ({result['seconds']:.1f}s)")
+    print(f"{'endpoint':<16} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>7}  vs baseline")
+    for endpoint, stats in result['endpoints'].items():
+        line = (f"{endpoint:<16} {stats['rps']:>8.1f} {stats['p50_ms']:>8.1f} {stats['p90_ms']:>8.1f} "
+                f"{stats['p99_ms']:>8.1f} {stats['max_ms']:>8.1f} {stats['errors']:>7}")
+        base = (baseline or {}).get(endpoint)
+        if base:
+            line += (f"  req/s {_change(stats['rps'], base['rps']):>7}"
+                     f"  p99 {_change(stats['p99_ms'], base['p99_ms']):>7}")
+        print(line)
+        if stats['statuses'].get('429'):
+            print(f"{'':<16} {stats['statuses']['429']} responses were rate limited; run the server with RATELIMIT_ENABLED=false")
+
+def _change(value, base):
+    return f'{(value - base) / base:+.1%}' if base else 'n/a'
+
+def regressions(results, baseline, tolerance):
+    """Endpoints whose throughput dropped or p99 grew by more than `tolerance` against the baseline."""
+    found = []
+    for name, result in results.items():
+        for endpoint, stats in result['endpoints'].items():
+            base = baseline.get(name, {}).get('endpoints', {}).get(endpoint)
+            if not base:
+                continue
+            if stats['rps'] < base['rps'] * (1 - tolerance):
+                found.append(f'{name}/{endpoint}: req/s {_change(stats["rps"], base["rps"])}')
+            if stats['p99_ms'] > base['p99_ms'] * (1 + tolerance):
+                found.append(f'{name}/{endpoint}: p99 {_change(stats["p99_ms"], base["p99_ms"])}')
+    return found
+
+def serve():
+    """Run the app in this process on a free local port, without rate limits. Returns the URL."""
+    import logging
+    from werkzeug.serving import make_server
+    from app import create_app
+    from config import get_config
+
+    class BenchmarkConfig(get_config()):
+        RATELIMIT_ENABLED = False
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # no access log line per request
+    server = make_server('127.0.0.1', 0, create_app(BenchmarkConfig), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='server to benchmark')
+    parser.add_argument('--serve', action='store_true', help='run the app in this process instead of using --url')
+    parser.add_argument('--mix', action='append', choices=sorted(MIXES), help='mixes to run (default: all)')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=20, help='measured seconds per mix')
+    parser.add_argument('--warmup', type=float, default=3, help='unmeasured seconds before each mix')
+    parser.add_argument('--users', type=int, default=10000, help='users created by flask seed')
+    parser.add_argument('--foods', type=int, default=2000, help='foods created by flask seed')
+    parser.add_argument('--password', default='password', help='password of the seeded users')
+    parser.add_argument('--seed', type=int, default=42, help='seed for the request choices')
+    parser.add_argument('--output', help='where to save the JSON results (default: benchmarks/<timestamp>.json)')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='with --baseline, exit 1 if req/s drops or p99 grows by more than this fraction')
+    args = parser.parse_args()
+
+    if args.serve:
+        args.url = serve()
+    args.url = args.url.rstrip('/')
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['mixes']
+
+    results = {}
+    for name in args.mix or list(MIXES):
+        results[name] = run_mix(args, name, args.seed)
+        print_mix(name, results[name], (baseline or {}).get(name, {}).get('endpoints'))
+
+    output = args.output or os.path.join('benchmarks', datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'url': args.url,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'seed': args.seed,
+            'mixes': results,
+        }, f, indent=2)
+    print(f'\nSaved results to {output}')
+
+    if baseline:
+        found = regressions(results, baseline, args.tolerance)
+        if found:
+            print(f'\nRegressions beyond {args.tolerance:.0%}:')
+            print('\n'.join(f'  {item}' for item in found))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
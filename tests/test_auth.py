@@ -2,6 +2,8 @@ import pytest
 import os
 from app import create_app, db
 from app.models import User
+from app.passwords import passwords
+from app.revocation import BloomFilter, revocation_list
 from config import TestingConfig
 
 @pytest.fixture(autouse=True)
@@ -131,4 +133,118 @@ def test_token_authentication(client, auth_headers):
     # Test malformed token
     response = client.get('/food_logs/1', headers={'Authorization': 'Bearer invalid-token'})
     assert response.status_code == 422
-    assert b'Invalid token' in response.data
\ No newline at end of file
+    assert b'Invalid token' in response.data
+
+def test_rehash_on_login(app, client, registered_user):
+    """Test that logging in upgrades hashes made with old Argon2 parameters."""
+    user = User.query.filter_by(username=registered_user['username']).first()
+    assert ',t=1,' in user.password_hash
+
+    app.config['ARGON2_TIME_COST'] = 2
+    passwords.init_app(app)
+    response = client.post('/auth/login', json={
+        'username': registered_user['username'],
+        'password': registered_user['password']
+    })
+    assert response.status_code == 200
+    db.session.expire_all()
+    user = User.query.filter_by(username=registered_user['username']).first()
+    assert ',t=2,' in user.password_hash
+    assert user.check_password(registered_user['password'])
+
+def test_password_pool(app, client, registered_user):
+    """Test hashing on the worker pool and shedding load when it is full."""
+    app.config['PASSWORD_POOL_WORKERS'] = 1
+    app.config['PASSWORD_POOL_MAX_PENDING'] = 1
+    passwords.init_app(app)
+    try:
+        password_hash = passwords.hash('secret')
+        assert passwords.verify(password_hash, 'secret')
+        assert not passwords.verify(password_hash, 'wrong')
+
+        passwords._pending = 1  # a request already hashing
+        response = client.post('/auth/login', json={
+            'username': registered_user['username'],
+            'password': registered_user['password']
+        })
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        assert passwords.pending == 1
+        passwords._pending = 0
+    finally:
+        passwords.shutdown()
+
+def test_refresh_token_rotation(client, registered_user):
+    """Test refreshing rotates the token and reuse revokes the family."""
+    response = client.post('/auth/login', json={
+        'username': registered_user['username'],
+        'password': registered_user['password']
+    })
+    first = response.get_json()['refresh_token']
+
+    response = client.post('/auth/refresh', json={'refresh_token': first})
+    assert response.status_code == 200
+    data = response.get_json()
+    second = data['refresh_token']
+    assert second != first
+    response = client.get('/api/profile', headers={'Authorization': f"Bearer {data['access_token']}"})
+    assert response.status_code == 200
+
+    # Replaying a used token revokes every token of that login
+    response = client.post('/auth/refresh', json={'refresh_token': first})
+    assert response.status_code == 401
+    response = client.post('/auth/refresh', json={'refresh_token': second})
+    assert response.status_code == 401
+
+    response = client.post('/auth/refresh', json={'refresh_token': 'bogus'})
+    assert response.status_code == 401
+    response = client.post('/auth/refresh', json={})
+    assert response.status_code == 400
+
+def test_logout_revokes_tokens(client, registered_user):
+    """Test that logout revokes the access token and its refresh token."""
+    response = client.post('/auth/login', json={
+        'username': registered_user['username'],
+        'password': registered_user['password']
+    })
+    data = response.get_json()
+    headers = {'Authorization': f"Bearer {data['access_token']}"}
+    assert client.get('/api/profile', headers=headers).status_code == 200
+
+    response = client.post('/auth/logout', json={'refresh_token': data['refresh_token']}, headers=headers)
+    assert response.status_code == 200
+    response = client.get('/api/profile', headers=headers)
+    assert response.status_code == 401
+    assert response.get_json()['message'] == 'Token has been revoked'
+    response = client.post('/auth/refresh', json={'refresh_token': data['refresh_token']})
+    assert response.status_code == 401
+
+def test_admin_revocation_seen_by_other_workers(client, runner, auth_headers):
+    """Test that revoking a user from the CLI reaches a worker's Bloom filter."""
+    assert revocation_list.is_revoked({'jti': 'unknown', 'sub': '1', 'iat': 0}) is False
+
+    result = runner.invoke(args=['tokens', 'revoke-user', '1'])
+    assert result.exit_code == 0
+    revocation_list.clear()  # as in a worker that did not make the revocation
+    assert client.get('/api/profile', headers=auth_headers).status_code == 401
+
+    # Refreshes re-read the last rows but don't count them twice
+    count = revocation_list._filter.count
+    revocation_list.refresh(force=True)
+    revocation_list.refresh(force=True)
+    assert revocation_list._filter.count == count
+
+    result = runner.invoke(args=['tokens', 'revoke-user', '999'])
+    assert result.exit_code != 0
+
+def test_bloom_filter():
+    """Test that the filter has no false negatives and few false positives."""
+    bloom = BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add(f'jti-{i}')
+    assert all(f'jti-{i}' in bloom for i in range(1000))
+    count = bloom.count
+    bloom.add('jti-0')  # refreshes re-read recent rows; they must not fill the filter
+    assert bloom.count == count <= 1000
+    false_positives = sum(f'other-{i}' in bloom for i in range(10000))
+    assert false_positives < 300
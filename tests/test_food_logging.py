@@ -1,7 +1,14 @@
 """Test cases for food logging functionality."""
+import csv
+import gzip
+import io
+import json
 import pytest
-from app.models import FoodLog, Food
-from datetime import datetime
+from app.models import DailyNutrition, FoodLog, Food, madrid_now
+from app.partitions import ensure_log_partitions, list_partitions, month_start
+from app.utils import cleanup_old_logs
+from sqlalchemy import text
+from datetime import datetime, timedelta
 from app import db
 
 def test_create_food_log(client, auth_headers, sample_food, app):
@@ -16,6 +23,12 @@ def test_create_food_log(client, auth_headers, sample_food, app):
         assert response.status_code == 201
         assert 'Food log created successfully' in response.get_json()['message']
 
+        # Stored as naive Madrid wall time, like batch entries
+        db.session.expire_all()
+        stored = FoodLog.query.one().log_date
+        assert stored.tzinfo is None
+        assert abs(stored - madrid_now()) < timedelta(minutes=1)
+
 def test_food_log_validation(client, auth_headers, app):
     """Test food log validation."""
     with app.app_context():
@@ -164,4 +177,193 @@ def test_multiple_logs_same_food(client, auth_headers, sample_food, app):
         response = client.get('/food_logs/1', headers=auth_headers)
         logs = response.get_json()
         assert len(logs) == 3
-        assert sorted([log['grams'] for log in logs]) == [100, 150, 200]
\ No newline at end of file
+        assert sorted([log['grams'] for log in logs]) == [100, 150, 200]
+
+def test_batch_food_logs(client, auth_headers, sample_food, app):
+    """Test batch logging with a mix of valid and invalid entries."""
+    with app.app_context():
+        sample_food = db.session.query(Food).filter_by(name="Test Apple").first()
+        entries = [
+            {'food_id': sample_food.id, 'grams': 100},
+            {'food_id': sample_food.id, 'grams': 250, 'log_date': '2025-03-01T08:30:00'},
+            {'food_id': 99999, 'grams': 100},
+            {'food_id': sample_food.id, 'grams': 0},
+            {'grams': 50},
+        ]
+        response = client.post('/food_logs/batch', json={'entries': entries}, headers=auth_headers)
+        assert response.status_code == 207
+        body = response.get_json()
+        assert body['created'] == 2
+        assert body['failed'] == 3
+        assert [r['status'] for r in body['results']] == [201, 201, 404, 422, 422]
+        assert body['results'][3]['message'] == 'Grams must be greater than 0'
+
+        logs = FoodLog.query.order_by(FoodLog.id).all()
+        assert [log.grams for log in logs] == [100, 250]
+        assert logs[1].log_date == datetime(2025, 3, 1, 8, 30)
+        assert [log.id for log in logs] == [r['id'] for r in body['results'][:2]]
+
+def test_batch_food_logs_entry_validation(client, auth_headers, sample_food, app):
+    """Test batch entries reject non-integer ids, non-finite grams and convert offsets."""
+    with app.app_context():
+        sample_food = db.session.query(Food).filter_by(name="Test Apple").first()
+        entries = [
+            {'food_id': sample_food.id + 0.9, 'grams': 100},
+            {'food_id': True, 'grams': 100},
+            {'food_id': sample_food.id, 'grams': 'nan'},
+            {'food_id': sample_food.id, 'grams': 'inf'},
+            {'food_id': sample_food.id, 'grams': 100, 'log_date': '2025-03-01T07:30:00Z'},
+        ]
+        response = client.post('/food_logs/batch', json={'entries': entries}, headers=auth_headers)
+        assert response.status_code == 207
+        results = response.get_json()['results']
+        assert [r['status'] for r in results] == [422, 422, 422, 422, 201]
+        assert results[0]['message'] == 'food_id must be an integer'
+        assert results[2]['message'] == 'grams must be a finite number'
+
+        # 07:30 UTC is 08:30 in Madrid (CET)
+        log = FoodLog.query.one()
+        assert log.log_date == datetime(2025, 3, 1, 8, 30)
+
+def test_batch_food_logs_validation(client, auth_headers, sample_food, app):
+    """Test batch logging request-level validation."""
+    with app.app_context():
+        sample_food = db.session.query(Food).filter_by(name="Test Apple").first()
+        response = client.post('/food_logs/batch', json={'entries': []}, headers=auth_headers)
+        assert response.status_code == 422
+
+        too_many = [{'food_id': sample_food.id, 'grams': 10}] * (app.config['FOOD_LOG_BATCH_MAX'] + 1)
+        response = client.post('/food_logs/batch', json={'entries': too_many}, headers=auth_headers)
+        assert response.status_code == 413
+
+        response = client.post('/food_logs/batch', json={'entries': [{'food_id': 99999, 'grams': 10}]},
+                               headers=auth_headers)
+        assert response.status_code == 422
+        assert FoodLog.query.count() == 0
+
+def test_food_log_history_pagination(client, auth_headers, sample_food, app):
+    """Test date filters and cursor pagination of a user's log history."""
+    with app.app_context():
+        sample_food = db.session.query(Food).filter_by(name="Test Apple").first()
+        entries = [
+            {'food_id': sample_food.id, 'grams': day * 10, 'log_date': f'2025-03-{day:02d}T12:00:00'}
+            for day in range(1, 8)
+        ]
+        client.post('/food_logs/batch', json={'entries': entries}, headers=auth_headers)
+
+        # Newest first, three per page
+        grams = []
+        cursor = None
+        while True:
+            url = '/food_logs/1?limit=3' + (f'&cursor={cursor}' if cursor else '')
+            response = client.get(url, headers=auth_headers)
+            assert response.status_code == 200
+            page = response.get_json()
+            assert len(page) <= 3
+            grams.extend(log['grams'] for log in page)
+            cursor = response.headers.get('X-Next-Cursor')
+            if not cursor:
+                break
+        assert grams == [70, 60, 50, 40, 30, 20, 10]
+
+        # Inclusive date range
+        response = client.get('/food_logs/1?from=2025-03-02&to=2025-03-04', headers=auth_headers)
+        assert [log['grams'] for log in response.get_json()] == [40, 30, 20]
+
+        response = client.get('/food_logs/1?from=March', headers=auth_headers)
+        assert response.status_code == 400
+        response = client.get('/food_logs/1?cursor=bogus', headers=auth_headers)
+        assert response.status_code == 400
+
+def test_nutrition_summary(client, auth_headers, sample_food, app):
+    """Test daily rollups follow logging and cleanup, and the summary reads them."""
+    with app.app_context():
+        sample_food = db.session.query(Food).filter_by(name="Test Apple").first()
+        client.put('/api/profile', json={'daily_calorie_goal': 2000}, headers=auth_headers)
+        old_day = (madrid_now() - timedelta(days=60)).date()
+        client.post('/food_logs/batch', json={'entries': [
+            {'food_id': sample_food.id, 'grams': 100, 'log_date': f'{old_day}T09:00:00'},
+            {'food_id': sample_food.id, 'grams': 200, 'log_date': f'{old_day}T13:00:00'},
+        ]}, headers=auth_headers)
+        client.post('/food_logs', json={'food_id': sample_food.id, 'grams': 150}, headers=auth_headers)
+
+        response = client.get('/food_logs/summary', headers=auth_headers)
+        assert response.status_code == 200
+        summary = response.get_json()
+        assert summary['daily_calorie_goal'] == 2000
+        assert len(summary['days']) == 1
+        today = summary['days'][0]
+        assert today['calories'] == pytest.approx(78.0)
+        assert today['protein'] == pytest.approx(0.45)
+        assert today['remaining_calories'] == pytest.approx(1922.0)
+
+        response = client.get(f'/food_logs/summary?from={old_day}&to={old_day + timedelta(days=1)}',
+                              headers=auth_headers)
+        days = response.get_json()['days']
+        assert [day['log_count'] for day in days] == [2, 0]
+        assert days[0]['calories'] == pytest.approx(156.0)
+
+        # Retention cleanup removes the old logs and their rollup row together
+        cleanup_old_logs()
+        assert db.session.get(DailyNutrition, (1, old_day)) is None
+        assert FoodLog.query.count() == 1
+
+        response = client.get('/food_logs/summary?from=2025-03-10&to=2025-03-01', headers=auth_headers)
+        assert response.status_code == 400
+
+def test_log_partitions_and_retention(client, auth_headers, sample_food, app):
+    """Test monthly partitions absorb existing rows and expire by partition drop."""
+    # Runs in the fixture's app context: dropping a partition needs every
+    # other transaction touching users/foods to be finished.
+    sample_food = db.session.query(Food).filter_by(name="Test Apple").first()
+    old_day = month_start(madrid_now() - timedelta(days=100))
+    recent_expired = madrid_now() - timedelta(days=40)
+    client.post('/food_logs/batch', json={'entries': [
+        {'food_id': sample_food.id, 'grams': 100, 'log_date': f'{old_day}T09:00:00'},
+        {'food_id': sample_food.id, 'grams': 120, 'log_date': recent_expired.isoformat()},
+    ]}, headers=auth_headers)
+    client.post('/food_logs', json={'food_id': sample_food.id, 'grams': 150}, headers=auth_headers)
+
+    # Creating partitions moves rows out of the default partition
+    created = ensure_log_partitions(app.config['FOOD_LOG_PARTITION_MONTHS_AHEAD'], start=old_day)
+    assert created == len(list_partitions()) >= 4
+    assert db.session.execute(text("SELECT count(*) FROM food_logs_default")).scalar() == 0
+    assert ensure_log_partitions(app.config['FOOD_LOG_PARTITION_MONTHS_AHEAD']) == 0
+
+    # The 100-day-old month goes as a whole partition; the 40-day-old row is
+    # deleted either with its partition or row by row, depending on the date
+    cleanup_old_logs()
+    assert old_day not in list_partitions()
+    assert db.session.get(DailyNutrition, (1, old_day)) is None
+    assert db.session.get(DailyNutrition, (1, recent_expired.date())) is None
+    assert [log.grams for log in FoodLog.query.all()] == [150]
+
+def test_export_food_logs(client, auth_headers, sample_food, app):
+    """Test streaming the full log history as NDJSON and CSV, gzipped on request."""
+    with app.app_context():
+        sample_food = db.session.query(Food).filter_by(name="Test Apple").first()
+        app.config['FOOD_LOG_EXPORT_CHUNK_ROWS'] = 2
+        entries = [
+            {'food_id': sample_food.id, 'grams': day * 10, 'log_date': f'2025-03-{day:02d}T12:00:00'}
+            for day in range(1, 6)
+        ]
+        client.post('/food_logs/batch', json={'entries': entries}, headers=auth_headers)
+
+        response = client.get('/food_logs/export', headers=auth_headers)
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        assert response.is_streamed
+        records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert [record['grams'] for record in records] == [10, 20, 30, 40, 50]
+        assert records[0]['food_name'] == 'Test Apple'
+        assert records[0]['calories'] == pytest.approx(5.2)
+
+        response = client.get('/food_logs/export?format=csv&from=2025-03-02&to=2025-03-03',
+                              headers={**auth_headers, 'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(response.get_data()).decode())))
+        assert [row['grams'] for row in rows] == ['20.0', '30.0']
+        assert rows[0]['log_date'] == '2025-03-02T12:00:00'
+
+        response = client.get('/food_logs/export?format=xml', headers=auth_headers)
+        assert response.status_code == 400
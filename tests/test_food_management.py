@@ -1,5 +1,7 @@
 """Test cases for food management functionality."""
 import pytest
+from app import db
+from app.food_index import food_index
 from app.models import Food
 from app.feature_flags import Feature, FeatureFlags
 
@@ -105,4 +107,87 @@ def test_nutrition_tracking_feature_flag(client, auth_headers):
     foods = response.get_json()
     assert foods[0].get('protein') is None
     assert foods[0].get('carbs') is None
-    assert foods[0].get('fat') is None
\ No newline at end of file
+    assert foods[0].get('fat') is None
+
+def test_search_foods_ranking_and_pagination(client, app):
+    """Test that search ranks exact/prefix matches first and paginates with a cursor."""
+    with app.app_context():
+        db.session.add_all([
+            Food(name="Pineapple Juice", calories_per_100g=50.0),
+            Food(name="Apple Pie", calories_per_100g=237.0),
+            Food(name="Apple", calories_per_100g=52.0),
+            Food(name="Crab Apple", calories_per_100g=76.0),
+        ])
+        db.session.commit()
+
+    response = client.get('/foods?query=apple')
+    names = [food['name'] for food in response.get_json()]
+    assert names[0] == 'Apple'
+    assert names[1] == 'Apple Pie'
+    assert set(names[2:]) == {'Pineapple Juice', 'Crab Apple'}
+
+    # Walk the same result set two rows at a time
+    seen = []
+    cursor = None
+    while True:
+        url = '/foods?query=apple&limit=2' + (f'&cursor={cursor}' if cursor else '')
+        response = client.get(url)
+        assert response.status_code == 200
+        page = response.get_json()
+        assert len(page) <= 2
+        seen.extend(food['name'] for food in page)
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+    assert seen == names
+
+    response = client.get('/foods?query=apple&cursor=not-a-cursor')
+    assert response.status_code == 400
+
+def test_autocomplete_from_memory_index(client, auth_headers, app):
+    """Test autocomplete answers from the in-memory index and sees new foods."""
+    app.config['FOOD_INDEX_ENABLED'] = True
+    app.config['FOOD_INDEX_REFRESH_SECONDS'] = 0
+    food_index.clear()
+    with app.app_context():
+        db.session.add_all([
+            Food(name="Crème Brûlée", calories_per_100g=320.0),
+            Food(name="Chicken Breast", calories_per_100g=165.0),
+            Food(name="Chickpeas", calories_per_100g=164.0),
+        ])
+        db.session.commit()
+
+    # Accent-folded prefix match
+    response = client.get('/foods/autocomplete?query=creme bru')
+    assert response.status_code == 200
+    assert [food['name'] for food in response.get_json()] == ['Crème Brûlée']
+
+    # Word prefix and infix matches
+    response = client.get('/foods/autocomplete?query=chick')
+    assert {food['name'] for food in response.get_json()} == {'Chicken Breast', 'Chickpeas'}
+    response = client.get('/foods/autocomplete?query=reast')
+    assert [food['name'] for food in response.get_json()] == ['Chicken Breast']
+
+    # Foods created through the API are patched in via the catalog version
+    response = client.post('/foods', json={'name': 'Chicken Soup', 'calories_per_100g': 36.0},
+                           headers=auth_headers)
+    assert response.status_code == 201
+    version = food_index.version
+    response = client.get('/foods/autocomplete?query=chicken s')
+    assert [food['name'] for food in response.get_json()] == ['Chicken Soup']
+    assert food_index.version > version
+    assert len(food_index) == 4
+
+def test_autocomplete_falls_back_when_index_fails(client, app, sample_food, monkeypatch):
+    """Test autocomplete uses the database search if the index can't be built."""
+    app.config['FOOD_INDEX_ENABLED'] = True
+    food_index.clear()
+
+    def broken_build(force=False):
+        raise RuntimeError("database unreachable")
+    monkeypatch.setattr(food_index, 'build', broken_build)
+
+    response = client.get('/foods/autocomplete?query=apple')
+    assert response.status_code == 200
+    assert [food['name'] for food in response.get_json()] == ['Test Apple']
+    assert not food_index.loaded
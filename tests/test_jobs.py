@@ -0,0 +1,53 @@
+"""Tests for the background job runner."""
+from app import db
+from app.jobs import JOBS, JobRunner, run_job
+from app.models import JobRun
+
+def test_run_job_records_run(app, monkeypatch):
+    """Test that runs are recorded with their row counts and errors."""
+    def failing():
+        raise RuntimeError("boom")
+
+    monkeypatch.setitem(JOBS, 'counting', (lambda: 7, {'trigger': 'interval', 'days': 1}, False))
+    monkeypatch.setitem(JOBS, 'failing', (failing, {'trigger': 'interval', 'days': 1}, False))
+
+    assert run_job('counting') is True
+    assert run_job('failing') is False
+
+    runs = {run.job_name: run for run in db.session.execute(db.select(JobRun)).scalars()}
+    assert runs['counting'].succeeded
+    assert runs['counting'].rows == 7
+    assert runs['counting'].duration_ms >= 0
+    assert not runs['failing'].succeeded
+    assert runs['failing'].error == 'RuntimeError: boom'
+
+def test_only_one_runner_leads(app):
+    """Test that the leader lock is exclusive and passes on when released."""
+    first, second = JobRunner(app), JobRunner(app)
+    try:
+        assert first.acquire_lock()
+        assert first.check_lock()
+        assert not second.acquire_lock()
+        assert not second.is_leader
+
+        first.release()
+        assert not first.is_leader
+        assert second.acquire_lock()
+        assert not first.acquire_lock()
+    finally:
+        first.release()
+        second.release()
+
+def test_jobs_cli_run_once(app):
+    """Test running a single job from the command line."""
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['jobs', 'run-once', 'ensure_log_partitions'])
+    assert result.exit_code == 0
+
+    run = db.session.execute(db.select(JobRun)).scalar_one()
+    assert run.job_name == 'ensure_log_partitions'
+    assert run.succeeded
+    assert run.rows == app.config['FOOD_LOG_PARTITION_MONTHS_AHEAD'] + 1
+
+    result = runner.invoke(args=['jobs', 'run-once', 'no_such_job'])
+    assert result.exit_code != 0
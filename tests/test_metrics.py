@@ -0,0 +1,40 @@
+"""Tests for the /metrics endpoint."""
+import json
+import os
+
+def test_metrics_endpoint(app, client, auth_headers):
+    """Test that request latencies are recorded per endpoint and merged across workers."""
+    client.get('/foods?query=apple', headers=auth_headers)
+    client.get('/foods?limit=0', headers=auth_headers)
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert '# TYPE bytebites_request_duration_seconds histogram' in text
+    assert ('bytebites_request_duration_seconds_bucket{endpoint="routes.search_foods",'
+            'method="GET",status="200",le="+Inf"}') in text
+    assert 'bytebites_request_duration_seconds_count{endpoint="routes.search_foods",method="GET",status="400"} ' in text
+    assert 'bytebites_db_pool_connections{state="checked_out"}' in text
+    assert 'bytebites_password_pool_pending 0' in text
+
+    # Another worker's totals are added in
+    other = {'metrics': {'bytebites_request_duration_seconds': {
+        '\x1f'.join(['routes.search_foods', 'GET', '200']): [1] + [0] * 14
+    }}, 'gauges': {}}
+    with open(os.path.join(app.config['METRICS_DIR'], '999999.json'), 'w') as f:
+        json.dump(other, f)
+    before = _count(text)
+    assert _count(client.get('/metrics').get_data(as_text=True)) == before + 1
+    os.remove(os.path.join(app.config['METRICS_DIR'], '999999.json'))
+
+def test_metrics_token(app, client):
+    """Test that a configured METRICS_TOKEN is required."""
+    app.config['METRICS_TOKEN'] = 'scrape-me'
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer scrape-me'}).status_code == 200
+
+def _count(text):
+    prefix = 'bytebites_request_duration_seconds_count{endpoint="routes.search_foods",method="GET",status="200"} '
+    line = next(line for line in text.splitlines() if line.startswith(prefix))
+    return int(line[len(prefix):])
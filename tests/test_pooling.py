@@ -0,0 +1,53 @@
+"""Tests for the connection pool settings and instrumentation."""
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from app import create_app, db
+from app.pooling import POOL_CHECKOUT, POOL_CONNECTIONS, POOL_TIMEOUTS, InstrumentedQueuePool
+from config import TestingConfig
+
+def _count(metric, *labels):
+    return metric.snapshot().get('\x1f'.join(labels), [0])[0]
+
+def test_pool_options_and_metrics(app):
+    """Test that the engine uses the instrumented pool, the statement timeout and records churn and timeouts."""
+    assert isinstance(db.engine.pool, InstrumentedQueuePool)
+    with db.engine.connect() as conn:
+        assert conn.execute(text("SHOW statement_timeout")).scalar() == '30s'
+        assert conn.execute(text("SHOW application_name")).scalar() == 'bytebites'
+
+    class TinyPoolConfig(TestingConfig):
+        SQLALCHEMY_ENGINE_OPTIONS = {**TestingConfig.SQLALCHEMY_ENGINE_OPTIONS,
+                                     "pool_size": 1, "max_overflow": 0, "pool_timeout": 0.1}
+
+    tiny = create_app(TinyPoolConfig)
+    with tiny.app_context():
+        engine = db.engine
+        opened = _count(POOL_CONNECTIONS, 'primary', 'connect')
+        timeouts = _count(POOL_TIMEOUTS, 'primary')
+        with engine.connect():
+            with pytest.raises(PoolTimeoutError):
+                engine.connect()
+        assert _count(POOL_TIMEOUTS, 'primary') == timeouts + 1
+        assert sum(POOL_CHECKOUT.snapshot()['primary'][:-1]) >= 2  # bucket counts, without the sum
+        assert _count(POOL_CONNECTIONS, 'primary', 'connect') == opened + 1
+
+        engine.dispose()
+        assert _count(POOL_CONNECTIONS, 'primary', 'close') >= 1
+        with engine.connect():
+            pass  # the recreated pool is still counted
+        assert _count(POOL_CONNECTIONS, 'primary', 'connect') == opened + 2
+
+def test_pgbouncer_mode():
+    """Test that PgBouncer mode sends no session settings and the job runner refuses to start."""
+    class PgBouncerConfig(TestingConfig):
+        DB_PGBOUNCER = True
+
+    bouncer = create_app(PgBouncerConfig)
+    assert 'options' not in bouncer.config['SQLALCHEMY_ENGINE_OPTIONS']['connect_args']
+    with bouncer.app_context():
+        with db.engine.connect() as conn:
+            assert conn.execute(text("SHOW statement_timeout")).scalar() != '30s'
+    result = bouncer.test_cli_runner().invoke(args=['jobs', 'run'])
+    assert result.exit_code != 0
+    assert 'advisory lock' in result.output
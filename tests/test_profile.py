@@ -3,6 +3,7 @@ import pytest
 from datetime import date
 from app.models import User, FoodLog, Food
 from app import db  # Add missing import
+from app.utils import reconcile_follow_counts
 
 @pytest.fixture
 def second_user(client):
@@ -84,6 +85,29 @@ def test_follow_unfollow_user(client, auth_headers, second_user, second_user_tok
     profile = response.get_json()
     assert profile['following_count'] == 0
 
+def test_follow_counters_and_reconciliation(client, auth_headers, second_user, app):
+    """Test that following twice counts once and drifted counters are repaired."""
+    with app.app_context():
+        client.post('/api/users/2/follow', headers=auth_headers)
+        client.post('/api/users/2/follow', headers=auth_headers)
+        response = client.get('/api/users/2/profile', headers=auth_headers)
+        assert response.get_json()['followers_count'] == 1
+
+        client.post('/api/users/2/unfollow', headers=auth_headers)
+        client.post('/api/users/2/unfollow', headers=auth_headers)
+        response = client.get('/api/users/2/profile', headers=auth_headers)
+        assert response.get_json()['followers_count'] == 0
+        assert response.get_json()['is_following'] is False
+
+        client.post('/api/users/2/follow', headers=auth_headers)
+        db.session.execute(db.update(User).values(followers_count=42, following_count=7))
+        db.session.commit()
+        assert reconcile_follow_counts() == 2
+        counts = {user.username: (user.followers_count, user.following_count)
+                  for user in db.session.execute(db.select(User)).scalars()}
+        assert counts == {'testuser': (0, 1), 'testuser2': (1, 0)}
+        assert reconcile_follow_counts() == 0
+
 def test_feed(client, auth_headers, second_user_token, app):
     """Test user feed with followed users."""
     with app.app_context():
@@ -135,4 +159,47 @@ def test_invalid_follow_operations(client, auth_headers):
     # Try to follow self
     response = client.post('/api/users/1/follow', headers=auth_headers)
     assert response.status_code == 400
-    assert 'Cannot follow yourself' in response.get_json()['message']
\ No newline at end of file
+    assert 'Cannot follow yourself' in response.get_json()['message']
+def test_feed_inbox_pagination_and_fan_out_on_read(client, auth_headers, second_user_token, app):
+    """Test feed cursors, unfollow cleanup and authors merged in on read."""
+    with app.app_context():
+        food = Food(name="Apple", calories_per_100g=52.0)
+        db.session.add(food)
+        db.session.commit()
+        headers2 = {'Authorization': f'Bearer {second_user_token}'}
+
+        client.post('/api/users/2/follow', headers=auth_headers)
+        client.post('/food_logs/batch', json={'entries': [
+            {'food_id': food.id, 'grams': day * 10, 'log_date': f'2025-03-{day:02d}T12:00:00'}
+            for day in range(1, 6)
+        ]}, headers=headers2)
+        client.post('/food_logs/batch', json={'entries': [
+            {'food_id': food.id, 'grams': 15, 'log_date': '2025-03-01T18:00:00'}
+        ]}, headers=auth_headers)
+
+        def read_all(page_size):
+            grams, cursor = [], None
+            while True:
+                url = f'/api/feed?limit={page_size}' + (f'&cursor={cursor}' if cursor else '')
+                response = client.get(url, headers=auth_headers)
+                assert response.status_code == 200
+                grams.extend(log['grams'] for log in response.get_json())
+                cursor = response.headers.get('X-Next-Cursor')
+                if not cursor:
+                    return grams
+
+        assert read_all(2) == [50, 40, 30, 20, 15, 10]
+
+        # Past the celebrity threshold the author's logs are read from food_logs
+        app.config['FEED_CELEBRITY_FOLLOWERS'] = 1
+        client.post('/food_logs/batch', json={'entries': [
+            {'food_id': food.id, 'grams': 60, 'log_date': '2025-03-06T12:00:00'}
+        ]}, headers=headers2)
+        assert read_all(4) == [60, 50, 40, 30, 20, 15, 10]
+        app.config['FEED_CELEBRITY_FOLLOWERS'] = 10000
+
+        client.post('/api/users/2/unfollow', headers=auth_headers)
+        assert read_all(10) == [15]
+
+        response = client.get('/api/feed?cursor=bogus', headers=auth_headers)
+        assert response.status_code == 400
@@ -0,0 +1,51 @@
+"""Tests for the request profiler and `flask profile merge`."""
+import os
+import threading
+import time
+import pytest
+from app.profiling import Sampler
+
+def test_profile_on_demand_and_merge(app, client, tmp_path):
+    """Test that requests with the profile token are profiled and merged into flamegraphs."""
+    app.config.update(PROFILE_TOKEN='let-me-see', PROFILE_DIR=str(tmp_path))
+
+    @app.route('/_slow')
+    def slow_view():
+        time.sleep(0.05)
+        return 'ok'
+
+    client.get('/_slow')
+    assert not os.path.exists(tmp_path / 'slow_view')
+    client.get('/_slow', headers={'X-Profile': 'wrong'})
+    assert not os.path.exists(tmp_path / 'slow_view')
+
+    client.get('/_slow', headers={'X-Profile': 'let-me-see'})
+    app.config['PROFILE_FORMAT'] = 'speedscope'
+    client.get('/_slow', headers={'X-Profile': 'let-me-see'})
+    files = sorted(os.listdir(tmp_path / 'slow_view'))
+    assert len(files) == 2
+    assert files[0].endswith('.folded') or files[1].endswith('.folded')
+    assert any(name.endswith('.speedscope.json') for name in files)
+
+    result = app.test_cli_runner().invoke(args=['profile', 'merge'])
+    assert result.exit_code == 0, result.output
+    assert 'slow_view: 2 profiles' in result.output
+    with open(tmp_path / 'flamegraphs' / 'slow_view.folded') as f:
+        top = f.readline()
+    assert 'slow_view (tests/test_profiling.py:' in top
+    svg = (tmp_path / 'flamegraphs' / 'slow_view.svg').read_text()
+    assert svg.startswith('<svg') and 'slow_view' in svg
+
+def test_profiler_stops_when_the_view_raises(app, client, tmp_path):
+    """Test that a failing request's sampler is stopped and its profile still written."""
+    app.config.update(PROFILE_TOKEN='let-me-see', PROFILE_DIR=str(tmp_path))
+
+    @app.route('/_broken')
+    def broken_view():
+        time.sleep(0.05)
+        raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        client.get('/_broken', headers={'X-Profile': 'let-me-see'})
+    assert not any(isinstance(thread, Sampler) for thread in threading.enumerate())
+    assert len(os.listdir(tmp_path / 'broken_view')) == 1
@@ -0,0 +1,75 @@
+"""Tests for per-request SQL statement counts, query budgets, deadlines and row caps."""
+import pytest
+from sqlalchemy import text
+from app import db
+from app.models import Food
+from app.queries import QueryBudgetExceeded, query_budget
+
+def test_query_count_does_not_grow_with_rows(client, auth_headers, sample_food, app):
+    """Test that log history and the feed run the same number of statements for 1 or 30 rows."""
+    with app.app_context():
+        food_id = db.session.query(Food).filter_by(name="Test Apple").first().id
+        client.post('/food_logs', json={'food_id': food_id, 'grams': 100}, headers=auth_headers)
+        single = client.get('/food_logs/1', headers=auth_headers)
+        assert single.status_code == 200
+        assert float(single.headers['X-Query-Time-Ms']) >= 0
+
+        entries = [{'food_id': food_id, 'grams': 10 + i} for i in range(29)]
+        client.post('/food_logs/batch', json={'entries': entries}, headers=auth_headers)
+        many = client.get('/food_logs/1', headers=auth_headers)
+        assert len(many.get_json()) == 30
+        assert many.headers['X-Query-Count'] == single.headers['X-Query-Count']
+
+def test_query_budget_and_repeated_statements(client, app):
+    """Test that going over a budget raises in strict mode and repeated statements are counted."""
+    @app.route('/_lazy_loop')
+    @query_budget(2)
+    def lazy_loop():
+        for _ in range(6):
+            db.session.execute(db.select(Food).limit(1)).all()
+        return 'ok'
+
+    with pytest.raises(QueryBudgetExceeded):
+        client.get('/_lazy_loop')
+
+    app.config['QUERY_BUDGET_STRICT'] = False
+    response = client.get('/_lazy_loop')
+    assert response.headers['X-Query-Count'] == '6'
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'bytebites_repeated_statements_total{endpoint="lazy_loop"} ' in text
+    assert 'bytebites_request_queries_count{endpoint="lazy_loop"} ' in text
+
+def test_deadline_and_row_cap(client, app):
+    """Test that requests get a statement_timeout from their deadline, and 503/413 when a limit fires."""
+    @app.route('/_timeout')
+    def show_timeout():
+        return db.session.execute(text("SHOW statement_timeout")).scalar()
+
+    @app.route('/_sleep')
+    def sleep_in_db():
+        db.session.execute(text("SELECT pg_sleep(2)"))
+        return 'ok'
+
+    @app.route('/_rows/<int:count>')
+    def read_rows(count):
+        return str(len(db.session.execute(text("SELECT generate_series(1, :n)"), {'n': count}).all()))
+
+    app.config.update(
+        QUERY_DEADLINE_OVERRIDES={'sleep_in_db': 0.2, 'show_timeout': 3.0},
+        QUERY_ROW_CAP_OVERRIDES={'read_rows': 10},
+    )
+    db.session.commit()  # requests start their own transaction
+    timeout = client.get('/_timeout').get_data(as_text=True)
+    assert timeout.endswith('ms') and 2900 <= int(timeout[:-2]) <= 3000
+
+    db.session.commit()
+    response = client.get('/_sleep')
+    assert response.status_code == 503
+    assert response.get_json()['message'] == "The request took too long; try again later"
+
+    assert client.get('/_rows/10').get_data(as_text=True) == '10'
+    response = client.get('/_rows/11')
+    assert response.status_code == 413
+    metrics = client.get('/metrics').get_data(as_text=True)
+    assert 'bytebites_request_limits_exceeded_total{endpoint="sleep_in_db",limit="deadline"} ' in metrics
+    assert 'bytebites_request_limits_exceeded_total{endpoint="read_rows",limit="row_cap"} ' in metrics
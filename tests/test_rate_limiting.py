@@ -0,0 +1,88 @@
+"""Tests for rate limiting."""
+import pytest
+from limits import parse
+from app import create_app, db
+from app import ratelimit
+from app.ratelimit import SlidingWindowCounterRateLimiter, SQLiteStorage
+from config import TestingConfig
+
+@pytest.fixture
+def limited_app(tmp_path):
+    """An app with rate limiting on, counting in a throwaway SQLite file."""
+    class LimitedConfig(TestingConfig):
+        RATELIMIT_ENABLED = True
+        RATELIMIT_STORAGE_URI = f"sqlite:///{tmp_path}/limits.sqlite"
+        RATELIMIT_AUTH = "3 per minute"
+        RATELIMIT_READ = "2 per minute"
+
+    app = create_app(LimitedConfig)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+def test_sqlite_storage_is_shared(tmp_path):
+    """Test that separate storage instances (as in separate workers) share counters."""
+    uri = f"sqlite:///{tmp_path}/limits.sqlite"
+    first, second = SQLiteStorage(uri), SQLiteStorage(uri)
+    assert first.incr('key', 60) == 1
+    assert second.incr('key', 60) == 2
+    assert first.get('key') == 2
+    assert second.get_expiry('key') > 0
+    second.clear('key')
+    assert first.get('key') == 0
+
+    first.incr('short', -1)  # already expired
+    assert first.get('short') == 0
+    assert first.incr('short', 60) == 1
+
+def test_sliding_window_counter(tmp_path, monkeypatch):
+    """Test that the previous window counts in proportion to its overlap."""
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, 'time', lambda: now[0])
+    limiter = SlidingWindowCounterRateLimiter(SQLiteStorage(f"sqlite:///{tmp_path}/limits.sqlite"))
+    item = parse("10 per minute")
+
+    now[0] = 60 * 100 + 50  # late in a window
+    assert all(limiter.hit(item, 'user') for _ in range(10))
+    assert not limiter.hit(item, 'user')
+
+    # A quarter into the next window, 3/4 of the previous 11 hits still count
+    now[0] = 60 * 101 + 15
+    assert limiter.get_window_stats(item, 'user').remaining == 2
+    assert limiter.hit(item, 'user')
+    assert limiter.hit(item, 'user')
+    assert not limiter.hit(item, 'user')
+
+    # Two windows later nothing is left
+    now[0] = 60 * 103
+    assert limiter.test(item, 'user')
+
+def test_limits_per_endpoint_and_identity(limited_app):
+    """Test the login budget and per-user budgets on read endpoints."""
+    client = limited_app.test_client()
+    for name in ('first', 'second'):
+        client.post('/auth/register', json={
+            'username': name, 'email': f'{name}@example.com', 'password': 'password123'
+        })
+
+    tokens = []
+    for name in ('first', 'second'):
+        response = client.post('/auth/login', json={'username': name, 'password': 'password123'})
+        assert response.status_code == 200
+        tokens.append(response.get_json()['access_token'])
+
+    # Logins are limited per address, whoever logs in
+    response = client.post('/auth/login', json={'username': 'first', 'password': 'password123'})
+    assert response.status_code == 200
+    response = client.post('/auth/login', json={'username': 'second', 'password': 'password123'})
+    assert response.status_code == 429
+
+    # Both users come from the same address but have their own read budget
+    for token in tokens:
+        headers = {'Authorization': f'Bearer {token}'}
+        assert client.get('/foods', headers=headers).status_code == 200
+        assert client.get('/foods', headers=headers).status_code == 200
+        assert client.get('/foods', headers=headers).status_code == 429
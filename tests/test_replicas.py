@@ -0,0 +1,67 @@
+"""Tests for read-replica routing, with a second local database standing in for the replica."""
+import os
+import time
+import pytest
+from sqlalchemy.engine import make_url
+from app import create_app, db, replicas
+from app.models import Food
+from config import TestingConfig
+
+REPLICA_URL = os.getenv(
+    'DATABASE_REPLICA_TEST_URL',
+    make_url(TestingConfig.SQLALCHEMY_DATABASE_URI).set(
+        database=make_url(TestingConfig.SQLALCHEMY_DATABASE_URI).database + '_replica'
+    ).render_as_string(hide_password=False)
+)
+
+class ReplicaConfig(TestingConfig):
+    SQLALCHEMY_REPLICA_URIS = [REPLICA_URL]
+    REPLICA_STICKY_SECONDS = 1
+
+@pytest.fixture
+def replica_app():
+    app = create_app(ReplicaConfig)
+    with app.app_context():
+        replica = app.extensions['replicas'].engines['replica_0']
+        for engine in (db.engine, replica):
+            db.metadata.drop_all(engine)
+            db.metadata.create_all(engine)
+        yield app
+        db.session.remove()
+        for engine in (db.engine, replica):
+            db.metadata.drop_all(engine)
+
+def test_read_only_views_use_the_replica(replica_app, monkeypatch):
+    """Test replica reads, read-your-writes after a write, and falling back when the replica lags."""
+    client = replica_app.test_client()
+    client.post('/auth/register', json={'username': 'reader', 'email': 'reader@example.com', 'password': 'password123'})
+    token = client.post('/auth/login', json={'username': 'reader', 'password': 'password123'}).get_json()['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+    with replica_app.extensions['replicas'].engines['replica_0'].begin() as conn:
+        conn.execute(db.insert(Food).values(id=500, name='Replica Kiwi', calories_per_100g=61.0))
+    food = Food(name='Primary Kiwi', calories_per_100g=61.0)
+    db.session.add(food)
+    db.session.commit()
+
+    # Anonymous read-only view: served by the replica
+    assert [item['name'] for item in client.get('/foods?query=kiwi').get_json()] == ['Replica Kiwi']
+
+    # Writes go to the primary, and the writer's next reads follow them there
+    assert client.post('/food_logs', json={'food_id': food.id, 'grams': 100}, headers=headers).status_code == 201
+    assert len(client.get('/food_logs/1', headers=headers).get_json()) == 1
+
+    # Once the sticky window is over the replica, which never got the log, is used again
+    time.sleep(1.1)
+    assert client.get('/food_logs/1', headers=headers).get_json() == []
+
+    # A lagging or unreachable replica is skipped
+    monkeypatch.setattr(replicas, 'measure_lag', lambda engine: 30.0)
+    assert len(client.get('/food_logs/1', headers=headers).get_json()) == 1
+    assert replica_app.extensions['replicas'].lags == {'replica_0': 30.0}
+
+    def unreachable(engine):
+        raise OSError('connection refused')
+    monkeypatch.setattr(replicas, 'measure_lag', unreachable)
+    assert len(client.get('/food_logs/1', headers=headers).get_json()) == 1
+    monkeypatch.undo()
+    assert client.get('/food_logs/1', headers=headers).get_json() == []
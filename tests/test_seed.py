@@ -0,0 +1,39 @@
+"""Tests for the `flask seed` command."""
+from sqlalchemy import text
+from app import db
+from app.utils import reconcile_follow_counts
+
+_ARGS = ['seed', '--users', '60', '--foods', '40', '--logs', '3000', '--days', '45',
+         '--end-date', '2026-03-15', '--feed-days', '20', '--seed', '7']
+
+def _fingerprint():
+    return db.session.execute(text(
+        "SELECT md5(string_agg(concat_ws(',', id, user_id, food_id, grams, log_date), ';' ORDER BY id)) FROM food_logs"
+    )).scalar()
+
+def test_seed(app):
+    """Test that seeding fills consistent, reproducible data."""
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=_ARGS)
+    assert result.exit_code == 0, result.output
+
+    assert db.session.execute(text("SELECT count(*) FROM users")).scalar() == 60
+    assert db.session.execute(text("SELECT count(*) FROM foods")).scalar() == 40
+    assert db.session.execute(text("SELECT count(*) FROM food_logs_default")).scalar() == 0
+    assert db.session.execute(text("SELECT sum(log_count) FROM daily_nutrition")).scalar() == 3000
+    assert db.session.execute(text("SELECT count(*) FROM followers")).scalar() > 0
+    assert db.session.execute(text("SELECT count(*) FROM feed_entries")).scalar() > 0
+    assert db.session.execute(text(
+        "SELECT min(log_date) >= '2026-01-29' AND max(log_date) < '2026-03-15' FROM food_logs"
+    )).scalar()
+    assert reconcile_follow_counts() == 0
+    fingerprint = _fingerprint()
+
+    # Refuses to mix with existing data; --reset reproduces it exactly
+    assert runner.invoke(args=_ARGS).exit_code != 0
+    result = runner.invoke(args=_ARGS + ['--reset'])
+    assert result.exit_code == 0, result.output
+    assert _fingerprint() == fingerprint
+
+    # New rows continue after the generated ids
+    assert db.session.execute(text("SELECT nextval(pg_get_serial_sequence('food_logs', 'id'))")).scalar() == 3001
@@ -0,0 +1,38 @@
+"""Tests for the slow-query log."""
+import json
+from sqlalchemy import text
+from app import db
+from app.slowlog import redact, slow_query_log
+
+def test_slow_query_log_with_plan(app, client):
+    """Test that slow statements are logged with redacted parameters, endpoint and plan."""
+    app.config['SLOW_QUERY_THRESHOLD_MS'] = 20
+
+    @app.route('/_slow_query')
+    def slow_query():
+        db.session.execute(text("SELECT pg_sleep(0.03), :email AS email, :n AS n"),
+                           {"email": "someone@example.com", "n": 7}).all()
+        db.session.execute(text("SELECT pg_sleep(0.03), :email AS email, :n AS n"),
+                           {"email": "someone@example.com", "n": 8}).all()
+        db.session.execute(text("SELECT 1")).all()
+        return 'ok'
+
+    client.get('/_slow_query')
+    slow_query_log.wait(timeout=10)
+    with open(app.config['SLOW_QUERY_LOG_PATH']) as f:
+        entries = [json.loads(line) for line in f]
+    entries = [entry for entry in entries if entry['endpoint'] == 'slow_query']
+    assert len(entries) == 2
+    explained = next(entry for entry in entries if entry['parameters']['n'] == 7)
+    assert explained['duration_ms'] >= 20
+    assert explained['parameters'] == {'email': '<str len=19>', 'n': 7}
+    assert 'actual time=' in explained['plan']
+    # Once per statement
+    repeated = next(entry for entry in entries if entry['parameters']['n'] == 8)
+    assert repeated['plan'] == 'skipped: explained recently'
+
+def test_redact():
+    """Test that only strings and bytes are hidden."""
+    assert redact([{'a': 'secret', 'b': b'xy', 'c': None, 'd': 1.5}]) == [
+        {'a': '<str len=6>', 'b': '<bytes len=2>', 'c': None, 'd': 1.5}
+    ]
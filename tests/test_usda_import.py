@@ -0,0 +1,112 @@
+"""Tests for the USDA importers: the concurrent API import against a local stub, and bulk dumps."""
+import io
+import json
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import pytest
+import requests
+from app import db
+from app.models import Food
+from app.usda import import_dump, import_foods, iter_json_array
+
+PAGES = 5
+
+class StubUSDA(BaseHTTPRequestHandler):
+    calories = 100
+    fail_pages = set()
+    requested = []
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        page, size = int(query['pageNumber'][0]), int(query['pageSize'][0])
+        self.requested.append(page)
+        if page in self.fail_pages:
+            self.send_response(500)
+            self.end_headers()
+            return
+        foods = [{
+            'fdcId': (page - 1) * size + i,
+            'description': f'Stub food {(page - 1) * size + i}',
+            'foodNutrients': [{'nutrientId': 1008, 'value': self.calories}, {'nutrientId': 1003, 'value': 2}],
+        } for i in range(size)]
+        if page == 2:
+            foods.append({'fdcId': 9999, 'description': 'No calories', 'foodNutrients': []})
+            foods.append({'fdcId': 9998, 'description': 'Stub food 0', 'foodNutrients': [{'nutrientId': 1008, 'value': 5}]})
+        body = json.dumps({'totalPages': PAGES, 'foods': foods}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def stub_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubUSDA)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    StubUSDA.calories, StubUSDA.fail_pages, StubUSDA.requested = 100, set(), []
+
+def test_import_resumes_and_upserts(app, stub_url, tmp_path):
+    """Test that an interrupted import resumes from its checkpoint and re-imports update in place."""
+    checkpoint = str(tmp_path / 'checkpoint.json')
+    StubUSDA.fail_pages = {4}
+    with pytest.raises(requests.RequestException):
+        import_foods(stub_url, 'key', workers=3, page_size=10, checkpoint_path=checkpoint, retries=0)
+    assert 4 not in json.load(open(checkpoint))['done']
+
+    StubUSDA.fail_pages, StubUSDA.requested = set(), []
+    stats = import_foods(stub_url, 'key', workers=3, page_size=10, checkpoint_path=checkpoint, retries=0)
+    assert 4 in StubUSDA.requested and 1 not in StubUSDA.requested
+    assert not (tmp_path / 'checkpoint.json').exists()
+    assert db.session.query(Food).count() == PAGES * 10
+    assert db.session.query(Food).filter_by(usda_id='9999').count() == 0  # no calories
+    assert db.session.query(Food).filter_by(usda_id='9998').count() == 0  # name taken
+
+    # A full refresh only rewrites rows whose values changed
+    stats = import_foods(stub_url, 'key', workers=3, page_size=10, checkpoint_path=checkpoint)
+    assert stats.pages == PAGES and stats.upserted == 0 and stats.skipped == 1
+    StubUSDA.calories = 120
+    stats = import_foods(stub_url, 'key', workers=3, page_size=10, checkpoint_path=checkpoint)
+    assert stats.upserted == PAGES * 10
+    db.session.expire_all()
+    assert {food.calories_per_100g for food in db.session.query(Food)} == {120}
+
+def _dump_food(fdc_id, description, calories):
+    return {'fdcId': fdc_id, 'description': description, 'dataType': 'SR Legacy',
+            'foodNutrients': [{'nutrient': {'id': 1008, 'number': '208'}, 'amount': calories},
+                              {'nutrient': {'id': 1004, 'number': '204'}, 'amount': 1.5}]}
+
+def test_iter_json_array_across_chunks():
+    """Test that dump objects split across read chunks are decoded whole."""
+    foods = [_dump_food(i, f'Food "{i}" [raw], {{x}}', i) for i in range(20)]
+    stream = io.StringIO(json.dumps({'SRLegacyFoods': foods}, indent=1))
+    assert list(iter_json_array(stream, chunk_size=7)) == foods
+    assert list(iter_json_array(io.StringIO('{"FoundationFoods": []}'))) == []
+
+def test_import_json_and_csv_dumps(app, tmp_path):
+    """Test importing a JSON dump and a zipped CSV dump through the staging table."""
+    dump = tmp_path / 'sr_legacy.json'
+    foods = [_dump_food(i, f'Dump food {i}', 50 + i) for i in range(1, 31)]
+    foods.append(_dump_food(99, 'Dump food 1', 10))  # name of another food
+    foods.append(_dump_food(98, 'No energy', 0))
+    dump.write_text(json.dumps({'SRLegacyFoods': foods}))
+    assert import_dump(str(dump)) == (30, 1)
+    assert import_dump(str(dump)) == (0, 1)
+    assert db.session.query(Food).filter_by(usda_id='5').one().fat_per_100g == 1.5
+
+    archive = tmp_path / 'csv.zip'
+    with zipfile.ZipFile(archive, 'w') as z:
+        z.writestr('FoodData_Central_csv/food.csv',
+                   'fdc_id,data_type,description\n5,sr_legacy_food,"Dump food 5, renamed"\n200,sr_legacy_food,New food\n')
+        z.writestr('FoodData_Central_csv/food_nutrient.csv',
+                   'id,fdc_id,nutrient_id,amount\n1,5,1008,70\n2,5,1003,3\n3,200,1008,12\n4,200,9999,1\n')
+    assert import_dump(str(archive)) == (2, 0)
+    renamed = db.session.query(Food).filter_by(usda_id='5').one()
+    assert (renamed.name, renamed.calories_per_100g, renamed.protein_per_100g) == ('Dump food 5, renamed', 70, 3)
+    assert db.session.query(Food).count() == 31